@@ -1,21 +1,42 @@
 import os
-import platform
-import warnings
-import collections
+import sys
 import numpy as np
-import webbrowser as wb
-from yattag import Doc
-from sklearn.cluster import KMeans
-from skimage import io, transform, color
-from utils import safe_mkdir, get_all_files, animate
+from PIL import Image
+from io import StringIO, BytesIO
+from utils import safe_mkdir, get_all_files, log_progress
+from common.image_io import check_image_array, open_image, reduce_image, raw_pixel_array, reduce_striped, text_writer, DEFAULT_MAX_BAND_BYTES
+from html_writer import ColourHTMLWriter, get_repeated_colours
+from ansi_writer import render_ansi
+from archive import write_archive, FILE_EXT as ARCHIVE_FILE_EXT
+from quantizers import get_quantizer
+from common.instrumentation import span
+
+
+def rgb_array(img):
+    '''
+    Purpose: Gives an image array the 3 RGB channels that images opened with PIL are converted to: greyscale channels are repeated
+             and an alpha channel is dropped (without a copy).
+    Inputs: img [np.ndarray]: uint8 (height, width) or (height, width, 1) greyscale, (height, width, 3) RGB or (height, width, 4) RGBA
+                              image (other dtypes raise ValueError, see common/image_io.check_image_array())
+    Returns: [np.ndarray] (height, width, 3)
+    '''
+    check_image_array(img)
+    if img.ndim == 3 and img.shape[2] in (3, 4):
+        return img[..., :3]
+    if img.ndim == 2 or (img.ndim == 3 and img.shape[2] == 1):
+        return np.repeat(img.reshape(img.shape[:2]+(1,)), 3, axis=2)
+    raise ValueError('Expected a (height, width) greyscale, (height, width, 3) RGB or (height, width, 4) RGBA image, got an array of shape {}.'.format(img.shape))
 
 
 class JPEGColourConverter(object):
-    def __init__(self, img_path, output_dir, line_height, font_size, h_stretch = 1.5, symbol = '#', max_size = (300,300), web_browser = None, background_colour = None):
+    def __init__(self, img_path, output_dir, line_height, font_size, h_stretch = 1.5, symbol = '#', max_size = (300,300), web_browser = None, background_colour = None, css_classes = False, save_file_name = None, fast_decode = True, max_band_bytes = DEFAULT_MAX_BAND_BYTES):
         '''
         Purpose: Converts an RGB image given in img_path to a np.array. Performs pooling on the img_array.
 
-        Inputs: img_path [STRING]: path to image file
+        Inputs: img_path [STRING]: path to image file. The image may also be given directly (without touching the filesystem) as a
+                                   uint8 np.ndarray ((height, width, 3) RGB, (height, width, 4) RGBA whose alpha is ignored, or (height, width)
+                                   greyscale), a PIL Image, a bytes-like object (bytes, bytearray, memoryview)
+                                   containing an encoded image, or a binary file object. Arrays and buffers are used without being copied.
                 max_size [TUPLE]: (max_height/rows, max_width/columns); a tuple containing the max          
                                   height/width (measured in terms of number of pixels/elements in np.array)
                 output_dir [STRING]: directory in which all generated HTML files will be saved
@@ -25,12 +46,32 @@ class JPEGColourConverter(object):
                 symbol [STRING]: symbol to be used for the ASCII image
                 web_browser [STRING]: the path to the desired web browser application. If this is None (i.e.                                            the default value), then the open_html_file() method will simply use the OS' default                              web_browser
                 background_colour [STRING]: sets the background colour of the HTML file. Must be a STRING, so only the basic HTML                             colour values are supported. You cannot input an RGB tuple here. If the default value                             of None is used, then the background_colour will be set to white. 
+                css_classes [BOOLEAN]: if True, colours that are used repeatedly are styled through CSS classes instead of inline styles,                             which makes the HTML file smaller. Defaults to False.
+                save_file_name [STRING]: name of the HTML file (without extension). Defaults to the name of the image file (or 'image' for in-memory images)
+                fast_decode [BOOLEAN]: if True, large images are decoded at a reduced scale and shrunk to about twice the output size
+                                       before the final resample (see common/image_io.reduce_image()), which saves most of the decode time and
+                                       memory. If False, the full-resolution image is resampled. Defaults to True.
+                max_band_bytes [INT]: with fast_decode, image files that store their pixels uncompressed (e.g. uncompressed TIFF,
+                                      PPM, BMP) are read and shrunk in horizontal bands of at most this many bytes (see
+                                      common/image_io.reduce_striped()), so memory use does not grow with the size of the image. The output is
+                                      the same as without bands.
         '''
-        #Original Image Attributes
+        #Miscellaneous Attributes
+        if save_file_name is None:
+            save_file_name = os.path.splitext(os.path.basename(img_path))[0] if isinstance(img_path, (str, os.PathLike)) else 'image'
+        self.save_file_name = save_file_name
+        self.output_dir = output_dir
+        self.full_save_file_path = os.path.join(self.output_dir, self.save_file_name)+'.html'
+        self.web_browser = web_browser
+
+        #Original Image Attributes (only the header of an image file is read here)
         self.img_path = img_path
-        self.img = io.imread(self.img_path)
-        self.img_height_original = self.img.shape[0]
-        self.img_width_original = self.img.shape[1]
+        if isinstance(self.img_path, np.ndarray):
+            self.img = rgb_array(self.img_path)
+            self.img_height_original, self.img_width_original = self.img.shape[:2]
+        else:
+            self.img = open_image(self.img_path)
+            self.img_width_original, self.img_height_original = self.img.size
         self.max_size = max_size
 
         #Resized Image Attributes
@@ -39,7 +80,23 @@ class JPEGColourConverter(object):
         self.resized_height = int(self.resize_ratio*self.img_height_original)
         self.resized_width = int(self.resize_ratio*self.img_width_original*self.h_stretch)
         self.resized_size = (self.resized_height, self.resized_width)
-        self.img = transform.resize(self.img, self.resized_size)
+        if not isinstance(self.img, np.ndarray):
+            with span('decode', image=self.save_file_name, pixels=self.img_height_original*self.img_width_original) as decode_span:
+                pixels = raw_pixel_array(self.img) if fast_decode and not isinstance(self.img_path, Image.Image) else None
+                if pixels is not None:
+                    decode_span.set(striped=True)
+                    self.img = reduce_striped(pixels, 'RGB', (self.resized_width, self.resized_height), max_band_bytes=max_band_bytes)
+                elif fast_decode:
+                    #Images given by the caller as PIL Images are not drafted, as Image.draft() would change them
+                    self.img = reduce_image(self.img, 'RGB', (self.resized_width, self.resized_height), draft=not isinstance(self.img_path, Image.Image))
+                elif self.img.mode != 'RGB':
+                    self.img = self.img.convert('RGB')
+                self.img = np.asarray(self.img)
+        #Resamples in float32 (half the memory of the float64 default). skimage.transform (and scipy with it) is only imported
+        #here, when the first image is resized, so that importing this module stays cheap.
+        from skimage import transform, img_as_float32
+        with span('resize', image=self.save_file_name, pixels=self.resized_height*self.resized_width):
+            self.img = transform.resize(img_as_float32(self.img), self.resized_size)
 
         #HTML Output Attributes
         self.symbol = symbol
@@ -48,46 +105,90 @@ class JPEGColourConverter(object):
         if background_colour:
             self.background_colour = background_colour
         else: self.background_colour = 'white'
+        self.css_classes = css_classes
 
-        #Miscellaneous Attributes
-        self.save_file_name = os.path.splitext(os.path.basename(self.img_path))[0]
-        self.output_dir = output_dir
-        self.full_save_file_path = os.path.join(self.output_dir, self.save_file_name)+'.html'
-        self.web_browser = web_browser
-
-        #Initialisation of yattag module
-        self.doc, self.tag, self.text = Doc().tagtext()
 
     def convert_to_colour_html(self):
-        if self.background_colour: 
-            with self.tag('body', style='background-color:{}'.format(self.background_colour)):
-                for i in range(self.resized_height): #Iterates through the rows
-                    rgb_colour_row = []
-                    row = self.img[i]
-                    for j in range(self.resized_width): #Iterates through the columns
-                        rgb_colour_pixel = tuple(map(int, row[j] * 255))
-                        rgb_colour_row.append(rgb_colour_pixel)
-                    self._write_html_line(rgb_colour_row)
-
-    def _write_html_line(self, rgb_colour_row):
-        with self.tag('text', style='white-space:PRE;line-height:{};font-size:{}px'.format(self.line_height, self.font_size)):
-            for i in range(len(rgb_colour_row)):
-                colour = rgb_colour_row[i]
-                with self.tag('span', style='color:rgb{}'.format(colour)):
-                    self.text('{}'.format(self.symbol))
-        self.doc.stag('br')
+        #Quantises the whole (float) image to uint8 RGB values in one pass. Truncation matches int(value * 255).
+        with span('extract', image=self.save_file_name, pixels=self.resized_height*self.resized_width):
+            rgb_img = self.img * 255
+            if rgb_img.ndim == 2: #Greyscale image
+                rgb_img = np.repeat(rgb_img[..., np.newaxis], 3, axis=2)
+            self.rgb_img = rgb_img[..., :3].astype(np.uint8)
+
+    def write_html(self, f):
+        '''
+        Purpose: Streams the HTML document to the file object f (text or binary) row by row (see ColourHTMLWriter). convert_to_colour_html() must be called first.
+        '''
+        with span('serialize', image=self.save_file_name, format='html', pixels=self.resized_height*self.resized_width) as serialize_span, text_writer(f) as f:
+            colour_classes = get_repeated_colours(self.rgb_img) if self.css_classes else None
+            writer = ColourHTMLWriter(serialize_span.count_writes(f), self.symbol, self.line_height, self.font_size, self.background_colour, colour_classes)
+            writer.write_header()
+            for rgb_row in self.rgb_img:
+                writer.write_row(rgb_row)
+            writer.write_footer()
+
+    def to_html(self):
+        f = StringIO()
+        self.write_html(f)
+        return f.getvalue()
+
+    def write_ansi(self, f, colour_mode='truecolor', half_blocks=False):
+        '''
+        Purpose: Writes the image to the file object f (text or binary) as text coloured with ANSI escape sequences (see
+                 ansi_writer.render_ansi()), in a single write. convert_to_colour_html() must be called first.
+        Inputs: colour_mode [STRING]: 'truecolor' (24-bit colour) or '256' (xterm 256-colour palette)
+                half_blocks [BOOLEAN]: if True, every character shows two rows of pixels (use an h_stretch of about 1, as the pixels are then about square)
+        '''
+        with span('serialize', image=self.save_file_name, format='ansi', colour_mode=colour_mode, half_blocks=half_blocks, pixels=self.resized_height*self.resized_width) as serialize_span, text_writer(f) as f:
+            serialize_span.count_writes(f).write(render_ansi(self.rgb_img, self.symbol, colour_mode, half_blocks))
+
+    def to_ansi(self, colour_mode='truecolor', half_blocks=False):
+        return render_ansi(self.rgb_img, self.symbol, colour_mode, half_blocks)
+
+    def print_to_terminal(self, colour_mode='truecolor', half_blocks=False, f=None):
+        '''
+        Purpose: Displays the image in the terminal (sys.stdout, or the file object f), without a web browser (see write_ansi()).
+        '''
+        f = sys.stdout if f is None else f
+        self.write_ansi(f, colour_mode, half_blocks)
+        f.flush()
     
     def save_html_file(self):
         with open(self.full_save_file_path, 'w') as f:
-            f.write(self.doc.getvalue())
+            self.write_html(f)
+
+    def write_archive(self, f, compression='zlib'):
+        '''
+        Purpose: Writes the image to the binary file object f as a compact archive (the colour of every character, as palette indices
+                 if there are at most 256 colours, e.g. after clustering, compressed in chunks of rows; see archive.py), from which
+                 archive.ArchiveReader renders any range of rows as HTML or ANSI-coloured text. convert_to_colour_html() must be called first.
+        Inputs: compression [STRING]: 'zlib', 'lzma', 'zstd' (needs the zstandard package) or 'none'
+        '''
+        with span('serialize', image=self.save_file_name, format='archive', compression=compression, pixels=self.resized_height*self.resized_width) as serialize_span:
+            render = {'line_height': self.line_height, 'font_size': self.font_size, 'background_colour': self.background_colour, 'css_classes': self.css_classes}
+            serialize_span.set(bytes_written=write_archive(f, [self.symbol], self.rgb_img, render=render, compression=compression))
+
+    def to_archive(self, compression='zlib'):
+        f = BytesIO()
+        self.write_archive(f, compression)
+        return f.getvalue()
+
+    def save_archive_file(self, compression='zlib'):
+        '''
+        Purpose: Saves the archive (see write_archive()) next to the HTML file, as <save_file_name>.asca in output_dir.
+        '''
+        with open(os.path.join(self.output_dir, self.save_file_name)+ARCHIVE_FILE_EXT, 'wb') as f:
+            self.write_archive(f, compression)
     
     def open_html_file(self):
+        import webbrowser as wb
         if self.web_browser:
             wb.get(using=self.web_browser).open('file://'+os.path.realpath(self.full_save_file_path))
         else:
             wb.open('file://'+os.path.realpath(self.full_save_file_path))
     
-    @animate
+    @log_progress
     def convert_save_open(self, open=False):
         self.convert_to_colour_html()
         self.save_html_file()
@@ -95,20 +196,32 @@ class JPEGColourConverter(object):
             self.open_html_file()
 
 class JPEGClusterColourConverter(JPEGColourConverter):
-    def __init__(self, img_path, output_dir, line_height, font_size, h_stretch = 1.5, symbol = '#', max_size = (300,300), web_browser=None, background_colour=None, num_clusters=8):
-        super().__init__(img_path, output_dir, line_height, font_size, h_stretch, symbol, max_size, web_browser, background_colour)
+    def __init__(self, img_path, output_dir, line_height, font_size, h_stretch = 1.5, symbol = '#', max_size = (300,300), web_browser=None, background_colour=None, num_clusters=8, css_classes=False, quantizer='kmeans', init_centroids=None, save_file_name=None, fast_decode=True, max_band_bytes=DEFAULT_MAX_BAND_BYTES):
+        '''
+        Purpose: Reduces the colours of the image to num_clusters colours before it is converted (see JPEGColourConverter for the other inputs).
+        Inputs: num_clusters [INT]: number of colours
+                quantizer [STRING] or quantizer object: 'kmeans' (full KMeans fit, the default), 'minibatch' (MiniBatchKMeans on a pixel
+                                                        subsample), 'histogram' (NumPy k-means on a colour histogram), 'median_cut' or
+                                                        'octree' (PIL Image.quantize). See quantizers.py.
+                init_centroids [np.array]: (num_clusters, 3) centroids to warm-start the fit with (e.g. from a fit with more clusters,
+                                           see quantizers.warm_start_centroids()). Ignored by the PIL quantizers.
+        '''
+        super().__init__(img_path, output_dir, line_height, font_size, h_stretch, symbol, max_size, web_browser, background_colour, css_classes, save_file_name, fast_decode, max_band_bytes)
         self.num_clusters = num_clusters
-        self.image_segmentation()
+        self.quantizer = get_quantizer(quantizer)
+        self.image_segmentation(init_centroids)
 
         #Update Parent Class' Miscellaneous Attributes
         self.file_name_suffix = '_n_cluster_{}'.format(num_clusters)
         self.save_file_name = self.save_file_name+self.file_name_suffix
         self.full_save_file_path = os.path.join(self.output_dir, self.save_file_name)+'.html'
 
-    def image_segmentation(self):
-        X = self.img.reshape(-1, 3)
-        kmeans = KMeans(n_clusters=self.num_clusters).fit(X)
-        self.img = kmeans.cluster_centers_[kmeans.labels_].reshape(self.img.shape)
+    def image_segmentation(self, init_centroids=None):
+        #self.quantization holds the centroids, labels, fit time and quantization error
+        with span('quantize', image=self.save_file_name, pixels=self.resized_height*self.resized_width, quantizer=getattr(self.quantizer, 'name', type(self.quantizer).__name__), num_clusters=self.num_clusters, warm_start=init_centroids is not None) as quantize_span:
+            self.quantization = self.quantizer.quantize(self.img, self.num_clusters, init_centroids)
+            quantize_span.set(quantization_error=self.quantization.error)
+        self.img = self.quantization.img
     
 
         
@@ -127,37 +240,33 @@ if __name__ == '__main__':
     #Parameters (JPEG Cluster Colour Converter)
     output_dir_cluster = './GeneratedHTML/Clusters'
     num_clusters = [5, 10, 15]
+    quantizer = 'histogram' #'kmeans', 'minibatch', 'histogram', 'median_cut' or 'octree' (see quantizers.py)
+    warm_start = True #Warm-start each num_clusters fit from the previous (larger) one
 
-    #Path to Google Chrome Application
-    chrome_path_mac = 'open -a /Applications/Google\ Chrome.app %s'
-    chrome_path_windows = 'C:/Program Files (x86)/Google/Chrome/Application/chrome.exe %s'
-    if platform.system() == 'Darwin':
-        web_browser_path = chrome_path_mac
-    elif platform.system() == 'Windows':
-        web_browser_path = chrome_path_windows
-
-    #Running of Main Code Body with Warning Suppression
-    with warnings.catch_warnings():
-        warnings.simplefilter('ignore')
-        safe_mkdir(output_dir)
-        safe_mkdir(output_dir_cluster)
-
-        #JPEG Colour Converter
-        print('WITHOUT CLUSTERING: Converting image files to ASCII HTML files now.')
-        for file_name in get_all_files(input_dir, file_ext='.jpg'):
-            img_obj = JPEGColourConverter(img_path=file_name, output_dir=output_dir, line_height=line_height, font_size=font_size, h_stretch=h_stretch, symbol=symbol, max_size=max_size, web_browser=web_browser_path, background_colour=background_colour)
-            img_obj.convert_save_open(open=False, loading_name=img_obj.save_file_name)
-        print('Conversion completed.')
-
-        #JPEG Cluster Colour Converter
-        print('WITH CLUSTERING: Converting image files to ASCII HTML files now.')
-        for num_cluster in num_clusters:
-            for file_name in get_all_files(input_dir, file_ext='.jpg'):
-                img_obj = JPEGClusterColourConverter(img_path=file_name, output_dir=output_dir_cluster, line_height=line_height, font_size=font_size, h_stretch=h_stretch, symbol=symbol, max_size=max_size, web_browser=web_browser_path, background_colour=background_colour, num_clusters=num_cluster)
-                img_obj.convert_save_open(open=False, loading_name=img_obj.save_file_name)
-        print('Conversion completed.')
-
-            
-
-
+    #Parameters (Batch Conversion)
+    workers = None #Number of worker processes (None uses every CPU)
 
+    #Converts every image without clustering, then with each value in num_clusters (in parallel, see batch.py). Outputs of
+    #unchanged images are copied from the output cache.
+    import batch
+    import logging
+    from common.output_cache import OutputCache
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    cache = OutputCache(batch.DEFAULT_CACHE_DIR, version=batch.CACHE_VERSION)
+    print('Converting image files to ASCII HTML files now.')
+    results = batch.convert_directory(input_dir=input_dir,
+                                      output_dir=output_dir,
+                                      output_dir_cluster=output_dir_cluster,
+                                      num_clusters=num_clusters,
+                                      workers=workers,
+                                      quantizer=quantizer,
+                                      warm_start=warm_start,
+                                      line_height=line_height,
+                                      font_size=font_size,
+                                      h_stretch=h_stretch,
+                                      symbol=symbol,
+                                      max_size=max_size,
+                                      background_colour=background_colour,
+                                      cache=cache)
+    batch.report(results, cache)
+    print('Conversion completed.')
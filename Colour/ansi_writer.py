@@ -0,0 +1,114 @@
+import numpy as np
+from html_writer import pack_rgb
+
+COLOUR_MODES = ('truecolor', '256')
+RESET = '\x1b[0m'
+#Upper half block: its foreground colour fills the top half of the cell, and its background colour the bottom half
+HALF_BLOCK = '▀'
+#Escape sequences (and parts of them) of every colour, looked up with the channel values or palette indices: SGR 38 sets the
+#foreground colour and SGR 48 the background colour, e.g. '\x1b[38;2;' + '255;' + '128;' + '0m' or '\x1b[48;5;208m'
+LAYERS = ('38', '48')
+TRUECOLOR_PREFIXES = {layer: np.array(['\x1b[{};2;{};'.format(layer, value) for value in range(256)], dtype=object) for layer in LAYERS}
+SEMICOLON_DECIMALS = np.array(['{};'.format(value) for value in range(256)], dtype=object)
+DECIMALS_M = np.array(['{}m'.format(value) for value in range(256)], dtype=object)
+PALETTE_ESCAPES = {layer: np.array(['\x1b[{};5;{}m'.format(layer, value) for value in range(256)], dtype=object) for layer in LAYERS}
+#Escape sequences that restore the default foreground (39) or background (49) colour of the terminal
+DEFAULT_ESCAPES = {'38': '\x1b[39m', '48': '\x1b[49m'}
+#Channel levels of the 6x6x6 colour cube of the 256-colour palette (colours 16-231), and the index of the nearest level to every
+#channel value
+CUBE_LEVELS = np.array([0, 95, 135, 175, 215, 255], dtype=np.int32)
+CUBE_INDEX = np.abs(np.arange(256)[:, np.newaxis] - CUBE_LEVELS).argmin(axis=1).astype(np.int32)
+
+
+def rgb_to_256(rgb_img):
+    '''
+    Purpose: Maps RGB colours to the nearest colour (least squared distance) of the xterm 256-colour palette: the 6x6x6 colour cube
+             (16-231) or the 24 greys (232-255). The 16 system colours (0-15) are not used, as every terminal theme sets them differently.
+    Inputs: rgb_img [np.array] of uint8: (..., 3) RGB values
+    Returns: [np.array] of uint8 palette indices with the shape of rgb_img without its last axis
+    '''
+    rgb = rgb_img.astype(np.int32)
+    cube = CUBE_INDEX[rgb_img]
+    cube_error = ((CUBE_LEVELS[cube] - rgb)**2).sum(axis=-1)
+    #The nearest grey (8, 18, ..., 238) is the one nearest to the mean of the channels
+    grey = np.clip((rgb.sum(axis=-1) - 9)//30, 0, 23)
+    grey_error = (((8 + 10*grey)[..., np.newaxis] - rgb)**2).sum(axis=-1)
+    cube_colours = 16 + 36*cube[..., 0] + 6*cube[..., 1] + cube[..., 2]
+    return np.where(grey_error < cube_error, 232 + grey, cube_colours).astype(np.uint8)
+
+def _colour_escapes(colours, colour_mode, layer):
+    '''
+    Purpose: Escape sequences that set the foreground (layer '38') or background (layer '48') colour to each of colours.
+    Inputs: colours [np.array] of int: packed RGB colours (see pack_rgb()) in 'truecolor' mode, palette indices in '256' mode, or -1
+                                       for the default colour of the terminal
+    Returns: [np.array] of [STRINGS] (dtype object)
+    '''
+    if colour_mode == '256':
+        escapes = PALETTE_ESCAPES[layer][colours & 255]
+    else:
+        escapes = TRUECOLOR_PREFIXES[layer][(colours >> 16) & 255] + SEMICOLON_DECIMALS[(colours >> 8) & 255] + DECIMALS_M[colours & 255]
+    default = colours < 0
+    if default.any():
+        escapes[default] = DEFAULT_ESCAPES[layer]
+    return escapes
+
+def _changed_escapes(colours, changed, colour_mode, layer):
+    #Escape sequence of every run start: the colour's if it changed, else an empty string
+    escapes = np.full(len(colours), '', dtype=object)
+    escapes[changed] = _colour_escapes(colours[changed], colour_mode, layer)
+    return escapes
+
+def _changes(colours):
+    #True for every cell whose colour differs from the cell to its left (and for the first cell of every row)
+    changed = np.ones(colours.shape, dtype=bool)
+    np.not_equal(colours[:, 1:], colours[:, :-1], out=changed[:, 1:])
+    return changed
+
+def render_ansi(rgb_img, symbol='#', colour_mode='truecolor', half_blocks=False):
+    '''
+    Purpose: Renders an RGB image as text coloured with ANSI escape sequences, for display in a terminal. A colour escape is only
+             emitted where the colour differs from the previous cell of the row, and every row ends with a reset, so the colours
+             do not spill into the rest of the line. The whole image is built with a few NumPy operations over the runs of cells of
+             the same colour, then joined once.
+    Inputs: rgb_img [np.array] of uint8: (height, width, 3) RGB image
+            symbol [STRING]: symbol of every cell (coloured with the foreground colour). Ignored with half_blocks.
+            colour_mode [STRING]: 'truecolor' (24-bit colour) or '256' (the nearest colour of the xterm 256-colour palette, for
+                                  terminals without 24-bit colour; see rgb_to_256())
+            half_blocks [BOOLEAN]: if True, every cell shows two pixels, one above the other, as an upper half block whose
+                                   foreground is the top pixel and background the bottom pixel, so (height+1)//2 rows are output.
+                                   Terminal cells are about twice as tall as they are wide, so the pixels are then about square.
+    Returns: [STRING] rows of coloured text, each ending with a newline
+    '''
+    if colour_mode not in COLOUR_MODES:
+        raise ValueError('Unknown colour mode {}. Choose from {}.'.format(colour_mode, COLOUR_MODES))
+    colours = (rgb_to_256(rgb_img) if colour_mode == '256' else pack_rgb(rgb_img)).astype(np.int32)
+    if half_blocks:
+        symbol = HALF_BLOCK
+        if len(colours) % 2:
+            #The bottom half of the last row keeps the default background
+            colours = np.concatenate([colours, np.full((1, colours.shape[1]), -1, dtype=np.int32)])
+        foreground, background = colours[0::2], colours[1::2]
+    else:
+        foreground, background = colours, None
+    height, width = foreground.shape
+    if not height or not width:
+        return ''
+
+    #Runs of cells whose colours (both colours, with half blocks) do not change. Every row starts a run.
+    foreground_changed = _changes(foreground).ravel()
+    changed = foreground_changed
+    if background is not None:
+        background_changed = _changes(background).ravel()
+        changed = foreground_changed | background_changed
+    starts = np.flatnonzero(changed)
+    lengths = np.diff(np.append(starts, height*width))
+
+    #Escape sequence(s) at the start of every run, setting only the colour(s) that changed
+    symbol_runs = np.array([symbol*length for length in range(width+1)], dtype=object)
+    pieces = _changed_escapes(foreground.ravel()[starts], foreground_changed[starts], colour_mode, '38') + symbol_runs[lengths]
+    if background is not None:
+        pieces = _changed_escapes(background.ravel()[starts], background_changed[starts], colour_mode, '48') + pieces
+    #Last run of every row
+    row_ends = np.searchsorted(starts, np.arange(1, height+1)*width) - 1
+    pieces[row_ends] += RESET + '\n'
+    return ''.join(pieces.tolist())
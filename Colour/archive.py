@@ -0,0 +1,151 @@
+import sys
+import argparse
+import numpy as np
+from io import StringIO
+from common.image_io import text_writer
+from common.archive import ArchiveReader as _ArchiveReader, DEFAULT_ROWS_PER_CHUNK, FILE_EXT, write_chunks
+from html_writer import ColourHTMLWriter, get_repeated_colours, pack_rgb
+from ansi_writer import render_ansi, COLOUR_MODES
+
+#Archive of colour ASCII art (.asca), in the container of common/archive.py (in the repository root). The header also holds the colour
+#plane ('palette' with its palette, or 'rgb') and the settings needed to render the HTML document. Each chunk holds rows_per_chunk
+#rows of
+#    - symbol indices (one uint8 per character), omitted if there is only one symbol
+#    - palette indices (one uint8 per character) if the image has at most 256 colours (e.g. after clustering), else the red, green
+#      and blue planes one after the other, each stored as the difference from the pixel to its left (mod 256, as in PNG's Sub
+#      filter), which compresses much better than the colours themselves
+
+
+def encode_colours(rgb_img):
+    '''
+    Purpose: Indexes the colours of an image with a palette if it has at most 256 colours (e.g. after clustering).
+    Inputs: rgb_img [np.array] of uint8: (height, width, 3) RGB image
+    Returns: [TUPLE] (palette [np.array] of uint8, (colours, 3); palette indices [np.array] of uint8, (height, width)), or
+             (None, None) if the image has more than 256 colours
+    '''
+    colours, indices = np.unique(pack_rgb(rgb_img), return_inverse=True)
+    if len(colours) > 256:
+        return None, None
+    palette = np.stack([colours >> 16, colours >> 8, colours], axis=-1).astype(np.uint8)
+    return palette, indices.reshape(rgb_img.shape[:2]).astype(np.uint8)
+
+def write_archive(f, symbols, rgb_img, symbol_indices=None, render=None, compression='zlib', rows_per_chunk=DEFAULT_ROWS_PER_CHUNK):
+    '''
+    Purpose: Writes colour ASCII art to the binary file object f as an archive.
+    Inputs: symbols [LIST] of [STRINGS]: symbol table (at most 256 symbols)
+            rgb_img [np.array] of uint8: (rows, columns, 3) colour of every character
+            symbol_indices [np.array] of uint8: (rows, columns) index in symbols of every character. Not needed with one symbol.
+            render [DICT]: settings used to render the HTML document (line_height, font_size, background_colour, css_classes)
+            compression [STRING]: 'zlib' (the default), 'lzma' (smaller, slower), 'zstd' (needs the zstandard package) or 'none'
+            rows_per_chunk [INT]: number of rows compressed together (the unit of lazy decoding)
+    Returns: [INT] number of bytes written
+    '''
+    height, width = rgb_img.shape[:2]
+    palette, palette_indices = encode_colours(rgb_img)
+    if palette is None:
+        #Sub filter: every colour is stored as the difference from the colour to its left
+        planes = np.moveaxis(rgb_img, -1, 0)
+        filtered = planes.copy()
+        np.subtract(planes[..., 1:], planes[..., :-1], out=filtered[..., 1:])
+    payloads = []
+    for start in range(0, height, rows_per_chunk):
+        stop = start + rows_per_chunk
+        payload = symbol_indices[start:stop].tobytes() if len(symbols) > 1 else b''
+        payload += palette_indices[start:stop].tobytes() if palette is not None else filtered[:, start:stop].tobytes()
+        payloads.append(payload)
+    header = {'width': width, 'height': height, 'symbols': list(symbols), 'colour': 'rgb' if palette is None else 'palette',
+              'palette': None if palette is None else palette.tolist(), 'rows_per_chunk': rows_per_chunk, 'render': render or {}}
+    return write_chunks(f, header, payloads, compression)
+
+
+class ArchiveReader(_ArchiveReader):
+    def __init__(self, source):
+        '''
+        Purpose: Reads an archive lazily: only the header is read here, and read_rows() (and the renderers built on it) read and
+                 decompress only the chunks that hold the rows asked for.
+        Inputs: source: path of the archive, a bytes-like object containing it, or a binary file object (seekable)
+        '''
+        super().__init__(source)
+        self.palette = np.array(self.header['palette'], dtype=np.uint8) if self.header['colour'] == 'palette' else None
+
+    def _check_header(self, header):
+        if header.get('colour') is None:
+            raise ValueError('The archive has no colours (it was written by the Monochrome converter).')
+
+    def _decode_chunk(self, i, num_rows):
+        #(symbol indices, RGB colours) of the rows of chunk i
+        payload = np.frombuffer(self._payload(i), dtype=np.uint8)
+        num_cells = num_rows*self.width
+        if len(self.symbols) > 1:
+            symbol_indices, payload = payload[:num_cells].reshape(num_rows, self.width), payload[num_cells:]
+        else:
+            symbol_indices = np.zeros((num_rows, self.width), dtype=np.uint8)
+        if self.palette is not None:
+            rgb = self.palette[payload.reshape(num_rows, self.width)]
+        else:
+            #Undoes the Sub filter (the running sum wraps around mod 256 like the differences)
+            rgb = np.moveaxis(np.cumsum(payload.reshape(3, num_rows, self.width), axis=-1, dtype=np.uint8), 0, -1)
+        return symbol_indices, rgb
+
+    def read_rows(self, start=0, stop=None):
+        '''
+        Purpose: Decodes rows start to stop (excluded, as in a slice; stop=None reads to the last row).
+        Returns: [TUPLE] (symbol indices [np.array] of uint8 (rows, columns): index in self.symbols of every character,
+                          colours [np.array] of uint8 (rows, columns, 3): RGB colour of every character)
+        '''
+        chunks, rows = self._row_chunks(start, stop)
+        if not chunks:
+            return np.zeros((0, self.width), dtype=np.uint8), np.zeros((0, self.width, 3), dtype=np.uint8)
+        return np.concatenate([symbol_indices for symbol_indices, _ in chunks])[rows], np.concatenate([rgb for _, rgb in chunks])[rows]
+
+    def to_text(self, start=0, stop=None):
+        #The symbols without their colours
+        symbols = np.array(self.symbols, dtype=object)
+        return ''.join(''.join(row)+'\n' for row in symbols[self.read_rows(start, stop)[0]].tolist())
+
+    def to_html(self, start=0, stop=None):
+        '''
+        Purpose: HTML document of rows start to stop, as written by JPEGColourConverter (with a single symbol, as every converter writes).
+        '''
+        render = self.header['render']
+        _, rgb_img = self.read_rows(start, stop)
+        f = StringIO()
+        colour_classes = get_repeated_colours(rgb_img) if render.get('css_classes') else None
+        writer = ColourHTMLWriter(f, self.symbols[0], render.get('line_height', 1), render.get('font_size', 5), render.get('background_colour', 'white'), colour_classes)
+        writer.write_header()
+        for rgb_row in rgb_img:
+            writer.write_row(rgb_row)
+        writer.write_footer()
+        return f.getvalue()
+
+    def to_ansi(self, start=0, stop=None, colour_mode='truecolor', half_blocks=False):
+        '''
+        Purpose: Rows start to stop as text coloured with ANSI escape sequences (see ansi_writer.render_ansi()).
+        '''
+        return render_ansi(self.read_rows(start, stop)[1], self.symbols[0], colour_mode, half_blocks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Renders rows of a colour ASCII art archive (.asca) as text, HTML or ANSI-coloured text on standard output.')
+    parser.add_argument('archive_path')
+    parser.add_argument('--format', default='ansi', choices=['txt', 'html', 'ansi'])
+    parser.add_argument('--rows', type=int, nargs='+', default=[0], metavar=('START', 'STOP'), help='range of rows to render (STOP excluded). Without STOP, renders up to the last row.')
+    parser.add_argument('--colour-mode', default='truecolor', choices=COLOUR_MODES)
+    parser.add_argument('--half-blocks', action='store_true')
+    args = parser.parse_args(argv)
+    if len(args.rows) > 2:
+        parser.error('--rows takes START and an optional STOP, not {} values'.format(len(args.rows)))
+    rows = (args.rows+[None])[:2]
+
+    with ArchiveReader(args.archive_path) as reader:
+        if args.format == 'ansi':
+            output = reader.to_ansi(*rows, colour_mode=args.colour_mode, half_blocks=args.half_blocks)
+        else:
+            output = reader.to_html(*rows) if args.format == 'html' else reader.to_text(*rows)
+        with text_writer(sys.stdout) as f:
+            f.write(output)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,360 @@
+import os
+import time
+import logging
+import argparse
+import warnings
+import collections
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from JPEGConverter import JPEGColourConverter, JPEGClusterColourConverter
+from utils import safe_mkdir, get_all_files
+from quantizers import QUANTIZERS, get_quantizer, warm_started_fits
+from common.instrumentation import JSONLinesSink, set_sink
+from common.output_cache import OutputCache, hash_file, DEFAULT_MAX_BYTES
+from common.watcher import DirectoryWatcher, remove_outputs
+
+logger = logging.getLogger(__name__)
+
+#Output cache of this converter (see common/output_cache.py). CACHE_VERSION is bumped whenever a change to the converter changes its
+#output, so that entries written by older versions are never hit.
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'output_cache')
+CACHE_VERSION = 1
+
+#cached is True if the HTML file was copied from the output cache instead of being converted (quantization_time and
+#quantization_error are then None)
+BatchResult = collections.namedtuple('BatchResult', ['img_path', 'num_clusters', 'full_save_file_path', 'error', 'quantization_time', 'quantization_error', 'cached'], defaults=(False,))
+
+#OutputCache shared by every job running in this (worker) process. Set once by _init_worker().
+_worker_cache = None
+
+
+def _init_worker(trace_path=None, cache=None):
+    global _worker_cache
+    _worker_cache = cache
+    if trace_path is not None:
+        set_sink(JSONLinesSink(trace_path))
+
+def _save_file_path(img_path, num_clusters, output_dir, settings):
+    #Path of the HTML file JPEGColourConverter (or JPEGClusterColourConverter) saves
+    save_file_name = settings.get('save_file_name') or os.path.splitext(os.path.basename(img_path))[0]
+    if num_clusters is not None:
+        save_file_name += '_n_cluster_{}'.format(num_clusters)
+    return os.path.join(output_dir, save_file_name)+'.html'
+
+def _cache_keys(cache, input_hash, num_clusters, settings):
+    '''
+    Purpose: Cache key of every output of a job (see _convert_one()). Clustered outputs also depend on the values they were
+             warm-started from (the larger values of the job).
+    Returns: [DICT] of {num_cluster (None without clustering): key}
+    '''
+    params = {name: value for name, value in settings.items() if name not in ('save_file_name', 'max_band_bytes')}
+    if num_clusters is None:
+        return {None: cache.key(input_hash, params)}
+    return {num_cluster: cache.key(input_hash, dict(params, num_clusters=num_cluster, warm_start_from=sorted(value for value in num_clusters if value > num_cluster)))
+            for num_cluster in num_clusters}
+
+def _from_cache(cache, job, keys):
+    '''
+    Purpose: Looks up every output of job in cache (one hit or miss per job), and saves them if they are all cached. An output that
+             cannot be saved is reported in its BatchResult, as _convert_one() does.
+    Returns: [LIST] of BatchResult (one per output, as _convert_one()) on a hit, else None
+    '''
+    img_path, num_clusters, output_dir, settings = job
+    all_outputs = cache.get_all(keys.values())
+    if all_outputs is None:
+        return None
+    results = []
+    for num_cluster, outputs in zip(keys, all_outputs):
+        full_save_file_path = _save_file_path(img_path, num_cluster, output_dir, settings)
+        try:
+            with open(full_save_file_path, 'w') as f:
+                f.write(outputs['html'])
+        except Exception:
+            results.append(BatchResult(img_path, num_cluster, full_save_file_path, traceback.format_exc(), None, None))
+            continue
+        results.append(BatchResult(img_path, num_cluster, full_save_file_path, None, None, None, True))
+    return results
+
+def _convert_one(job):
+    '''
+    Purpose: Converts a single image to colour ASCII HTML file(s). Any exception is caught and reported in the returned
+             BatchResult, so that one bad image does not abort the rest of the batch.
+    Inputs: job [TUPLE]: (img_path, num_clusters, output_dir, settings, keys). If num_clusters is None, JPEGColourConverter is used.
+                         Else num_clusters is a [TUPLE] of [INTS], and JPEGClusterColourConverter is used once for each value. The values
+                         are fitted from the largest down, each warm-started from the previous fit. settings is a [DICT] of keyword
+                         arguments for the converter. If keys is not None (see _cache_keys()), every output is also stored in the
+                         output cache of this process.
+    Returns: [LIST] of BatchResult, one per value in num_clusters (in the same order)
+    '''
+    img_path, num_clusters, output_dir, settings, keys = job
+    keys = keys if _worker_cache is not None else None
+    if num_clusters is None:
+        return [_convert(img_path, None, output_dir, settings, key=keys and keys[None])[0]]
+
+    def fit(num_cluster, init_centroids):
+        result, img_obj = _convert(img_path, num_cluster, output_dir, settings, init_centroids, keys and keys[num_cluster])
+        return result, img_obj and img_obj.quantization
+    results = warm_started_fits(num_clusters, get_quantizer(settings.get('quantizer', 'kmeans')), fit)
+    return [results[num_cluster] for num_cluster in num_clusters]
+
+def _convert(img_path, num_clusters, output_dir, settings, init_centroids=None, key=None):
+    '''
+    Purpose: Converts and saves one image. If num_clusters is None, JPEGColourConverter is used, else JPEGClusterColourConverter.
+             If key is not None, the HTML document is also stored under key in the output cache of this process.
+    Returns: [TUPLE] (BatchResult, converter object or None if the conversion failed)
+    '''
+    full_save_file_path = None
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            if num_clusters is None:
+                img_obj = JPEGColourConverter(img_path=img_path, output_dir=output_dir, **settings)
+            else:
+                img_obj = JPEGClusterColourConverter(img_path=img_path, output_dir=output_dir, num_clusters=num_clusters, init_centroids=init_centroids, **settings)
+            full_save_file_path = img_obj.full_save_file_path
+            img_obj.convert_to_colour_html()
+            if key is None:
+                img_obj.save_html_file()
+            else:
+                html = img_obj.to_html()
+                with open(img_obj.full_save_file_path, 'w') as f:
+                    f.write(html)
+                _worker_cache.put(key, {'html': html})
+    except Exception:
+        return BatchResult(img_path, num_clusters, full_save_file_path, traceback.format_exc(), None, None), None
+    quantization = getattr(img_obj, 'quantization', None)
+    if quantization is None:
+        return BatchResult(img_path, num_clusters, full_save_file_path, None, None, None), img_obj
+    return BatchResult(img_path, num_clusters, full_save_file_path, None, quantization.time, quantization.error), img_obj
+
+def convert_batch(jobs, workers=None, trace_path=None, cache=None, executor=None):
+    '''
+    Purpose: Runs every (img_path, num_clusters, output_dir, settings) job over a pool of worker processes. If a cache is given,
+             jobs whose outputs are all cached are not run (and no worker is started if every job is cached).
+    Inputs: jobs [LIST] of [TUPLES]: see _convert_one()
+            workers [INT]: number of worker processes. If None, uses the number of CPUs. If 1, runs in the current process.
+            trace_path [STRING]: if given, the spans of every stage of every conversion (see common/instrumentation.py) are appended to this
+                                 JSON-lines file by every process
+            cache [OutputCache]: cache of HTML documents, looked up by image content and settings (see common/output_cache.py). Outputs
+                                 of the jobs that are run are added to it, and its least recently used entries are then evicted.
+            executor [ProcessPoolExecutor]: pool (whose workers were initialised by _init_worker() with the same trace_path and cache)
+                                            to run the jobs in, instead of a pool started for this batch
+    Returns: [LIST] of BatchResult, in the same order as jobs
+    '''
+    job_results = [None]*len(jobs)
+    pending_jobs = []
+    input_hashes = {}
+    for i, job in enumerate(jobs):
+        keys = None
+        if cache is not None:
+            img_path, num_clusters = job[:2]
+            try:
+                if img_path not in input_hashes:
+                    input_hashes[img_path] = hash_file(img_path)
+                keys = _cache_keys(cache, input_hashes[img_path], num_clusters, job[3])
+                job_results[i] = _from_cache(cache, job, keys)
+            except OSError:
+                #Run (and reported) as usual
+                keys = None
+        if job_results[i] is None:
+            pending_jobs.append((i, tuple(job)+(keys,)))
+
+    if executor is not None and pending_jobs:
+        pending_results = list(executor.map(_convert_one, [job for _, job in pending_jobs]))
+    elif workers == 1 or not pending_jobs:
+        _init_worker(cache=cache)
+        if trace_path is not None:
+            sink = JSONLinesSink(trace_path)
+            previous_sink = set_sink(sink)
+        try:
+            pending_results = [_convert_one(job) for _, job in pending_jobs]
+        finally:
+            if trace_path is not None:
+                set_sink(previous_sink)
+                sink.close()
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(trace_path, cache)) as executor:
+            pending_results = list(executor.map(_convert_one, [job for _, job in pending_jobs]))
+    for (i, _), results in zip(pending_jobs, pending_results):
+        job_results[i] = results
+    if cache is not None and pending_jobs:
+        cache.evict()
+    return [result for results in job_results for result in results]
+
+def convert_directory(input_dir, output_dir, output_dir_cluster=None, num_clusters=(), file_ext='.jpg', workers=None, quantizer='kmeans', warm_start=False, trace_path=None, cache=None, **settings):
+    '''
+    Purpose: Converts every image with file_ext in input_dir without clustering (saved in output_dir), and once more for each
+             value in num_clusters (saved in output_dir_cluster). All of these jobs share one pool of worker processes.
+    Inputs: quantizer [STRING]: clustering backend (see quantizers.py)
+            warm_start [BOOLEAN]: if True, all values in num_clusters are fitted in one job per image, each warm-started from the
+                                  centroids of the previous (larger) fit. If False, every (image, num_clusters) pair is a separate job.
+            trace_path [STRING], cache [OutputCache]: see convert_batch()
+            settings: remaining keyword arguments for JPEGColourConverter (line_height, font_size, h_stretch, symbol, max_size, ...)
+    Returns: [LIST] of BatchResult
+    '''
+    img_paths = sorted(get_all_files(input_dir, file_ext=file_ext))
+    safe_mkdir(output_dir)
+    if num_clusters:
+        safe_mkdir(output_dir_cluster)
+    jobs = _build_jobs(img_paths, output_dir, output_dir_cluster, num_clusters, quantizer, warm_start, settings)
+    return convert_batch(jobs, workers=workers, trace_path=trace_path, cache=cache)
+
+def _build_jobs(img_paths, output_dir, output_dir_cluster, num_clusters, quantizer, warm_start, settings):
+    #Jobs of convert_batch() for img_paths (see convert_directory())
+    jobs = [(img_path, None, output_dir, settings) for img_path in img_paths]
+    if num_clusters:
+        cluster_settings = dict(settings, quantizer=quantizer)
+        if warm_start:
+            jobs.extend((img_path, tuple(num_clusters), output_dir_cluster, cluster_settings) for img_path in img_paths)
+        else:
+            for num_cluster in num_clusters:
+                jobs.extend((img_path, (num_cluster,), output_dir_cluster, cluster_settings) for img_path in img_paths)
+    return jobs
+
+def watch_directory(input_dir, output_dir, output_dir_cluster=None, num_clusters=(), file_ext='.jpg', workers=None, quantizer='kmeans', warm_start=False, manifest_path=None, poll_interval=1.0, settle_time=2.0, full_scan_interval=60.0, max_scans=None, trace_path=None, cache=None, **settings):
+    '''
+    Purpose: Watches input_dir, converting images as they are added or changed (as convert_directory() does) and deleting the outputs
+             of deleted images, until interrupted (Ctrl+C). Only new and changed images are converted, as recorded in a persistent
+             manifest (see common/watcher.DirectoryWatcher), so a restart does not convert the directory again. The pool of worker
+             processes is kept for the whole watch. The results of every scan are printed with report().
+    Inputs: output_dir_cluster, num_clusters, quantizer, warm_start, workers, trace_path, cache: see convert_directory()
+            manifest_path [STRING]: manifest of the converted images. Defaults to .manifest.json in output_dir.
+            poll_interval [FLOAT]: seconds between scans
+            settle_time [FLOAT]: seconds an image must go unmodified (and unchanged since the previous scan) before it is converted
+            full_scan_interval [FLOAT]: seconds between full scans, which also find images overwritten in place (images replaced
+                                        by a rename are found by every scan). The first scan is always full. If None, only the first
+                                        scan is.
+            max_scans [INT]: number of scans before returning. If None, watches until interrupted.
+            settings: remaining keyword arguments for JPEGColourConverter (line_height, font_size, h_stretch, symbol, max_size, ...)
+    Returns: [INT] number of failed conversions
+    '''
+    safe_mkdir(output_dir)
+    if num_clusters:
+        safe_mkdir(output_dir_cluster)
+    if manifest_path is None:
+        manifest_path = os.path.join(output_dir, '.manifest.json')
+    watcher = DirectoryWatcher(input_dir, manifest_path, file_ext, settle_time,
+                               settings=dict(settings, output_dir=output_dir, output_dir_cluster=output_dir_cluster, num_clusters=list(num_clusters), quantizer=quantizer, warm_start=warm_start))
+    executor = None
+    if workers != 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(trace_path, cache))
+    logger.info('Watching %s (Ctrl+C to stop)...', input_dir)
+    num_failed = 0
+    num_scans = 0
+    last_full_scan = None
+    try:
+        while max_scans is None or num_scans < max_scans:
+            full = last_full_scan is None or (full_scan_interval is not None and time.monotonic()-last_full_scan >= full_scan_interval)
+            if full:
+                last_full_scan = time.monotonic()
+            ready, deleted = watcher.scan(full)
+            for output_paths in deleted:
+                logger.info('Image deleted: removed %d output(s) (%s)', remove_outputs(output_paths), ', '.join(output_paths))
+            if ready:
+                jobs = _build_jobs(ready, output_dir, output_dir_cluster, num_clusters, quantizer, warm_start, settings)
+                results = convert_batch(jobs, workers=workers, trace_path=trace_path, cache=cache, executor=executor)
+                #Every image has one result per output (with and without clustering)
+                outputs = {img_path: [] for img_path in ready}
+                failed = set()
+                for result in results:
+                    if result.error:
+                        failed.add(result.img_path)
+                    else:
+                        outputs[result.img_path].append(result.full_save_file_path)
+                for img_path in ready:
+                    watcher.record(img_path, outputs[img_path], failed=img_path in failed)
+                num_failed += report(results, cache)
+            watcher.save()
+            num_scans += 1
+            if max_scans is None or num_scans < max_scans:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.save()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return num_failed
+
+def report(results, cache=None):
+    '''
+    Purpose: Prints one line per result, the full traceback of every failed job and, if the OutputCache used for the batch is
+             given, its number of hits and misses. Returns the number of failed jobs.
+    '''
+    num_failed = 0
+    for result in results:
+        if result.error:
+            num_failed += 1
+            print('FAILED: {} (num_clusters={})\n{}'.format(result.img_path, result.num_clusters, result.error))
+        elif result.cached:
+            print('Cached: {}'.format(result.full_save_file_path))
+        elif result.quantization_time is not None:
+            print('Converted: {} (clustering: {:.3f} s, error: {:.5f})'.format(result.full_save_file_path, result.quantization_time, result.quantization_error))
+        else:
+            print('Converted: {}'.format(result.full_save_file_path))
+    print('{} of {} conversions completed.'.format(len(results)-num_failed, len(results)))
+    if cache is not None:
+        print('Output cache: {} hits, {} misses.'.format(cache.hits, cache.misses))
+    return num_failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Converts every image in a directory to colour ASCII art (.html), with and without clustering.')
+    parser.add_argument('--input-dir', default='./Images')
+    parser.add_argument('--output-dir', default='./GeneratedHTML')
+    parser.add_argument('--output-dir-cluster', default='./GeneratedHTML/Clusters')
+    parser.add_argument('--file-ext', default='.jpg')
+    parser.add_argument('--num-clusters', type=int, nargs='*', default=[5, 10, 15], help='number of clusters to convert each image with (none disables clustering)')
+    parser.add_argument('--quantizer', default='histogram', choices=sorted(QUANTIZERS), help='clustering backend')
+    parser.add_argument('--no-warm-start', dest='warm_start', action='store_false', help='fit every --num-clusters value of an image in a separate job, from scratch')
+    parser.add_argument('--line-height', type=float, default=1)
+    parser.add_argument('--font-size', type=int, default=5)
+    parser.add_argument('--h-stretch', type=float, default=1.5)
+    parser.add_argument('--symbol', default='#')
+    parser.add_argument('--max-size', type=int, nargs=2, default=(200, 200), metavar=('MAX_HEIGHT', 'MAX_WIDTH'))
+    parser.add_argument('--background-colour', default='black')
+    parser.add_argument('--css-classes', action='store_true', help='style repeated colours through CSS classes (smaller HTML files)')
+    parser.add_argument('--no-fast-decode', dest='fast_decode', action='store_false', help='resample the full-resolution image (slower, more memory)')
+    parser.add_argument('--max-band-size', type=int, default=64, metavar='MB', help='memory budget of each band of an uncompressed image (TIFF, PPM, BMP) read in bands')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (defaults to the number of CPUs)')
+    parser.add_argument('--trace', default=None, metavar='FILE', help='append a JSON line per conversion stage (timing, pixels, bytes written, clustering) to FILE')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='directory of the output cache (outputs of unchanged images are copied from it)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES >> 20, metavar='MB', help='size limit of the output cache, in MB (least recently used outputs are evicted)')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help='convert every image, without reading or writing the output cache')
+    parser.add_argument('--watch', action='store_true', help='keep watching --input-dir, converting images as they are added or changed and deleting the outputs of deleted images (Ctrl+C to stop)')
+    parser.add_argument('--manifest', default=None, metavar='FILE', help='manifest of the images converted by --watch (defaults to .manifest.json in --output-dir)')
+    parser.add_argument('--poll-interval', type=float, default=1.0, metavar='SECONDS', help='time between two scans of --watch')
+    parser.add_argument('--settle-time', type=float, default=2.0, metavar='SECONDS', help='time an image must go unmodified before --watch converts it (so that images still being written are skipped)')
+    parser.add_argument('--full-scan-interval', type=float, default=60.0, metavar='SECONDS', help='time between two full scans of --watch, which also find images overwritten in place')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level, format='%(levelname)s: %(message)s')
+
+    cache = OutputCache(args.cache_dir, args.cache_size << 20, CACHE_VERSION) if args.cache else None
+    settings = dict(input_dir=args.input_dir,
+                    output_dir=args.output_dir,
+                    output_dir_cluster=args.output_dir_cluster,
+                    num_clusters=args.num_clusters,
+                    file_ext=args.file_ext,
+                    workers=args.workers,
+                    quantizer=args.quantizer,
+                    warm_start=args.warm_start,
+                    line_height=args.line_height,
+                    font_size=args.font_size,
+                    h_stretch=args.h_stretch,
+                    symbol=args.symbol,
+                    max_size=tuple(args.max_size),
+                    background_colour=args.background_colour,
+                    css_classes=args.css_classes,
+                    fast_decode=args.fast_decode,
+                    max_band_bytes=args.max_band_size << 20,
+                    trace_path=args.trace,
+                    cache=cache)
+    if args.watch:
+        num_failed = watch_directory(manifest_path=args.manifest, poll_interval=args.poll_interval, settle_time=args.settle_time, full_scan_interval=args.full_scan_interval, **settings)
+        return 1 if num_failed else 0
+    results = convert_directory(**settings)
+    return 1 if report(results, cache) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,321 @@
+import os
+import io
+import sys
+import time
+import gzip
+import resource
+import tempfile
+import multiprocessing
+import warnings
+import collections
+import tracemalloc
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from skimage import io as skimage_io, transform
+from yattag import Doc
+from JPEGConverter import JPEGColourConverter, JPEGClusterColourConverter
+from archive import ArchiveReader
+from ansi_writer import COLOUR_MODES
+from quantizers import get_quantizer, warm_started_fits
+from utils import get_all_files
+
+
+def legacy_extract_colours(img):
+    '''
+    Purpose: The original per-pixel colour extraction of JPEGColourConverter.convert_to_colour_html(), kept as a reference for benchmarking.
+    Inputs: img [np.array]: resized (float) image
+    Returns: [LIST] of rows, each a [LIST] of (r, g, b) [TUPLES]
+    '''
+    rgb_colour_rows = []
+    for i in range(img.shape[0]): #Iterates through the rows
+        rgb_colour_row = []
+        row = img[i]
+        for j in range(img.shape[1]): #Iterates through the columns
+            rgb_colour_pixel = tuple(map(int, row[j] * 255))
+            rgb_colour_row.append(rgb_colour_pixel)
+        rgb_colour_rows.append(rgb_colour_row)
+    return rgb_colour_rows
+
+def legacy_write_html(img_obj, rgb_colour_rows):
+    '''
+    Purpose: The original yattag HTML output of JPEGColourConverter (one <span> per pixel, whole document built in memory),
+             kept as a reference for benchmarking.
+    Returns: [STRING] the HTML document
+    '''
+    doc, tag, text = Doc().tagtext()
+    with tag('body', style='background-color:{}'.format(img_obj.background_colour)):
+        for rgb_colour_row in rgb_colour_rows:
+            with tag('text', style='white-space:PRE;line-height:{};font-size:{}px'.format(img_obj.line_height, img_obj.font_size)):
+                for colour in rgb_colour_row:
+                    with tag('span', style='color:rgb{}'.format(colour)):
+                        text('{}'.format(img_obj.symbol))
+            doc.stag('br')
+    return doc.getvalue()
+
+def _measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def benchmark_colour_html(img_path, max_size=(200,200), css_classes=False):
+    '''
+    Purpose: Times the legacy colour extraction and yattag HTML writer against the vectorised extraction and the streaming
+             writer on one image, and reports the size and peak (traced) memory of the HTML output of each.
+    Returns: [DICT] of results
+    '''
+    img_obj = JPEGColourConverter(img_path=img_path, output_dir='.', line_height=1, font_size=5, max_size=max_size, background_colour='black', css_classes=css_classes)
+
+    rgb_colour_rows, legacy_extract_time, _ = _measure(lambda: legacy_extract_colours(img_obj.img))
+    legacy_html, legacy_write_time, legacy_peak = _measure(lambda: legacy_write_html(img_obj, rgb_colour_rows))
+
+    _, extract_time, _ = _measure(img_obj.convert_to_colour_html)
+    #Memory is measured while writing to os.devnull, as a StringIO would hold the whole document
+    with open(os.devnull, 'w') as f:
+        _, write_time, peak = _measure(lambda: img_obj.write_html(f))
+    f = io.StringIO()
+    img_obj.write_html(f)
+
+    assert [list(map(tuple, row)) for row in img_obj.rgb_img.tolist()] == rgb_colour_rows, 'Vectorised colours differ from the legacy colours for {}'.format(img_path)
+    return {'pixels': img_obj.resized_height*img_obj.resized_width,
+            'legacy_extract_time': legacy_extract_time, 'legacy_write_time': legacy_write_time,
+            'legacy_bytes': len(legacy_html), 'legacy_peak': legacy_peak,
+            'extract_time': extract_time, 'write_time': write_time,
+            'bytes': len(f.getvalue()), 'peak': peak}
+
+def benchmark_ansi(img_path, columns=300, repeat=10):
+    '''
+    Purpose: Times the terminal output (ANSI escape sequences) of an image columns characters wide, in every colour mode, with and
+             without half blocks (best of repeat runs).
+    Returns: [DICT] of {(colour_mode, half_blocks): (time in seconds, output size in bytes)}
+    '''
+    results = {}
+    for half_blocks in [False, True]:
+        h_stretch = 1.0 if half_blocks else 2.0
+        img_obj = JPEGColourConverter(img_path, '.', 1, 5, h_stretch=h_stretch, max_size=(float('inf'), columns/h_stretch))
+        img_obj.convert_to_colour_html()
+        for colour_mode in COLOUR_MODES:
+            times = []
+            for _ in range(repeat):
+                f = io.StringIO()
+                start = time.perf_counter()
+                img_obj.write_ansi(f, colour_mode, half_blocks)
+                times.append(time.perf_counter() - start)
+            results[(colour_mode, half_blocks)] = (min(times), len(f.getvalue().encode('utf-8')))
+    return results
+
+def benchmark_archive(img_path, max_size=(200,200), num_clusters=None, compressions=('zlib', 'lzma'), rows=(0, 20), repeat=5):
+    '''
+    Purpose: Compares the archive (see archive.py) of one image, with every compression, to its HTML file (plain and gzipped): size,
+             time to encode, time to decode and render the whole image as HTML, and time to render only the given range of rows as
+             ANSI-coloured text (best of repeat runs). With num_clusters, the image is clustered first, so the archive stores palette indices.
+    Returns: [DICT] of {'html': (bytes, seconds to write), 'html.gz': bytes, compression: (bytes, encode seconds, decode seconds, row range seconds)}
+    '''
+    settings = dict(img_path=img_path, output_dir='.', line_height=1, font_size=5, max_size=max_size)
+    img_obj = JPEGClusterColourConverter(num_clusters=num_clusters, **settings) if num_clusters else JPEGColourConverter(**settings)
+    img_obj.convert_to_colour_html()
+
+    def best(func):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - start)
+        return result, min(times)
+    html, html_time = best(img_obj.to_html)
+    results = {'html': (len(html.encode('utf-8')), html_time), 'html.gz': len(gzip.compress(html.encode('utf-8')))}
+    for compression in compressions:
+        archive, encode_time = best(lambda: img_obj.to_archive(compression))
+        decoded, decode_time = best(lambda: ArchiveReader(archive).to_html())
+        assert decoded == html, 'The archive of {} does not decode to its HTML file'.format(img_path)
+        _, range_time = best(lambda: ArchiveReader(archive).to_ansi(*rows))
+        results[compression] = (len(archive), encode_time, decode_time, range_time)
+    return results
+
+def benchmark_clustering(img_path, max_size=(200,200), num_clusters_list=(5, 10, 15)):
+    '''
+    Purpose: Times every quantizer backend (each value in num_clusters_list fitted independently, and warm-started from the
+             previous fit where supported) on one image.
+    Returns: [DICT] of {backend_name: (total_seconds, mean_error)}
+    '''
+    img_obj = JPEGColourConverter(img_path=img_path, output_dir='.', line_height=1, font_size=5, max_size=max_size)
+    results = {}
+    for name in ['kmeans', 'minibatch', 'histogram', 'median_cut', 'octree']:
+        quantizer = get_quantizer(name)
+        independent = [quantizer.quantize(img_obj.img, num_clusters) for num_clusters in num_clusters_list]
+        results[name] = (sum(r.time for r in independent), sum(r.error for r in independent)/len(independent))
+        if quantizer.supports_warm_start:
+            def fit(num_clusters, init_centroids):
+                result = quantizer.quantize(img_obj.img, num_clusters, init_centroids)
+                return result, result
+            #Timed as a whole, so that deriving the warm start centroids is included
+            start_time = time.perf_counter()
+            warm = warm_started_fits(num_clusters_list, quantizer, fit).values()
+            results[name+' (warm)'] = (time.perf_counter()-start_time, sum(r.error for r in warm)/len(warm))
+    return results
+
+def legacy_decode(img_path, max_size=(200,200), h_stretch=1.5):
+    '''
+    Purpose: The original decode and resample of JPEGColourConverter (full-resolution skimage.io.imread(), float64 transform.resize()),
+             kept as a reference for benchmarking.
+    Returns: [np.array] resized float64 image
+    '''
+    img = skimage_io.imread(img_path)
+    resize_ratio = min(max_size[0]/img.shape[0], max_size[1]/img.shape[1])
+    return transform.resize(img, (int(resize_ratio*img.shape[0]), int(resize_ratio*img.shape[1]*h_stretch)))
+
+def make_test_image(path, size=(8000, 6000), quality=90):
+    '''
+    Purpose: Saves a synthetic RGB JPEG of size (width, height) (gradients and noise, like a large phone photo) to path.
+    '''
+    noise = Image.effect_noise(size, 64)
+    horizontal = Image.linear_gradient('L').rotate(90).resize(size)
+    vertical = Image.linear_gradient('L').resize(size)
+    Image.merge('RGB', (noise, horizontal, vertical)).save(path, quality=quality)
+
+def peak_rss():
+    '''
+    Purpose: Returns the peak resident set size of this process in bytes. On Linux this is read from /proc (VmHWM), as ru_maxrss
+             also counts the memory of the parent process before a fork.
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss*1024 #Bytes on macOS, KB elsewhere
+
+def _decode_and_measure(img_path, legacy, max_size):
+    #Runs in a fresh process, so that peak_rss() is the peak RSS of this decode alone
+    start = time.perf_counter()
+    if img_path is not None:
+        if legacy:
+            legacy_decode(img_path, max_size)
+        else:
+            JPEGColourConverter(img_path=img_path, output_dir='.', line_height=1, font_size=5, max_size=max_size)
+    elapsed = time.perf_counter() - start
+    return elapsed, peak_rss()
+
+def _in_fresh_process(func, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(func, *args).result()
+
+def benchmark_decode(img_path, max_size=(200,200)):
+    '''
+    Purpose: Times the legacy decode and float64 resample of one image against JPEGColourConverter (fast_decode, float32 resample), and
+             measures the peak RSS of each, in a fresh process so that the runs do not share memory. The peak RSS of an idle process
+             (interpreter and imports) is reported separately.
+    Returns: [DICT] of {'idle': peak_bytes, 'legacy': (seconds, peak_bytes), 'fast': (seconds, peak_bytes)}
+    '''
+    return {'idle': _in_fresh_process(_decode_and_measure, None, False, max_size)[1],
+            'legacy': _in_fresh_process(_decode_and_measure, img_path, True, max_size),
+            'fast': _in_fresh_process(_decode_and_measure, img_path, False, max_size)}
+
+
+def make_raw_test_image(path, size=(40000, 25000), band_height=256):
+    '''
+    Purpose: Saves a synthetic RGB image of size (width, height) as an uncompressed PPM file, one band of rows at a time, so that
+             images larger than memory can be made (the default is a 1 gigapixel, 3 GB file).
+    '''
+    width, height = size
+    rng = np.random.default_rng(0)
+    horizontal = np.linspace(0, 255, width).astype(np.uint8)
+    with open(path, 'wb') as f:
+        f.write('P6\n{} {}\n255\n'.format(width, height).encode('ascii'))
+        for top in range(0, height, band_height):
+            rows = min(band_height, height-top)
+            band = np.empty((rows, width, 3), dtype=np.uint8)
+            band[..., 0] = rng.integers(0, 256, (rows, width), dtype=np.uint8)
+            band[..., 1] = horizontal
+            band[..., 2] = (np.arange(top, top+rows)*255//height).astype(np.uint8)[:, np.newaxis]
+            f.write(band.tobytes())
+
+def _convert_raw_and_measure(img_path, striped, max_size):
+    #Runs in a fresh process. Without striped, the image is given as a PIL Image, which is decoded whole.
+    Image.MAX_IMAGE_PIXELS = None #The image is larger than PIL's decompression bomb limit
+    start = time.perf_counter()
+    img_obj = JPEGColourConverter(img_path=img_path if striped else Image.open(img_path), output_dir='.', line_height=1, font_size=5, max_size=max_size)
+    img_obj.convert_to_colour_html()
+    elapsed = time.perf_counter() - start
+    return elapsed, peak_rss(), img_obj.to_html()
+
+def benchmark_striped(img_path, max_size=(200,200)):
+    '''
+    Purpose: Times the conversion of an uncompressed image read in bands (see common/image_io.reduce_striped()) and decoded whole, and
+             measures the peak RSS of each in a fresh process.
+    Returns: [DICT] of {'whole': (seconds, peak_bytes), 'striped': (seconds, peak_bytes), 'same_output': [BOOLEAN]}
+    '''
+    whole = _in_fresh_process(_convert_raw_and_measure, img_path, False, max_size)
+    striped = _in_fresh_process(_convert_raw_and_measure, img_path, True, max_size)
+    return {'whole': whole[:2], 'striped': striped[:2], 'same_output': whole[2] == striped[2]}
+
+
+if __name__ == '__main__':
+    input_dir = './Images'
+    max_sizes = [(100, 100), (200, 200), (300, 300), (600, 600)]
+    num_images = 3
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        #Clustering (every bundled image, num_clusters = 5, 10, 15)
+        totals = collections.defaultdict(lambda: [0, 0])
+        img_paths = sorted(get_all_files(input_dir, file_ext='.jpg'))
+        for img_path in img_paths:
+            for name, (elapsed, error) in benchmark_clustering(img_path).items():
+                totals[name][0] += elapsed
+                totals[name][1] += error/len(img_paths)
+        for name, (elapsed, error) in totals.items():
+            print('clustering {:<18} total: {:7.2f} s   speedup: {:6.1f}x   mean error: {:.5f}'.format(name, elapsed, totals['kmeans'][0]/elapsed, error))
+
+        img_paths = sorted(get_all_files(input_dir, file_ext='.jpg'))[:num_images]
+        for css_classes in [False, True]:
+            print('css_classes={}'.format(css_classes))
+            for max_size in max_sizes:
+                for img_path in img_paths:
+                    r = benchmark_colour_html(img_path, max_size=max_size, css_classes=css_classes)
+                    print('{:<11} {:<18} {:>7} px | extract {:8.1f} -> {:5.1f} ms | write {:8.1f} -> {:6.1f} ms | {:6.0f} -> {:5.0f} KB | peak {:6.0f} -> {:4.0f} KB'.format(
+                        str(max_size), os.path.basename(img_path), r['pixels'],
+                        r['legacy_extract_time']*1000, r['extract_time']*1000,
+                        r['legacy_write_time']*1000, r['write_time']*1000,
+                        r['legacy_bytes']/1024, r['bytes']/1024,
+                        r['legacy_peak']/1024, r['peak']/1024))
+
+    #Terminal output, 300 columns wide
+    for img_path in img_paths:
+        for (colour_mode, half_blocks), (elapsed, num_bytes) in benchmark_ansi(img_path).items():
+            print('ANSI {:<18} {:<9} half_blocks={!s:<5} 300 columns: {:5.1f} ms  {:6.0f} KB'.format(os.path.basename(img_path), colour_mode, half_blocks, elapsed*1000, num_bytes/1024))
+
+    #Archives against the HTML files (200x200, as in the benchmarks above)
+    for num_clusters in [None, 8]:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for img_path in img_paths:
+                r = benchmark_archive(img_path, num_clusters=num_clusters)
+                print('archive {:<18} clusters={!s:<4} html {:6.0f} KB ({:5.1f} ms)  html.gz {:5.0f} KB'.format(os.path.basename(img_path), num_clusters, r['html'][0]/1024, r['html'][1]*1000, r['html.gz']/1024), end='')
+                for compression in ['zlib', 'lzma']:
+                    num_bytes, encode_time, decode_time, range_time = r[compression]
+                    print(' | {} {:5.1f} KB  encode {:5.1f} ms  decode {:5.1f} ms  20 rows {:4.1f} ms'.format(compression, num_bytes/1024, encode_time*1000, decode_time*1000, range_time*1000), end='')
+                print()
+
+    #Decode and resample of a large (48 MP) image
+    with tempfile.TemporaryDirectory() as temp_dir:
+        img_path = os.path.join(temp_dir, 'large.jpg')
+        make_test_image(img_path)
+        r = benchmark_decode(img_path)
+    print('\n48 MP JPEG        legacy decode: {:8.1f} ms  peak RSS {:6.1f} MB   fast decode: {:6.1f} ms  peak RSS {:6.1f} MB   (idle process: {:.1f} MB)'.format(
+        r['legacy'][0]*1000, r['legacy'][1]/2**20, r['fast'][0]*1000, r['fast'][1]/2**20, r['idle']/2**20))
+
+    #Conversion of a large uncompressed image, read in bands and decoded whole
+    with tempfile.TemporaryDirectory() as temp_dir:
+        img_path = os.path.join(temp_dir, 'large.ppm')
+        make_raw_test_image(img_path, size=(20000, 12500))
+        r = benchmark_striped(img_path)
+    print('250 MP PPM        whole decode: {:7.1f} ms  peak RSS {:6.1f} MB   striped: {:9.1f} ms  peak RSS {:6.1f} MB   same output: {}'.format(
+        r['whole'][0]*1000, r['whole'][1]/2**20, r['striped'][0]*1000, r['striped'][1]/2**20, r['same_output']))
@@ -0,0 +1,195 @@
+import io
+import os
+import gc
+import json
+import time
+import argparse
+import platform
+import tempfile
+import warnings
+import tracemalloc
+import numpy as np
+import PIL
+import skimage
+from skimage import transform, img_as_float32
+from JPEGConverter import JPEGColourConverter
+from quantizers import QUANTIZERS, get_quantizer
+from benchmark import make_test_image
+from utils import get_all_files
+from common.image_io import open_image, reduce_image
+
+SUITE_NAME = 'colour'
+DEFAULT_SYNTHETIC_SIZES = [(512, 384), (2048, 1536), (4096, 3072)]
+
+
+def _reset_peak_rss():
+    '''
+    Purpose: Resets the peak RSS of this process (Linux only, through /proc/self/clear_refs). Returns False if it cannot be reset.
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _read_rss():
+    #[TUPLE] (current RSS, peak RSS) in bytes, from /proc/self/status
+    values = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                values[line.split(':')[0]] = int(line.split()[1])*1024
+    return values['VmRSS'], values['VmHWM']
+
+def measure(func, repeat=3):
+    '''
+    Purpose: Measures func() (one stage of the conversion).
+    Returns: [DICT] of {'wall_time': fastest of repeat runs in seconds,
+                        'peak_traced_bytes': peak memory allocated through Python and NumPy during one run (tracemalloc),
+                        'peak_rss_bytes': growth of the peak RSS of the process during one run (includes PIL buffers; None where the
+                                          peak RSS cannot be reset, i.e. outside Linux)}
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    peak_rss = None
+    if _reset_peak_rss():
+        rss_before = _read_rss()[0]
+        func()
+        peak_rss = max(0, _read_rss()[1] - rss_before)
+
+    tracemalloc.start()
+    func()
+    peak_traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'wall_time': min(times), 'peak_traced_bytes': peak_traced, 'peak_rss_bytes': peak_rss}
+
+def _record(results, stage, input_name, pixels, measurement):
+    measurement = dict(stage=stage, input=input_name, pixels=pixels, **measurement)
+    measurement['pixels_per_s'] = pixels/measurement['wall_time'] if pixels and measurement['wall_time'] > 0 else None
+    results.append(measurement)
+    print('{:<20} {:<28} {:>10} px {:10.2f} ms {:>14} px/s  peak {:8.0f} KB traced {:>8} KB RSS'.format(
+        stage, input_name, pixels or '-', measurement['wall_time']*1000,
+        '{:.3g}'.format(measurement['pixels_per_s']) if measurement['pixels_per_s'] else '-',
+        measurement['peak_traced_bytes']/1024, '{:.0f}'.format(measurement['peak_rss_bytes']/1024) if measurement['peak_rss_bytes'] is not None else '-'))
+
+def benchmark_image(results, img_path, input_name, settings, quantizers=('histogram',), num_clusters=8, repeat=3):
+    '''
+    Purpose: Measures every stage of the conversion of one image: decode (reading and shrinking the image, see common/image_io.reduce_image()),
+             resize (float32 transform.resize()), colour extraction (convert_to_colour_html()), clustering with every quantizer in
+             quantizers (image_segmentation(), see quantizers.py) and HTML serialization. Throughput is measured against the pixels
+             of the source image for decode, and of the resized image for the other stages.
+    '''
+    img_obj = JPEGColourConverter(img_path=img_path, output_dir='.', **settings)
+    resized_size = (img_obj.resized_width, img_obj.resized_height)
+    source_pixels = img_obj.img_width_original*img_obj.img_height_original
+    resized_pixels = img_obj.resized_width*img_obj.resized_height
+
+    def decode():
+        return np.asarray(reduce_image(open_image(img_path), 'RGB', resized_size))
+    decoded_img = decode()
+    resized_img = img_obj.img
+    img_obj.convert_to_colour_html()
+
+    _record(results, 'decode', input_name, source_pixels, measure(decode, repeat))
+    _record(results, 'resize', input_name, resized_pixels, measure(lambda: transform.resize(img_as_float32(decoded_img), img_obj.resized_size), repeat))
+    _record(results, 'extract', input_name, resized_pixels, measure(img_obj.convert_to_colour_html, repeat))
+    for name in quantizers:
+        quantizer = get_quantizer(name)
+        _record(results, 'clustering_'+name, input_name, resized_pixels, measure(lambda: quantizer.quantize(resized_img, num_clusters), repeat))
+    _record(results, 'serialize_html', input_name, resized_pixels, measure(lambda: img_obj.write_html(io.StringIO()), repeat))
+
+def run_suite(input_dir='./Images', synthetic_sizes=DEFAULT_SYNTHETIC_SIZES, max_size=(200, 200), h_stretch=1.5, quantizers=('histogram',), num_clusters=8, css_classes=False, repeat=3):
+    '''
+    Purpose: Runs every stage of the conversion of every image in input_dir and of a synthetic JPEG of each size in synthetic_sizes
+             ((width, height) [TUPLES]).
+    Returns: [DICT] report, with one entry per (stage, input) in 'results'
+    '''
+    results = []
+    settings = {'line_height': 1, 'font_size': 5, 'max_size': max_size, 'h_stretch': h_stretch, 'background_colour': 'black', 'css_classes': css_classes}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for img_path in sorted(get_all_files(input_dir, file_ext=None)):
+            benchmark_image(results, os.path.join(input_dir, img_path), img_path, settings, quantizers, num_clusters, repeat)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for size in synthetic_sizes:
+                img_path = os.path.join(temp_dir, 'synthetic_{}x{}.jpg'.format(*size))
+                make_test_image(img_path, size)
+                benchmark_image(results, img_path, os.path.basename(img_path), settings, quantizers, num_clusters, repeat)
+
+    return {'suite': SUITE_NAME,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': {'machine': platform.machine(), 'processor': platform.processor(), 'python': platform.python_version(),
+                         'numpy': np.__version__, 'pillow': PIL.__version__, 'scikit-image': skimage.__version__},
+            'settings': {'max_size': list(max_size), 'h_stretch': h_stretch, 'quantizers': list(quantizers), 'num_clusters': num_clusters,
+                         'css_classes': css_classes, 'repeat': repeat},
+            'results': results}
+
+def compare(report, baseline, tolerance=0.25, memory_tolerance=0.25, min_time=0.001):
+    '''
+    Purpose: Compares every result in report with the result of the same (stage, input) in baseline.
+    Inputs: tolerance [FLOAT]: maximum allowed relative increase in wall time (0.25 allows runs to be up to 25% slower)
+            memory_tolerance [FLOAT]: maximum allowed relative increase in peak traced memory
+            min_time [FLOAT]: increases in wall time smaller than this (in seconds) are ignored, as they are within timer noise
+    Returns: [LIST] of [STRINGS], one per regression
+    '''
+    baseline_results = {(result['stage'], result['input']): result for result in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        reference = baseline_results.get((result['stage'], result['input']))
+        if reference is None:
+            continue
+        if result['wall_time'] > reference['wall_time']*(1+tolerance) and result['wall_time']-reference['wall_time'] > min_time:
+            regressions.append('{} {}: wall time {:.2f} ms (baseline {:.2f} ms, +{:.0%})'.format(
+                result['stage'], result['input'], result['wall_time']*1000, reference['wall_time']*1000, result['wall_time']/reference['wall_time']-1))
+        if result['peak_traced_bytes'] > reference['peak_traced_bytes']*(1+memory_tolerance) and result['peak_traced_bytes']-reference['peak_traced_bytes'] > 1 << 16:
+            regressions.append('{} {}: peak memory {:.0f} KB (baseline {:.0f} KB)'.format(
+                result['stage'], result['input'], result['peak_traced_bytes']/1024, reference['peak_traced_bytes']/1024))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks every stage of the colour conversion and compares the results with a saved baseline.')
+    parser.add_argument('--input-dir', default='./Images')
+    parser.add_argument('--synthetic-sizes', type=int, nargs='*', default=[size for sizes in DEFAULT_SYNTHETIC_SIZES for size in sizes], metavar='WIDTH HEIGHT', help='sizes of the synthetic JPEG images (pairs of width and height)')
+    parser.add_argument('--max-size', type=int, nargs=2, default=(200, 200), metavar=('MAX_HEIGHT', 'MAX_WIDTH'))
+    parser.add_argument('--h-stretch', type=float, default=1.5)
+    parser.add_argument('--quantizers', nargs='*', default=['histogram'], choices=sorted(QUANTIZERS), help='clustering backends to benchmark')
+    parser.add_argument('--num-clusters', type=int, default=8)
+    parser.add_argument('--css-classes', action='store_true')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of each stage (the fastest is reported)')
+    parser.add_argument('--output', help='file to write the JSON report to')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='write the report to --baseline instead of comparing against it')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='maximum allowed relative increase in wall time')
+    parser.add_argument('--memory-tolerance', type=float, default=0.25, help='maximum allowed relative increase in peak memory')
+    args = parser.parse_args(argv)
+    if len(args.synthetic_sizes) % 2:
+        parser.error('--synthetic-sizes takes pairs of WIDTH HEIGHT')
+
+    synthetic_sizes = list(zip(args.synthetic_sizes[::2], args.synthetic_sizes[1::2]))
+    report = run_suite(args.input_dir, synthetic_sizes, tuple(args.max_size), args.h_stretch, args.quantizers, args.num_clusters, args.css_classes, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+        print('Baseline saved to {}.'.format(args.baseline))
+    elif args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.memory_tolerance)
+        for regression in regressions:
+            print('REGRESSION: {}'.format(regression))
+        print('{} regressions against {}.'.format(len(regressions), args.baseline))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,6 @@
+import os
+
+#The modules shared by the Monochrome and Colour converters live in common/ in the repository root. This package stands in for it, so that
+#the scripts of this directory can be run directly (python batch.py) without the repository root on the path: every common.<module>
+#is loaded from there.
+__path__ = [os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'common')]
@@ -0,0 +1,112 @@
+import numpy as np
+from html import escape
+
+#Two-digit hex string of every channel value (0-255), e.g. HEX_PAIRS[171] == 'ab'
+HEX_PAIRS = np.array(['{:02x}'.format(value) for value in range(256)])
+
+
+def pack_rgb(rgb_img):
+    '''
+    Purpose: Packs the (r, g, b) channels of every pixel into one integer (r<<16 | g<<8 | b), so that colours can be compared in one operation.
+    Inputs: rgb_img [np.array] of uint8: (..., 3) RGB values
+    Returns: [np.array] of int32 with the shape of rgb_img without its last axis
+    '''
+    rgb_img = rgb_img.astype(np.int32)
+    return (rgb_img[..., 0] << 16) | (rgb_img[..., 1] << 8) | rgb_img[..., 2]
+
+def hex_colours(rgb_pixels):
+    '''
+    Purpose: Converts RGB values to 6-digit hex colour strings using the HEX_PAIRS lookup table.
+    Inputs: rgb_pixels [np.array] of uint8: (n, 3) RGB values
+    Returns: [np.array] of n 'rrggbb' strings
+    '''
+    return np.ascontiguousarray(HEX_PAIRS[rgb_pixels]).view('U6').ravel()
+
+def find_runs(packed_row):
+    '''
+    Purpose: Finds the runs of neighbouring pixels with the same colour in one row.
+    Inputs: packed_row [np.array]: packed colours of one row (see pack_rgb())
+    Returns: [TUPLE] (starts, lengths) of [np.arrays]: index of the first pixel and number of pixels of each run
+    '''
+    is_start = np.empty(len(packed_row), dtype=bool)
+    is_start[:1] = True
+    np.not_equal(packed_row[1:], packed_row[:-1], out=is_start[1:])
+    starts = np.flatnonzero(is_start)
+    lengths = np.diff(np.append(starts, len(packed_row)))
+    return starts, lengths
+
+
+class ColourHTMLWriter(object):
+    def __init__(self, f, symbol, line_height, font_size, background_colour, colour_classes=None):
+        '''
+        Purpose: Streams a colour ASCII HTML document to the file object f, one row at a time, so that the document is never held in memory.
+                 Each run of neighbouring pixels with the same colour is written as a single <span>, which renders identically
+                 to one <span> per pixel.
+        Inputs: f [FILE]: file object opened for writing text
+                symbol [STRING]: symbol to be used for the ASCII image
+                line_height, font_size: see JPEGColourConverter
+                background_colour [STRING]: background colour of the HTML page
+                colour_classes [DICT] of {packed_colour: class_name}: colours to be styled through a CSS class instead of an
+                                                                     inline style (see get_repeated_colours()). Defaults to None (inline styles only).
+        '''
+        self.f = f
+        self.symbol = escape(symbol, quote=False)
+        self.line_height = line_height
+        self.font_size = font_size
+        self.background_colour = background_colour
+        self.colour_classes = colour_classes or {}
+        self.row_start = '<text style="white-space:PRE;line-height:{};font-size:{}px">'.format(self.line_height, self.font_size)
+
+        #Sorted packed colours and their class names, so that the class of every run is found with one np.searchsorted() call
+        self.class_colours = np.array(sorted(self.colour_classes), dtype=np.int32)
+        self.class_open_tags = np.array(['<span class="{}">'.format(self.colour_classes[colour]) for colour in self.class_colours.tolist()], dtype=object)
+
+    def write_header(self):
+        if self.colour_classes:
+            self.f.write('<style>')
+            self.f.write(''.join('.{}{{color:#{:06x}}}'.format(class_name, colour) for colour, class_name in self.colour_classes.items()))
+            self.f.write('</style>')
+        self.f.write('<body style="background-color:{}">'.format(self.background_colour))
+
+    def write_row(self, rgb_row):
+        '''
+        Purpose: Writes one row of the image.
+        Inputs: rgb_row [np.array] of uint8: (width, 3) RGB colour of each pixel in the row
+        '''
+        packed_row = pack_rgb(rgb_row)
+        starts, lengths = find_runs(packed_row)
+        if len(self.class_colours):
+            run_colours = packed_row[starts]
+            class_index = np.minimum(np.searchsorted(self.class_colours, run_colours), len(self.class_colours)-1)
+            has_class = self.class_colours[class_index] == run_colours
+            open_tags = np.empty(len(starts), dtype=object)
+            open_tags[has_class] = self.class_open_tags[class_index[has_class]]
+            inline_starts = starts[~has_class]
+            open_tags[~has_class] = ['<span style="color:#{}">'.format(colour) for colour in hex_colours(rgb_row[inline_starts]).tolist()]
+            open_tags = open_tags.tolist()
+        else:
+            open_tags = ['<span style="color:#{}">'.format(colour) for colour in hex_colours(rgb_row[starts]).tolist()]
+
+        symbol = self.symbol
+        spans = ''.join([open_tag + symbol*length + '</span>' for open_tag, length in zip(open_tags, lengths.tolist())])
+        self.f.write(self.row_start + spans + '</text><br />')
+
+    def write_footer(self):
+        self.f.write('</body>')
+
+
+def get_repeated_colours(rgb_img, min_runs=2):
+    '''
+    Purpose: Finds the colours that are used by at least min_runs runs of pixels, so that each can be given a (short) CSS class.
+             The most used colours are given the shortest class names.
+    Inputs: rgb_img [np.array] of uint8: (height, width, 3) RGB image
+            min_runs [INT]: minimum number of runs a colour must appear in
+    Returns: [DICT] of {packed_colour: class_name} (see pack_rgb())
+    '''
+    packed_img = pack_rgb(rgb_img)
+    is_start = np.ones(packed_img.shape, dtype=bool)
+    is_start[:, 1:] = packed_img[:, 1:] != packed_img[:, :-1]
+    colours, counts = np.unique(packed_img[is_start], return_counts=True)
+    order = np.argsort(-counts, kind='stable')
+    repeated_colours = colours[order][counts[order] >= min_runs]
+    return {colour: 'c{}'.format(index) for index, colour in enumerate(repeated_colours.tolist())}
@@ -0,0 +1,89 @@
+import time
+import asyncio
+import logging
+import argparse
+import numpy as np
+from service import ConversionService
+from utils import get_all_files
+from quantizers import QUANTIZERS
+
+
+async def run_level(service, images, concurrency, num_requests, **settings):
+    '''
+    Purpose: Sends num_requests requests to service from concurrency concurrent clients, each sending its next request as soon as
+             the previous one is answered (a closed loop), cycling through images.
+    Returns: [DICT] with the concurrency, the number of requests, errors and timeouts, the throughput (requests/s), and the 50th and
+             99th percentiles of the latency (seconds) of the successful requests
+    '''
+    latencies = []
+    failures = {'errors': 0, 'timeouts': 0}
+    next_request = iter(range(num_requests))
+
+    async def client():
+        for i in next_request:
+            start_time = time.perf_counter()
+            try:
+                await service.convert(images[i % len(images)], **settings)
+            except TimeoutError:
+                failures['timeouts'] += 1
+            except Exception:
+                failures['errors'] += 1
+            else:
+                latencies.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start_time
+    return dict(concurrency=concurrency,
+                requests=num_requests,
+                errors=failures['errors'],
+                timeouts=failures['timeouts'],
+                throughput=len(latencies)/elapsed,
+                p50=float(np.percentile(latencies, 50)) if latencies else float('nan'),
+                p99=float(np.percentile(latencies, 99)) if latencies else float('nan'))
+
+async def run(images, concurrency_levels, num_requests, workers=None, max_batch=16, batch_window=0.002, timeout=30.0, **settings):
+    '''
+    Purpose: Runs run_level() at every concurrency level in concurrency_levels against one ConversionService.
+    Returns: [LIST] of [DICT] (see run_level())
+    '''
+    async with ConversionService(workers=workers, max_batch=max_batch, batch_window=batch_window, timeout=timeout) as service:
+        #Starts the worker processes (and imports the converter in each) before measuring
+        await asyncio.gather(*[service.convert(images[0], **settings) for _ in range(service.workers)])
+        return [await run_level(service, images, concurrency, num_requests, **settings) for concurrency in concurrency_levels]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load generator for service.ConversionService: sends the images in --image-src-dir (as encoded bytes, like uploads to an HTTP service) from an increasing number of concurrent clients, and reports the latency and throughput at each level.')
+    parser.add_argument('--image-src-dir', default='./Images')
+    parser.add_argument('--file-ext', default='.jpg')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--requests', type=int, default=200, help='number of requests per concurrency level')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (defaults to the number of CPUs)')
+    parser.add_argument('--max-batch', type=int, default=16, help='maximum number of requests per micro-batch (1 disables batching)')
+    parser.add_argument('--batch-window', type=float, default=0.002, metavar='SECONDS')
+    parser.add_argument('--timeout', type=float, default=30.0, metavar='SECONDS')
+    parser.add_argument('--num-clusters', type=int, default=None, help='reduce the colours of every image to this many colours')
+    parser.add_argument('--quantizer', default='histogram', choices=QUANTIZERS)
+    parser.add_argument('--max-size', type=int, nargs=2, default=(50, 50), metavar=('MAX_HEIGHT', 'MAX_WIDTH'))
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+    images = []
+    for image_path in get_all_files(args.image_src_dir, args.file_ext):
+        with open(image_path, 'rb') as f:
+            images.append(f.read())
+    if not images:
+        parser.error('No {} files in {}'.format(args.file_ext, args.image_src_dir))
+
+    settings = dict(max_size=tuple(args.max_size))
+    if args.num_clusters:
+        settings.update(num_clusters=args.num_clusters, quantizer=args.quantizer)
+    levels = asyncio.run(run(images, args.concurrency, args.requests, workers=args.workers, max_batch=args.max_batch, batch_window=args.batch_window, timeout=args.timeout, **settings))
+    print('{:>11} {:>9} {:>8} {:>8} {:>10} {:>10}'.format('concurrency', 'requests', 'errors', 'timeouts', 'p50 (ms)', 'p99 (ms)') + '  req/s')
+    for level in levels:
+        print('{concurrency:>11} {requests:>9} {errors:>8} {timeouts:>8} {p50_ms:>10.1f} {p99_ms:>10.1f}  {throughput:.1f}'.format(p50_ms=level['p50']*1000, p99_ms=level['p99']*1000, **level))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,231 @@
+import time
+import collections
+import numpy as np
+from PIL import Image
+
+QuantizationResult = collections.namedtuple('QuantizationResult', ['img', 'centroids', 'labels', 'time', 'error'])
+
+
+def _pixels(img):
+    #(height*width, 3) view of the pixels of img, which every quantizer (and _result()) expects to be a (height, width, 3) RGB image
+    if img.ndim != 3 or img.shape[-1] != 3:
+        raise ValueError('Expected a (height, width, 3) RGB image, got an array of shape {}.'.format(img.shape))
+    return img.reshape(-1, 3)
+
+def _result(img, centroids, labels, start_time):
+    '''
+    Purpose: Builds the QuantizationResult of a fit. error is the mean squared error (summed over the channels) between each
+             pixel and its centroid, in the units of img.
+    '''
+    quantized_img = centroids[labels].reshape(img.shape)
+    elapsed = time.perf_counter() - start_time
+    error = float(np.mean(np.sum((img.reshape(-1, 3) - quantized_img.reshape(-1, 3))**2, axis=1)))
+    return QuantizationResult(quantized_img, centroids, labels, elapsed, error)
+
+
+class KMeansQuantizer(object):
+    name = 'kmeans'
+    supports_warm_start = True
+
+    def __init__(self, random_state=None):
+        '''
+        Purpose: Full sklearn KMeans fit on every pixel (the original behaviour of JPEGClusterColourConverter).
+        '''
+        self.random_state = random_state
+
+    def quantize(self, img, num_clusters, init_centroids=None):
+        '''
+        Purpose: Reduces the colours of img to num_clusters colours.
+        Inputs: img [np.array]: (height, width, 3) float image
+                num_clusters [INT]: number of colours
+                init_centroids [np.array]: (num_clusters, 3) initial centroids (warm start). If None, k-means++ is used.
+        Returns: QuantizationResult
+        '''
+        #sklearn takes about a second to import, so it is only imported by the quantizers that use it (before the fit is timed)
+        from sklearn.cluster import KMeans
+        start_time = time.perf_counter()
+        X = _pixels(img)
+        if init_centroids is None:
+            kmeans = KMeans(n_clusters=num_clusters, random_state=self.random_state).fit(X)
+        else:
+            kmeans = KMeans(n_clusters=num_clusters, init=init_centroids, n_init=1, random_state=self.random_state).fit(X)
+        return _result(img, kmeans.cluster_centers_, kmeans.labels_, start_time)
+
+
+class MiniBatchKMeansQuantizer(object):
+    name = 'minibatch'
+    supports_warm_start = True
+
+    def __init__(self, sample_size=10000, batch_size=2048, random_state=None):
+        '''
+        Purpose: sklearn MiniBatchKMeans fitted on a random subsample of sample_size pixels. Every pixel is then assigned to its
+                 nearest centroid, so the cost of the fit does not grow with the image size.
+        '''
+        self.sample_size = sample_size
+        self.batch_size = batch_size
+        self.random_state = random_state
+
+    def quantize(self, img, num_clusters, init_centroids=None):
+        from sklearn.cluster import MiniBatchKMeans
+        start_time = time.perf_counter()
+        X = _pixels(img)
+        rng = np.random.default_rng(self.random_state)
+        sample = X[rng.choice(len(X), size=self.sample_size, replace=False)] if len(X) > self.sample_size else X
+        if init_centroids is None:
+            kmeans = MiniBatchKMeans(n_clusters=num_clusters, batch_size=self.batch_size, n_init=3, random_state=self.random_state)
+        else:
+            kmeans = MiniBatchKMeans(n_clusters=num_clusters, batch_size=self.batch_size, init=init_centroids, n_init=1, random_state=self.random_state)
+        kmeans.fit(sample)
+        return _result(img, kmeans.cluster_centers_, kmeans.predict(X), start_time)
+
+
+def _kmeans_plus_plus(points, weights, num_clusters, rng):
+    '''
+    Purpose: Weighted k-means++ seeding of num_clusters centroids from points.
+    '''
+    centroids = [points[rng.choice(len(points), p=weights/weights.sum())]]
+    closest = np.sum((points - centroids[0])**2, axis=1)
+    for _ in range(1, num_clusters):
+        probabilities = weights*closest
+        total = probabilities.sum()
+        index = rng.choice(len(points), p=probabilities/total) if total > 0 else rng.integers(len(points))
+        centroids.append(points[index])
+        closest = np.minimum(closest, np.sum((points - points[index])**2, axis=1))
+    return np.array(centroids)
+
+def _nearest_centroid(points, centroids):
+    #Squared distances through a matrix product (||p||^2 is the same for every centroid, so it is left out)
+    return np.argmin(np.sum(centroids**2, axis=1) - 2*points @ centroids.T, axis=1)
+
+def weighted_kmeans(points, weights, num_clusters, init_centroids=None, max_iter=50, tol=1e-7, rng=None):
+    '''
+    Purpose: Lloyd's k-means on weighted points, in NumPy.
+    Inputs: points [np.array]: (n, 3) points
+            weights [np.array]: (n,) weight of each point
+            num_clusters [INT]: number of clusters (ignored if init_centroids is given)
+            init_centroids [np.array]: initial centroids. If None, weighted k-means++ seeding is used.
+            max_iter [INT]: maximum number of iterations
+            tol [FLOAT]: the fit stops once no centroid moves by more than tol (squared distance)
+    Returns: [TUPLE] (centroids, labels) of [np.arrays]
+    '''
+    if init_centroids is None:
+        rng = rng if rng is not None else np.random.default_rng()
+        centroids = _kmeans_plus_plus(points, weights, min(num_clusters, len(points)), rng)
+    else:
+        centroids = np.array(init_centroids, dtype=np.float64)
+    for _ in range(max_iter):
+        labels = _nearest_centroid(points, centroids)
+        cluster_weights = np.bincount(labels, weights=weights, minlength=len(centroids))
+        sums = np.stack([np.bincount(labels, weights=weights*points[:, c], minlength=len(centroids)) for c in range(points.shape[1])], axis=1)
+        #Empty clusters keep their previous centroid
+        new_centroids = np.where(cluster_weights[:, np.newaxis] > 0, sums/np.maximum(cluster_weights, 1e-12)[:, np.newaxis], centroids)
+        shift = np.max(np.sum((new_centroids - centroids)**2, axis=1))
+        centroids = new_centroids
+        if shift <= tol:
+            break
+    return centroids, _nearest_centroid(points, centroids)
+
+
+class HistogramKMeansQuantizer(object):
+    name = 'histogram'
+    supports_warm_start = True
+
+    def __init__(self, bits=5, max_iter=50, tol=1e-7, random_state=None):
+        '''
+        Purpose: Weighted k-means (NumPy) on a colour histogram instead of on the pixels. Every pixel is put into one of
+                 2**(3*bits) colour bins, k-means runs on the mean colour of each occupied bin (weighted by its pixel count), and every
+                 pixel then takes the cluster of its bin through one lookup table. The cost of the fit depends on the number of
+                 distinct colours, not on the number of pixels.
+        Inputs: bits [INT]: number of bits per channel of the histogram
+                max_iter, tol: see weighted_kmeans()
+        '''
+        self.bits = bits
+        self.max_iter = max_iter
+        self.tol = tol
+        self.random_state = random_state
+
+    def quantize(self, img, num_clusters, init_centroids=None):
+        start_time = time.perf_counter()
+        X = _pixels(img)
+        levels = 1 << self.bits
+        quantized = np.minimum((X*levels).astype(np.int64), levels-1)
+        bins = (quantized[:, 0] << (2*self.bits)) | (quantized[:, 1] << self.bits) | quantized[:, 2]
+
+        #Mean colour and pixel count of every occupied bin
+        counts = np.bincount(bins, minlength=levels**3)
+        occupied = np.flatnonzero(counts)
+        weights = counts[occupied].astype(np.float64)
+        colours = np.stack([np.bincount(bins, weights=X[:, c], minlength=levels**3)[occupied] for c in range(3)], axis=1)/weights[:, np.newaxis]
+
+        centroids, bin_labels = weighted_kmeans(colours, weights, num_clusters, init_centroids, self.max_iter, self.tol, np.random.default_rng(self.random_state))
+        label_lut = np.zeros(levels**3, dtype=np.int64)
+        label_lut[occupied] = bin_labels
+        return _result(img, centroids, label_lut[bins], start_time)
+
+
+class PILQuantizer(object):
+    supports_warm_start = False
+
+    def __init__(self, method='median_cut'):
+        '''
+        Purpose: PIL's Image.quantize(), using median cut ('median_cut') or a fast octree ('octree'). The fit runs on the uint8 image.
+        '''
+        self.name = method
+        self.method = {'median_cut': Image.Quantize.MEDIANCUT, 'octree': Image.Quantize.FASTOCTREE}[method]
+
+    def quantize(self, img, num_clusters, init_centroids=None):
+        _pixels(img)
+        start_time = time.perf_counter()
+        pil_img = Image.fromarray((img*255).astype(np.uint8), 'RGB')
+        quantized = pil_img.quantize(colors=num_clusters, method=self.method)
+        labels = np.asarray(quantized).ravel()
+        palette = np.array(quantized.getpalette()[:3*(int(labels.max())+1)], dtype=np.float64).reshape(-1, 3)/255
+        return _result(img, palette, labels, start_time)
+
+
+QUANTIZERS = {'kmeans': KMeansQuantizer,
+              'minibatch': MiniBatchKMeansQuantizer,
+              'histogram': HistogramKMeansQuantizer,
+              'median_cut': lambda: PILQuantizer('median_cut'),
+              'octree': lambda: PILQuantizer('octree')}
+
+def get_quantizer(quantizer):
+    '''
+    Purpose: Returns the quantizer object for quantizer, which is either one of the names in QUANTIZERS or a quantizer object.
+    '''
+    if isinstance(quantizer, str):
+        if quantizer not in QUANTIZERS:
+            raise ValueError('Unknown quantizer {}. Choose from {}.'.format(quantizer, list(QUANTIZERS)))
+        return QUANTIZERS[quantizer]()
+    return quantizer
+
+def warm_start_centroids(centroids, labels, num_clusters, random_state=None):
+    '''
+    Purpose: Derives num_clusters initial centroids from a fit with at least as many clusters, by clustering its centroids
+             (weighted by the number of pixels in each cluster). This is far cheaper than a fit on the pixels.
+    Inputs: centroids [np.array]: (k, 3) centroids of the previous fit, where k >= num_clusters
+            labels [np.array]: cluster of each pixel in the previous fit
+    Returns: [np.array] (num_clusters, 3)
+    '''
+    if len(centroids) == num_clusters:
+        return centroids
+    weights = np.bincount(labels, minlength=len(centroids)).astype(np.float64) + 1e-9
+    return weighted_kmeans(centroids, weights, num_clusters, rng=np.random.default_rng(random_state))[0]
+
+def warm_started_fits(num_clusters_list, quantizer, fit):
+    '''
+    Purpose: Runs one fit for every value in num_clusters_list, from the largest down. When quantizer supports it, every fit is
+             warm-started from the centroids of the previous (larger) fit (see warm_start_centroids()).
+    Inputs: quantizer: quantizer object (see get_quantizer()) the fits use
+            fit [FUNCTION]: fit(num_clusters, init_centroids) runs one fit and returns a [TUPLE] (result, QuantizationResult of the
+                            fit). If the QuantizationResult is None (e.g. the fit failed), the next fit starts from scratch.
+    Returns: [DICT] of {num_clusters: result}
+    '''
+    results = {}
+    previous = None
+    for num_clusters in sorted(set(num_clusters_list), reverse=True):
+        init_centroids = None
+        if previous is not None and quantizer.supports_warm_start:
+            init_centroids = warm_start_centroids(previous.centroids, previous.labels, num_clusters, getattr(quantizer, 'random_state', None))
+        results[num_clusters], previous = fit(num_clusters, init_centroids)
+    return results
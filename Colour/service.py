@@ -0,0 +1,66 @@
+import json
+import warnings
+from JPEGConverter import JPEGColourConverter, JPEGClusterColourConverter
+#ServiceOverloaded is raised by convert() and imported here for its callers
+from common.service import BatchingService, ServiceOverloaded
+
+
+def _convert_requests(settings, images):
+    '''
+    Purpose: Converts a micro-batch of images that share settings to colour ASCII HTML documents, in a worker process.
+    Inputs: settings [DICT]: keyword arguments for JPEGColourConverter, or for JPEGClusterColourConverter if it has num_clusters
+            images [LIST]: image of every request (see JPEGColourConverter)
+    Returns: [LIST] of (HTML document [STRING], None) or (None, exception), in the same order as images
+    '''
+    converter_class = JPEGClusterColourConverter if settings.get('num_clusters') else JPEGColourConverter
+    results = []
+    for image in images:
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                #Nothing is saved, so output_dir is not used
+                converter = converter_class(img_path=image, output_dir='.', **settings)
+                converter.convert_to_colour_html()
+            results.append((converter.to_html(), None))
+        except Exception as e:
+            results.append((None, e))
+    return results
+
+
+class ConversionService(BatchingService):
+    def __init__(self, workers=None, max_queue=256, max_batch=16, max_batch_bytes=1 << 20, batch_window=0.002, timeout=30.0, reject_when_full=False, executor=None):
+        '''
+        Purpose: asyncio front-end that converts images to colour ASCII HTML in a pool of worker processes, so that the event loop
+                 (e.g. of an HTTP server) is never blocked by a conversion (resampling, colour quantization, serialization).
+                 Requests wait in a bounded queue. Whenever a worker is free, the oldest queued request is sent to it together with
+                 the other queued requests that have the same settings (a micro-batch), so they share one round trip to the pool.
+                 Under load, requests queue up while every worker is busy, and batches grow with the load.
+                 Use as
+                     async with ConversionService() as service:
+                         html = await service.convert(image_bytes, num_clusters=8, max_size=(50, 50))
+        Inputs: see common/service.BatchingService
+        '''
+        super().__init__(_convert_requests, workers=workers, max_queue=max_queue, max_batch=max_batch, max_batch_bytes=max_batch_bytes, batch_window=batch_window, timeout=timeout, reject_when_full=reject_when_full, executor=executor)
+
+    async def convert(self, image, num_clusters=None, line_height=1, font_size=5, timeout=None, **settings):
+        '''
+        Purpose: Converts image to a colour ASCII HTML document in a worker process.
+        Inputs: image: path to an image file, bytes or bytearray containing an encoded image, or np.ndarray (see
+                       JPEGColourConverter). It is sent to a worker process, so it must be picklable.
+                num_clusters [INT]: if given, the colours are reduced to num_clusters colours (see JPEGClusterColourConverter)
+                line_height, font_size: see JPEGColourConverter
+                timeout [FLOAT]: seconds before the request fails with TimeoutError, including the time spent waiting in the
+                                 queue. Defaults to the timeout of the service. A request whose batch is already being converted
+                                 cannot stop its worker, so the worker finishes the batch and the output is discarded.
+                settings: remaining keyword arguments for the converter (h_stretch, symbol, max_size, background_colour, css_classes,
+                          quantizer, ...)
+        Returns: [STRING] the HTML document
+        Raises: TimeoutError, ServiceOverloaded, or the exception raised by the conversion. Cancelling the calling task cancels the
+                request (it is then dropped from its batch if the batch has not been sent to a worker yet).
+        '''
+        settings = dict(settings, line_height=line_height, font_size=font_size)
+        if num_clusters:
+            settings['num_clusters'] = num_clusters
+        key = json.dumps(settings, sort_keys=True, default=str)
+        return await self.submit(key, (settings,), image, timeout)
+
@@ -0,0 +1,48 @@
+import os
+import shutil
+import logging
+import argparse
+import warnings
+from JPEGConverter import JPEGColourConverter, JPEGClusterColourConverter
+from ansi_writer import COLOUR_MODES
+from quantizers import QUANTIZERS
+
+
+def default_colour_mode():
+    '''
+    Purpose: 'truecolor' if the terminal announces 24-bit colour support (COLORTERM=truecolor or 24bit), else '256'.
+    '''
+    return 'truecolor' if os.environ.get('COLORTERM', '').lower() in ('truecolor', '24bit') else '256'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Displays an image as colour ASCII art in the terminal (ANSI escape sequences), without writing an HTML file or opening a web browser.')
+    parser.add_argument('image_path')
+    parser.add_argument('--columns', type=int, default=None, help='width of the output in characters (defaults to the width of the terminal)')
+    parser.add_argument('--colour-mode', default=None, choices=COLOUR_MODES, help='24-bit colour or the xterm 256-colour palette (defaults to truecolor if $COLORTERM announces it, else 256)')
+    parser.add_argument('--half-blocks', action='store_true', help='show two pixels per character (upper half blocks), for twice the vertical resolution')
+    parser.add_argument('--h-stretch', type=float, default=None, help='horizontal stretch of the image (defaults to 2, or 1 with --half-blocks, as terminal cells are about twice as tall as they are wide)')
+    parser.add_argument('--symbol', default='#')
+    parser.add_argument('--num-clusters', type=int, default=None, help='reduce the colours of the image to this many colours')
+    parser.add_argument('--quantizer', default='kmeans', choices=QUANTIZERS)
+    parser.add_argument('--no-fast-decode', dest='fast_decode', action='store_false', help='resample the full-resolution image (slower, more memory)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+    columns = args.columns or shutil.get_terminal_size().columns
+    h_stretch = args.h_stretch or (1.0 if args.half_blocks else 2.0)
+    #max_size is (max_height, max_width) before the horizontal stretch, and the height is not limited
+    settings = dict(img_path=args.image_path, output_dir='.', line_height=1, font_size=5, h_stretch=h_stretch, symbol=args.symbol, max_size=(float('inf'), columns/h_stretch), fast_decode=args.fast_decode)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        if args.num_clusters:
+            img_obj = JPEGClusterColourConverter(num_clusters=args.num_clusters, quantizer=args.quantizer, **settings)
+        else:
+            img_obj = JPEGColourConverter(**settings)
+        img_obj.convert_to_colour_html()
+    img_obj.print_to_terminal(args.colour_mode or default_colour_mode(), args.half_blocks)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
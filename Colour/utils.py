@@ -1,11 +1,10 @@
 import os
 import glob
-import functools
-import threading
-import sys
 import time
+import logging
 import functools
-import itertools
+
+logger = logging.getLogger(__name__)
 
 def safe_mkdir(dir_path):
     if not os.path.exists(dir_path):
@@ -25,29 +24,20 @@ def get_all_files(dir_path, file_ext):
     else: 
         return os.listdir(dir_path)
 
-def animate(func):
+def log_progress(func):
+    '''
+    Purpose: Logs (at INFO level, through the logging module) when func starts and how long it took. An optional loading_name
+             keyword argument names the item being processed in the messages.
+    '''
     @functools.wraps(func)
-    def animated_func(*args, **kwargs):        
-        try: 
-            loading_item_name = ' ' + kwargs['loading_name']
-            del kwargs['loading_name']
-        except:
-            loading_item_name = ' '
-
-        process_done = False
-        def loading_animation():
-            for c in itertools.cycle(['|', '/', '-', '\\']):
-                if process_done: 
-                    break
-                sys.stdout.write('\rLoading{} {}'.format(loading_item_name, c))
-                sys.stdout.flush()
-                time.sleep(0.1)
-        
-        t = threading.Thread(target=loading_animation)
-        t.setDaemon(True) #This ensures that should the main thread terminate, the animation() thread will terminate as well
-        t.start()
+    def logged_func(*args, **kwargs):
+        loading_item_name = kwargs.pop('loading_name', func.__name__)
+        logger.info('Processing %s...', loading_item_name)
+        start_time = time.perf_counter()
+        result = func(*args, **kwargs)
+        logger.info('Done: %s (%.2f s)', loading_item_name, time.perf_counter()-start_time)
+        return result
+    return logged_func
 
-        func(*args, **kwargs)
-        process_done = True
-        print('\rLoading Done!' + ' '*len(loading_item_name))
-    return animated_func
\ No newline at end of file
+#The former name of log_progress() (which replaced its spinner thread)
+animate = log_progress
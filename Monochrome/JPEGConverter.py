@@ -1,19 +1,33 @@
-from PIL import Image, ImageFont, ImageDraw
+from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 import string
 import os
-import json
+import io
+import sys
 from utils import safe_mkdir, get_all_files
-from yattag import Doc
+from common.image_io import open_image, reduce_image, raw_pixel_array, reduce_striped, text_writer, DEFAULT_MAX_BAND_BYTES
+from glyph_cache import GlyphDensityCache
+from common.instrumentation import span
+from archive import encode_symbols, write_archive, rows_to_html, FILE_EXT as ARCHIVE_FILE_EXT
+
+#Ways of choosing the symbol of each character cell (see JPEGtoASCII)
+GLYPH_MATCHING = ('density', 'structure')
+#Structure matching: sub-cells further than this from the mean of their cell (in pixel values) are brighter or darker than it
+STRUCTURE_THRESHOLD = 24
+#Largest number of sub-cells per character cell (the glyph index has 256*3**sub-cells entries)
+MAX_DESCRIPTOR_CELLS = 8
 
 
 class Buckets(object):
-    def __init__(self, num_buckets, symbols=None, reverse=False):
+    def __init__(self, num_buckets, symbols=None, reverse=False, font='Arial.ttf', font_size=100, glyph_cache=None):
         '''
         Purpose: Creates the buckets and sorts the symbol set.
         Inputs: num_buckets [INT]: number of buckets
                 symbols [LIST] of [STRINGS]: symbol set
                 reverse [BOOLEAN]: if False, inverts the colour scheme. Defaults to False
+                font [STRING]: font file (name or path) used to measure the intensity of each symbol. Defaults to Arial.
+                font_size [INT]: font size used to measure the intensity of each symbol. Defaults to 100.
+                glyph_cache [GlyphDensityCache]: cache of measured intensities. If None, the default cache (./data next to this file) is used.
         '''
         self.num_buckets = num_buckets
         self.min_value = 0
@@ -28,82 +42,171 @@ class Buckets(object):
             self.symbols = symbols
         assert self.num_buckets <= len(self.symbols), 'Number of buckets is greater than the number of characters available in the specified symbol set.'
 
-        #Generates sorted symbol set. (new or from .JSON file)
-        self.json_file_name = 'dump.JSON'
-        self.json_file_path = './data/{}'.format(self.json_file_name)
-        if os.path.exists('./data') and os.path.isfile(self.json_file_path):
-            print('\n(BUCKET) An existing .JSON file was found. Reading in data now.')
-            with open(self.json_file_path, 'r') as f:
-                data = json.load(f)
-            if set(self.symbols).issubset(data['original_symbol_list']):
-                print('(BUCKET) Symbol set in .JSON file matches with specified symbol set.\n(BUCKET) Using saved symbol set in .JSON file')
-                self.symbols = data['sorted_symbols']
-            else: 
-                print('(BUCKET) Symbol set in .JSON file does not match with specified symbol set.')
-                print('\n(BUCKET) New symbol set being generated...')
-                self.symbols = self._sort_symbols()
-        else: 
-            print('(BUCKET) New symbol set being generated...')
-            self.symbols = self._sort_symbols()
+        #Generates sorted symbol set (from the glyph density cache, measuring only uncached symbols)
+        self.font = font
+        self.font_size = font_size
+        self.glyph_cache = glyph_cache if glyph_cache is not None else GlyphDensityCache()
+        self.symbols = self._sort_symbols()
 
         #Generates the starting values of each bucket
         self.buckets = np.linspace(self.min_value, self.max_value, num=self.num_buckets, endpoint=False, dtype=np.int32)
         #Generates the indices of the symbols to be used (in self.symbols)
         self.buckets_symbols_index = np.linspace(1, len(self.symbols), num=self.num_buckets, dtype=np.int32)-1 
         self.used_symbols = [self.symbols[i] for i in self.buckets_symbols_index]
+        #Generates the lookup table mapping every pixel value (0-255) to its symbol
+        self.symbol_lut = self._build_symbol_lut()
+        #Shape descriptors of the used symbols and their indices, computed on demand: {descriptor_size: ...}
+        self.glyph_descriptors = {}
+        self.glyph_indices = {}
 
     def _sort_symbols(self):
         '''
-        Purpose: Sorts self.symbols in order of increasing intensity (how many pixels each symbol occupies)
-                 This function also creates a .JSON file that saves the intensity values of the symbols in self.symbols, as well as the sorted list of symbols. 
-        Note:The default font type used is Arial, font size = 100. There is no option to change this font type.
+        Purpose: Sorts self.symbols in order of increasing intensity (how many pixels each symbol occupies), or decreasing intensity if self.reverse is True.
+                 Intensities are read from self.glyph_cache, which only renders the symbols it has not measured before with this font.
         Returns: sorted [LIST] of symbols
         '''
-        helvetica = ImageFont.truetype('Arial.ttf', 100)
-        def _draw_symbol(symbol):
-            img = Image.new('RGB', (100,100), 'white')
-            draw = ImageDraw.Draw(img)
-            draw.text((0,0), symbol, font=helvetica, fill='#000000')
-            return img
-        
-        def _count_black_pixels(img):
-            pixels = list(img.getdata())
-            return len(list(filter(lambda rgb: sum(rgb)==0, pixels)))
-        
-        #Creates list of sorted symbols
-        symbol_store = []
-        for symbol in self.symbols:
-            symbol_store.append((symbol, _count_black_pixels(_draw_symbol(symbol))))
-        sorted_symbols = [s[0] for s in sorted(symbol_store, key=lambda x: x[1], reverse=self.reverse)]
-
-        #Creates and saves .JSON file
-        json_dump = {'original_symbol_list': self.symbols, 
-                     'intensity_values_unsorted': symbol_store, 
-                     'sorted_symbols': sorted_symbols}
-        safe_mkdir('./data')
-        with open('./data/{}'.format(self.json_file_name), 'w') as f:
-            json.dump(json_dump, f)
-
-        return sorted_symbols
-    
+        densities = self.glyph_cache.get_densities(self.symbols, self.font, self.font_size, self._measure_symbols)
+        return sorted(self.symbols, key=lambda symbol: densities[symbol], reverse=self.reverse)
+
+    @staticmethod
+    def _measure_symbols(font_obj, symbols, batch_size=1024):
+        '''
+        Purpose: Counts the number of pixels each symbol covers inside a (font_size x font_size) box when drawn at its top-left corner.
+                 The symbols are drawn in batches onto one mode 'L' atlas image, and the black pixels of every cell are counted in a
+                 single vectorised NumPy pass. Cells are sized from font_obj.getbbox() so that no glyph can overlap its neighbours.
+        Inputs: font_obj [ImageFont]: font to render the symbols with
+                symbols [LIST] of [STRINGS]: symbols to measure
+                batch_size [INT]: maximum number of symbols drawn onto one atlas image (bounds its memory use)
+        Returns: [DICT] of {symbol: number of black pixels}
+        '''
+        box_size = font_obj.size
+        densities = {}
+        for start in range(0, len(symbols), batch_size):
+            batch = symbols[start:start+batch_size]
+            bboxes = np.array([font_obj.getbbox(symbol) for symbol in batch], dtype=np.int64).reshape(-1, 4)
+
+            #Each cell holds the measured box and every part of every glyph outside it
+            offset_x = max(0, -int(bboxes[:, 0].min()))
+            offset_y = max(0, -int(bboxes[:, 1].min()))
+            cell_width = offset_x + max(box_size, int(bboxes[:, 2].max()))
+            cell_height = offset_y + max(box_size, int(bboxes[:, 3].max()))
+            num_cols = int(np.ceil(np.sqrt(len(batch))))
+            num_rows = -(-len(batch)//num_cols)
+
+            atlas = Image.new('L', (num_cols*cell_width, num_rows*cell_height), 255)
+            draw = ImageDraw.Draw(atlas)
+            for i, symbol in enumerate(batch):
+                row, col = divmod(i, num_cols)
+                draw.text((col*cell_width+offset_x, row*cell_height+offset_y), symbol, font=font_obj, fill=0)
+
+            cells = np.asarray(atlas).reshape(num_rows, cell_height, num_cols, cell_width)
+            boxes = cells[:, offset_y:offset_y+box_size, :, offset_x:offset_x+box_size]
+            counts = np.count_nonzero(boxes == 0, axis=(1, 3)).ravel()[:len(batch)]
+            densities.update(zip(batch, counts.tolist()))
+        return densities
+
+    def _build_symbol_lut(self):
+        '''
+        Purpose: Precomputes the symbol for every possible B/W pixel value, so that an entire image can be mapped to symbols with a single indexing operation.
+        Returns: np.array of shape (256,) containing the symbol (from self.used_symbols) for each pixel value
+        '''
+        pixel_values = np.arange(self.min_value, self.max_value+1)
+        bucket_indices = np.digitize(pixel_values, self.buckets) - 1
+        return np.array(self.used_symbols)[bucket_indices]
+
+    def get_glyph_descriptors(self, descriptor_size=(2, 3)):
+        '''
+        Purpose: Describes the shape of every symbol in self.used_symbols by the fraction of each of (columns x rows) sub-cells it covers,
+                 when drawn centred in a character cell (the widest advance of the used symbols by the line height of the font), as a
+                 monospaced terminal or <pre> block shows it. Computed once per descriptor_size. Raises OSError if the font cannot be loaded.
+        Inputs: descriptor_size [TUPLE]: (columns, rows) of sub-cells
+        Returns: [TUPLE] (descriptors, tone_lut): descriptors is a float32 np.array of shape (num_buckets, columns*rows) holding the
+                 coverage (0 to 1) of every used symbol, row by row. tone_lut is a float32 np.array of shape (256,) holding, for every
+                 pixel value, the mean coverage of the symbol that the density mapping (self.symbol_lut) picks for it.
+        '''
+        descriptor_size = tuple(descriptor_size)
+        if descriptor_size not in self.glyph_descriptors:
+            try:
+                font_obj = ImageFont.truetype(self.font, self.font_size)
+            except OSError:
+                raise OSError('Font {} could not be loaded. Structure matching needs it to render the glyphs.'.format(self.font))
+            ascent, descent = font_obj.getmetrics()
+            advances = [font_obj.getlength(symbol) for symbol in self.used_symbols]
+            cell_size = (max(1, int(np.ceil(max(advances)))), ascent+descent)
+            descriptors = np.empty((len(self.used_symbols), descriptor_size[0]*descriptor_size[1]), dtype=np.float32)
+            for i, (symbol, advance) in enumerate(zip(self.used_symbols, advances)):
+                cell = Image.new('L', cell_size, 0)
+                ImageDraw.Draw(cell).text(((cell_size[0]-advance)/2, 0), symbol, font=font_obj, fill=255)
+                #Box filter: each sub-cell averages the coverage of its pixels
+                descriptors[i] = np.asarray(cell.resize(descriptor_size, Image.BOX), dtype=np.float32).ravel()/255
+            bucket_indices = np.digitize(np.arange(self.min_value, self.max_value+1), self.buckets) - 1
+            tone_lut = descriptors.mean(axis=1)[bucket_indices]
+            self.glyph_descriptors[descriptor_size] = (descriptors, tone_lut)
+        return self.glyph_descriptors[descriptor_size]
+
+    def get_glyph_index(self, descriptor_size=(2, 3), threshold=STRUCTURE_THRESHOLD):
+        '''
+        Purpose: Precomputes the nearest glyph descriptor (see get_glyph_descriptors()) for every quantized character cell, so that
+                 structure matching is a table lookup. A cell of n = columns*rows sub-cells is quantized to its mean pixel value and
+                 the pattern of its sub-cells, each of which is darker than the mean by more than threshold, brighter by more than
+                 threshold, or neither. Every entry holds the symbol nearest (squared distance between tones, see tone_lut) to a cell
+                 with that mean whose darker and brighter sub-cells are 2*threshold away from it. Computed once per descriptor_size.
+        Returns: [np.array] uint8 of shape (256*3**n,) holding the index (in self.used_symbols) of the symbol of every cell, at
+                 mean*3**n + pattern, where pattern = sum(q_i*3**i) over the sub-cells i (row by row) and q_i is 0 (darker), 1 or 2 (brighter)
+        '''
+        descriptor_size = tuple(descriptor_size)
+        num_cells = descriptor_size[0]*descriptor_size[1]
+        if num_cells > MAX_DESCRIPTOR_CELLS:
+            raise ValueError('descriptor_size {} has more than {} sub-cells.'.format(descriptor_size, MAX_DESCRIPTOR_CELLS))
+        if descriptor_size not in self.glyph_indices:
+            descriptors, tone_lut = self.get_glyph_descriptors(descriptor_size)
+            num_patterns = 3**num_cells
+            patterns = np.arange(num_patterns)[:, np.newaxis]//3**np.arange(num_cells) % 3
+            norms = (descriptors**2).sum(axis=1)
+            index = np.empty((256, num_patterns), dtype=np.uint8)
+            for mean in range(256):
+                cells = tone_lut[np.clip(mean + (patterns-1)*2*threshold, 0, 255)]
+                #Squared distance to every descriptor, without |cell|^2 (the same for every symbol): |descriptor|^2 - 2 cell.descriptor
+                index[mean] = (norms - 2*cells @ descriptors.T).argmin(axis=1)
+            self.glyph_indices[descriptor_size] = index.ravel()
+        return self.glyph_indices[descriptor_size]
+
     def get_bucketed_symbols(self):
         return self.used_symbols
     
     def get_buckets(self):
         return self.buckets
+
+    def get_symbol_lut(self):
+        return self.symbol_lut
     
 
+def symbols_to_rows(symbol_img):
+    '''
+    Purpose: Joins the symbols of every row of symbol_img into one STRING.
+    Inputs: symbol_img [np.array] of [STRINGS]: (rows, columns) symbol of every pixel (e.g. Buckets.get_symbol_lut()[pixels])
+    Returns: [LIST] of [STRINGS], one per row
+    '''
+    if symbol_img.dtype.itemsize == np.dtype('U1').itemsize:
+        #Single-character symbols: reinterpret each row of characters as one string
+        return np.ascontiguousarray(symbol_img).view('U{}'.format(symbol_img.shape[1])).ravel().tolist()
+    return [''.join(row) for row in symbol_img.tolist()]
+
+
 class JPEGtoASCII(object):
-    def __init__(self, image_path, num_buckets, save_file_name, h_stretch=1.5, save_file_path_html='.', save_file_path_txt = '.', html_line_height = 0.05, html_font_size = 1, max_size=(100, 300), symbols=None, reverse=False):
+    def __init__(self, image_path, num_buckets, save_file_name=None, h_stretch=1.5, save_file_path_html='.', save_file_path_txt = '.', html_line_height = 0.05, html_font_size = 1, max_size=(100, 300), symbols=None, reverse=False, font='Arial.ttf', font_size=100, bucket_obj=None, fast_decode=True, max_band_bytes=DEFAULT_MAX_BAND_BYTES, glyph_matching='density', descriptor_size=(2, 3)):
         '''
         Purpose: Converts a JPEG file provided at image_path into an ASCII text object
 
-        Inputs: image_path [STRING]: path to JPEG file
+        Inputs: image_path [STRING]: path to JPEG file. The image may also be given directly (without touching the filesystem) as a
+                                     np.ndarray (uint8, (height, width) or (height, width, 3); other dtypes raise ValueError), a PIL Image, a bytes-like object
+                                     (bytes, bytearray, memoryview) containing an encoded image, or a binary file object.
+                                     Arrays, mode 'L' images and buffers are used without being copied.
                 num_buckets [INT]: number of buckets to bin colour values of pixels in JPEG image
                 save_file_path_txt [STRING]: path to directory containing the generated ASCII text files
                                          (defaults to the current directory)
                 save_file_path_html [STRING]: path to directory containing the generated ASCII html files (defaults to the current directory)
-                save_file_name [STRING]: name of ASCII .txt file generated
+                save_file_name [STRING]: name of ASCII .txt file generated. Defaults to the name of the image file (or 'image' for in-memory images)
                 h_stretch [FLOAT]: determines by what factor the image is stretched horizontally
                 max_size [TUPLE]: (max_width, max_height) to ensure that the generated ASCII text files
                                   can fit inside the screen 
@@ -111,15 +214,39 @@ class JPEGtoASCII(object):
                 html_line_height [FLOAT]: sets the line_height for the html files (the smaller, the more detail)
                 html_font_size [INT]: sets the font_size for the html files (the smaller, the more detail)
                 reverse [BOOLEAN]: if False, inverts the colour scheme. Defaults to False.
+                font [STRING]: font file used to measure the intensity of each symbol (see Buckets)
+                font_size [INT]: font size used to measure the intensity of each symbol (see Buckets)
+                bucket_obj [Buckets]: a prebuilt Buckets object to share between images. If this is None (i.e. the default value), a new Buckets object is
+                                      created from num_buckets, symbols, reverse, font and font_size
+                fast_decode [BOOLEAN]: if True, large images are decoded at a reduced scale and shrunk to about twice the output size
+                                       before the final resample (see common/image_io.reduce_image()), which saves most of the decode time and
+                                       memory. If False, the full-resolution image is resampled. Defaults to True.
+                max_band_bytes [INT]: with fast_decode, uint8 arrays (including np.memmap) and image files that store their pixels
+                                      uncompressed (e.g. uncompressed TIFF, PPM/PGM, BMP) are read and shrunk in horizontal bands of
+                                      at most this many bytes (see common/image_io.reduce_striped()), so memory use does not grow with the size
+                                      of the image. The output is the same as without bands.
+                glyph_matching [STRING]: 'density' (the default) picks the symbol of each character cell from the brightness of one
+                                         pixel. 'structure' samples every cell on a grid of descriptor_size sub-cells and picks the
+                                         used symbol whose shape is nearest (see Buckets.get_glyph_index()), so edges and texture
+                                         within a cell are kept at the same number of columns. Flat areas keep the tones of 'density'.
+                                         The font must be loadable, as the glyphs are rendered to describe their shape.
+                descriptor_size [TUPLE]: (columns, rows) of sub-cells per character cell for 'structure', at most 8 sub-cells.
+                                         Defaults to (2, 3), which makes sub-cells about square with the default h_stretch.
         '''
+        if glyph_matching not in GLYPH_MATCHING:
+            raise ValueError('Unknown glyph_matching {}. Choose from {}.'.format(glyph_matching, list(GLYPH_MATCHING)))
+
         #Bucket Attribtues
-        self.bucket_obj = Buckets(num_buckets, symbols, reverse)
+        if bucket_obj is None:
+            bucket_obj = Buckets(num_buckets, symbols, reverse, font, font_size)
+        self.bucket_obj = bucket_obj
         self.used_symbols = self.bucket_obj.get_bucketed_symbols()
         self.buckets = self.bucket_obj.get_buckets()
+        self.symbol_lut = self.bucket_obj.get_symbol_lut()
 
         #Image Attributes
         self.image_path = image_path
-        self.img = Image.open(image_path).convert('L') #convert image to Black and White
+        self.img = open_image(image_path)
         self.img_height = self.img.height
         self.img_width = self.img.width
         self.max_size = max_size
@@ -127,6 +254,8 @@ class JPEGtoASCII(object):
         #Miscellaneous Attribtues
         self.save_file_path_txt = save_file_path_txt
         self.save_file_path_html = save_file_path_html
+        if save_file_name is None:
+            save_file_name = os.path.splitext(os.path.basename(image_path))[0] if isinstance(image_path, (str, os.PathLike)) else 'image'
         self.save_file_name = save_file_name
         self.html_line_height = html_line_height
         self.html_font_size = html_font_size
@@ -135,45 +264,138 @@ class JPEGtoASCII(object):
         self.resized_width = int(self.resize_ratio*self.img_width*self.h_stretch)
         self.resized_height = int(self.resize_ratio*self.img_height)
         self.resized_size = (self.resized_width, self.resized_height)
+        self.glyph_matching = glyph_matching
+        self.descriptor_size = tuple(descriptor_size)
+        #Size the image is resampled to: one pixel per character cell, or one per sub-cell for structure matching. The box filter
+        #that averages sub-cells needs no more than the sampled pixels, while bicubic resampling is given twice as many.
+        if self.glyph_matching == 'structure':
+            self.sample_size = (self.resized_width*self.descriptor_size[0], self.resized_height*self.descriptor_size[1])
+            oversample = 1
+        else:
+            self.sample_size = self.resized_size
+            oversample = 2
+
+        #Decodes the image (only the header has been read so far) and converts it to Black and White
+        with span('decode', image=self.save_file_name, pixels=self.img_width*self.img_height) as decode_span:
+            pixels = None
+            if fast_decode and not isinstance(image_path, Image.Image):
+                pixels = image_path if isinstance(image_path, np.ndarray) else raw_pixel_array(self.img)
+            if pixels is not None and pixels.dtype == np.uint8 and (pixels.ndim == 2 or pixels.shape[2:] == (3,)):
+                decode_span.set(striped=True)
+                self.img = reduce_striped(pixels, 'L', self.sample_size, oversample, max_band_bytes)
+            elif fast_decode:
+                #Images given by the caller as PIL Images are not drafted, as Image.draft() would change them
+                self.img = reduce_image(self.img, 'L', self.sample_size, oversample, draft=not isinstance(image_path, Image.Image))
+            elif self.img.mode != 'L':
+                self.img = self.img.convert('L')
+            self.img.load()
         
     def convert_to_ascii(self):
         #Converts image to appropriate size
-        self.img = self.img.resize(self.resized_size, Image.BICUBIC)
+        with span('resize', image=self.save_file_name, pixels=self.sample_size[0]*self.sample_size[1]):
+            #Each sub-cell of structure matching averages the pixels it covers
+            self.img = self.img.resize(self.sample_size, Image.BOX if self.glyph_matching == 'structure' else Image.BICUBIC)
 
-        self.ascii_img = [[] for row in range(self.resized_height)] #index into ascii_img[row][column]
-        pixels = list(self.img.getdata())
-        # self.ascii_img = [pixels[(i*self.img_width):((i+1)*self.img_width)] for i in range(self.img_height)] #index into ascii_img[row][column]
+        #Maps every pixel (or every cell of sub-cell pixels) to its symbol in one pass. Each row of self.ascii_img is a STRING.
+        #self.symbol_img keeps the (rows, columns) array of symbols for write_archive().
+        with span('symbol_map', image=self.save_file_name, pixels=self.resized_width*self.resized_height, matching=self.glyph_matching):
+            pixels = np.asarray(self.img)
+            if self.glyph_matching == 'structure':
+                self.symbol_img = self.match_glyphs(pixels)
+            else:
+                self.symbol_img = self.symbol_lut[pixels]
+            self.ascii_img = symbols_to_rows(self.symbol_img)
+
+    def match_glyphs(self, pixels):
+        '''
+        Purpose: Picks the symbol of every character cell by nearest glyph descriptor, through the glyph index of
+                 Buckets.get_glyph_index(). Each (columns x rows) cell of pixels is quantized (see get_glyph_index()) with a few
+                 whole-image NumPy operations per sub-cell, and the symbols are then looked up all at once.
+        Inputs: pixels [np.array]: uint8 image of shape (resized_height*rows, resized_width*columns)
+        Returns: [np.array] of symbols, of shape (resized_height, resized_width)
+        '''
+        columns, rows = self.descriptor_size
+        num_cells = columns*rows
+        index = self.bucket_obj.get_glyph_index(self.descriptor_size)
+        #One contiguous (resized_height, resized_width) plane per sub-cell
+        planes = np.ascontiguousarray(pixels.reshape(self.resized_height, rows, self.resized_width, columns).transpose(1, 3, 0, 2)).reshape(num_cells, -1)
+        #int16 holds the sum of up to 8 sub-cells and every pattern (3**8 = 6561)
+        means = (planes.sum(axis=0, dtype=np.int16) + num_cells//2)//num_cells
+        darker = planes < means - STRUCTURE_THRESHOLD
+        brighter = planes > means + STRUCTURE_THRESHOLD
+
+        #Pattern: sum(q_i*3**i), with q_i = 1 - darker_i + brighter_i
+        weights = 3**np.arange(num_cells, dtype=np.int16)
+        patterns = np.full_like(means, weights.sum())
+        weighted = np.empty_like(means)
+        for i in range(num_cells):
+            patterns += np.multiply(brighter[i], weights[i], out=weighted)
+            patterns -= np.multiply(darker[i], weights[i], out=weighted)
+        positions = means.astype(np.int32)*3**num_cells + patterns
+        symbol_indices = index[positions].reshape(self.resized_height, self.resized_width)
+        return np.array(self.used_symbols)[symbol_indices]
 
-        for index, pixel in enumerate(pixels):
-            row = int(index/self.resized_width)
-            bucket_index = np.digitize(pixel, self.buckets) - 1
-            symbol_to_append = self.used_symbols[bucket_index]
-            self.ascii_img[row].append(symbol_to_append)
-    
     def print_img_to_console(self):
-        for row in self.ascii_img:
-            for pixel in row:
-                print(pixel, end = '')
-            print('\n')
+        #One write per row instead of one print() per symbol
+        self.write_text(sys.stdout)
     
+    def write_text(self, f):
+        '''
+        Purpose: Writes the ASCII art as text to the file object f (text or binary). convert_to_ascii() must be called first.
+        '''
+        with span('serialize', image=self.save_file_name, format='txt', pixels=self.resized_width*self.resized_height) as serialize_span, text_writer(f) as f:
+            f = serialize_span.count_writes(f)
+            for row in self.ascii_img:
+                f.write(''.join(row)+'\n')
+
+    def to_text(self):
+        f = io.StringIO()
+        self.write_text(f)
+        return f.getvalue()
+
     def save_to_file(self):
-        ascii_img_str = []
-        for row in self.ascii_img:
-            ascii_img_str.append(''.join(row)+'\n')
         with open(os.path.join(self.save_file_path_txt, self.save_file_name+'.txt'), 'w') as f:
-            for row_str in ascii_img_str:
-                f.write(row_str)
+            self.write_text(f)
+
+    def write_html(self, f):
+        '''
+        Purpose: Writes the ASCII art as HTML to the file object f (text or binary). convert_to_ascii() must be called first.
+        '''
+        with span('serialize', image=self.save_file_name, format='html', pixels=self.resized_width*self.resized_height) as serialize_span, text_writer(f) as f:
+            serialize_span.count_writes(f).write(rows_to_html(self.ascii_img, self.html_line_height, self.html_font_size))
+
+    def to_html(self):
+        f = io.StringIO()
+        self.write_html(f)
+        return f.getvalue()
     
     def save_as_html(self):
-        #Initialisation of yattag module
-        doc, tag, text = Doc().tagtext()
-
-        #Parsing symbols
-        for row in self.ascii_img:
-            with tag('pre', color = "#000000", style='white-space:PRE;line-height:{};font-size:{}px'.format(self.html_line_height, self.html_font_size)):
-                text(''.join(row))
         with open(os.path.join(self.save_file_path_html, self.save_file_name+'.html'), 'w') as f:
-            f.write(doc.getvalue())
+            self.write_html(f)
+
+    def write_archive(self, f, compression='zlib'):
+        '''
+        Purpose: Writes the ASCII art to the binary file object f as a compact archive (symbol table and one uint8 per character,
+                 compressed in chunks of rows; see archive.py), from which archive.ArchiveReader renders any range of rows as text or
+                 HTML. convert_to_ascii() must be called first.
+        Inputs: compression [STRING]: 'zlib', 'lzma', 'zstd' (needs the zstandard package) or 'none'
+        '''
+        with span('serialize', image=self.save_file_name, format='archive', compression=compression, pixels=self.resized_width*self.resized_height) as serialize_span:
+            symbols, symbol_indices = encode_symbols(self.symbol_img)
+            render = {'html_line_height': self.html_line_height, 'html_font_size': self.html_font_size}
+            serialize_span.set(bytes_written=write_archive(f, symbols, symbol_indices, render, compression))
+
+    def to_archive(self, compression='zlib'):
+        f = io.BytesIO()
+        self.write_archive(f, compression)
+        return f.getvalue()
+
+    def save_as_archive(self, save_file_path=None, compression='zlib'):
+        '''
+        Purpose: Saves the archive (see write_archive()) as <save_file_name>.asca in save_file_path (defaults to save_file_path_txt).
+        '''
+        with open(os.path.join(save_file_path or self.save_file_path_txt, self.save_file_name+ARCHIVE_FILE_EXT), 'wb') as f:
+            self.write_archive(f, compression)
         
 
 
@@ -192,33 +414,32 @@ if __name__ == '__main__':
     symbols = None
     html_line_height = 0.2
     html_font_size = 5
+    workers = None #Number of worker processes (None uses every CPU)
 
     #Set directories
-    save_file_path = './GeneratedASCII'
     save_file_path_txt = './GeneratedASCII/txt'
     save_file_path_html = './GeneratedASCII/html'
     image_src_dir = './Images'
     
-    #Get ASCII text files
-    safe_mkdir(save_file_path)
-    safe_mkdir(save_file_path_txt)
-    safe_mkdir(save_file_path_html)
-    for image_path in get_all_files(image_src_dir, file_ext='.jpg'):
-        file_name = os.path.splitext(os.path.basename(image_path))[0]
-        image = JPEGtoASCII(image_path=image_path, 
-                            num_buckets=num_buckets, 
-                            save_file_name=file_name, 
-                            h_stretch=h_stretch, 
-                            save_file_path_html=save_file_path_html,
-                            save_file_path_txt=save_file_path_txt, 
-                            html_font_size=html_font_size,
-                            html_line_height=html_line_height,
-                            max_size=max_size, 
-                            symbols=symbols, 
-                            reverse=reverse)
-        image.convert_to_ascii()
-        image.save_to_file()
-        image.save_as_html()
+    #Get ASCII text files (converted in parallel, see batch.py). Outputs of unchanged images are copied from the output cache.
+    import batch
+    import logging
+    from common.output_cache import OutputCache
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    cache = OutputCache(batch.DEFAULT_CACHE_DIR, version=batch.CACHE_VERSION)
+    results = batch.convert_directory(image_src_dir=image_src_dir,
+                                      save_file_path_txt=save_file_path_txt,
+                                      save_file_path_html=save_file_path_html,
+                                      num_buckets=num_buckets,
+                                      h_stretch=h_stretch,
+                                      html_font_size=html_font_size,
+                                      html_line_height=html_line_height,
+                                      max_size=max_size,
+                                      symbols=symbols,
+                                      reverse=reverse,
+                                      workers=workers,
+                                      cache=cache)
+    batch.report(results, cache)
 
 
     #Unicode symbols
@@ -0,0 +1,165 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import collections
+import numpy as np
+from PIL import Image, ImageSequence
+from JPEGConverter import JPEGtoASCII, symbols_to_rows
+from common.image_io import open_image, reduce_image, text_writer
+
+#ANSI escape sequences
+HIDE_CURSOR = '\x1b[?25l'
+SHOW_CURSOR = '\x1b[?25h'
+CLEAR_SCREEN = '\x1b[2J'
+ERASE_LINE = '\x1b[K'
+
+
+def move_cursor(row, column):
+    '''
+    Purpose: ANSI escape sequence that moves the cursor to (row, column), counted from 0 at the top-left corner of the terminal.
+    '''
+    return '\x1b[{};{}H'.format(row+1, column+1)
+
+
+class JPEGtoASCIIAnimation(JPEGtoASCII):
+    def __init__(self, image_path, num_buckets, save_file_name=None, h_stretch=1.5, max_size=(100, 50), symbols=None, reverse=False, font='Arial.ttf', font_size=100, bucket_obj=None, fast_decode=True, default_duration=100):
+        '''
+        Purpose: Converts an animated image (GIF, APNG, animated WebP, multi-page TIFF, ...) to ASCII art one frame at a time, and plays
+                 it in a terminal. Frames are decoded lazily, so the animation is never held in memory. The symbol lookup table and the
+                 resize geometry (taken from the first frame) are computed once and shared by every frame.
+        Inputs: default_duration [INT]: display time (in milliseconds) of frames that do not specify one
+                See JPEGtoASCII for the other inputs. convert_to_ascii() and the methods that write its output use the first frame.
+        '''
+        #The image is opened once; JPEGtoASCII converts a copy of its first frame and every frame is later read from self.sequence
+        self.sequence = open_image(image_path)
+        if save_file_name is None and isinstance(image_path, (str, os.PathLike)):
+            save_file_name = os.path.splitext(os.path.basename(image_path))[0]
+        super().__init__(image_path=self.sequence, num_buckets=num_buckets, save_file_name=save_file_name, h_stretch=h_stretch, max_size=max_size, symbols=symbols, reverse=reverse, font=font, font_size=font_size, bucket_obj=bucket_obj, fast_decode=fast_decode)
+        self.image_path = image_path
+        self.fast_decode = fast_decode
+        self.default_duration = default_duration
+
+        #Frames are compared through the index of each symbol (one byte per cell) rather than the symbols themselves
+        self.frame_symbols, symbol_codes = np.unique(self.symbol_lut, return_inverse=True)
+        self.symbol_code_lut = symbol_codes.astype(np.uint8)
+        #Width (in characters) of every symbol, or None if the symbols differ in width (only whole rows can then be redrawn)
+        symbol_widths = set(len(symbol) for symbol in self.frame_symbols.tolist())
+        self.symbol_width = symbol_widths.pop() if len(symbol_widths) == 1 else None
+
+    def frames(self):
+        '''
+        Purpose: Decodes and converts the frames one at a time.
+        Yields: [TUPLE] (codes, duration): codes is a (rows, columns) np.array of uint8 holding the index (in self.frame_symbols) of
+                the symbol of every cell, and duration is the display time of the frame in seconds
+        '''
+        for frame in ImageSequence.Iterator(self.sequence):
+            duration = frame.info.get('duration') or self.default_duration
+            if self.fast_decode:
+                img = reduce_image(frame, 'L', self.resized_size, draft=False)
+            else:
+                img = frame.convert('L')
+            img = img.resize(self.resized_size, Image.BICUBIC)
+            yield self.symbol_code_lut[np.asarray(img)], duration/1000
+
+    def render_frame(self, codes, previous_codes=None):
+        '''
+        Purpose: Builds the ANSI output that turns the terminal from previous_codes into codes. If previous_codes is None, every row is
+                 drawn. Else only the changed rows are redrawn, from their first to their last changed cell (whole rows if the symbols
+                 differ in width).
+        Returns: [STRING]
+        '''
+        rows = symbols_to_rows(self.frame_symbols[codes])
+        if previous_codes is None:
+            return ''.join([move_cursor(i, 0) + row for i, row in enumerate(rows)])
+
+        changed = codes != previous_codes
+        changed_rows = np.flatnonzero(changed.any(axis=1))
+        if self.symbol_width is None:
+            return ''.join([move_cursor(i, 0) + rows[i] for i in changed_rows.tolist()])
+        changed = changed[changed_rows]
+        starts = changed.argmax(axis=1)*self.symbol_width
+        ends = (changed.shape[1] - changed[:, ::-1].argmax(axis=1))*self.symbol_width
+        return ''.join([move_cursor(i, start) + rows[i][start:end] for i, start, end in zip(changed_rows.tolist(), starts.tolist(), ends.tolist())])
+
+    def play(self, f=None, loop=False, fps=None, show_fps=True, realtime=True):
+        '''
+        Purpose: Plays the animation in a terminal, using ANSI escape sequences to redraw only what changed between frames. Each frame
+                 is sent to f in a single write. Playback can be stopped with Ctrl+C.
+        Inputs: f [FILE]: file object of the terminal (text or binary). Defaults to sys.stdout.
+                loop [BOOLEAN]: if True, the animation is repeated until it is interrupted
+                fps [FLOAT]: playback frame rate. If None, every frame is shown for its own duration (the source frame rate).
+                show_fps [BOOLEAN]: if True, the measured frame rate is shown below the animation
+                realtime [BOOLEAN]: if False, frames are drawn as fast as possible, without waiting (e.g. for benchmarking)
+        Returns: [FLOAT] the mean frame rate over the whole playback
+        '''
+        f = sys.stdout if f is None else f
+        frame_times = collections.deque(maxlen=30) #Times at which the last 30 frames were drawn
+        num_frames = 0
+        previous_codes = None
+        with text_writer(f) as f:
+            f.write(HIDE_CURSOR + CLEAR_SCREEN)
+            start_time = next_time = time.perf_counter()
+            try:
+                while True:
+                    for codes, duration in self.frames():
+                        output = self.render_frame(codes, previous_codes)
+                        previous_codes = codes
+                        frame_times.append(time.perf_counter())
+                        num_frames += 1
+                        if show_fps and len(frame_times) > 1:
+                            measured_fps = (len(frame_times)-1)/(frame_times[-1]-frame_times[0])
+                            output += move_cursor(codes.shape[0], 0) + 'fps: {:5.1f}'.format(measured_fps) + ERASE_LINE
+                        f.write(output)
+                        f.flush()
+
+                        if realtime:
+                            next_time += 1/fps if fps else duration
+                            delay = next_time - time.perf_counter()
+                            if delay > 0:
+                                time.sleep(delay)
+                            else:
+                                #Running behind: carry on from now rather than rushing the next frames to catch up
+                                next_time = time.perf_counter()
+                    if not loop:
+                        break
+            except KeyboardInterrupt:
+                pass
+            finally:
+                last_row = previous_codes.shape[0]+1 if previous_codes is not None else 0
+                f.write(move_cursor(last_row, 0) + SHOW_CURSOR + '\n')
+                f.flush()
+        elapsed = time.perf_counter() - start_time
+        return num_frames/elapsed if elapsed > 0 else 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Plays an animated image (GIF, APNG, WebP, ...) as ASCII art in the terminal.')
+    parser.add_argument('image_path')
+    parser.add_argument('--num-buckets', type=int, default=80)
+    parser.add_argument('--h-stretch', type=float, default=1.5)
+    parser.add_argument('--max-size', type=int, nargs=2, default=(100, 50), metavar=('MAX_WIDTH', 'MAX_HEIGHT'))
+    parser.add_argument('--reverse', action='store_true', help='map bright pixels to sparse symbols (for terminals with a light background)')
+    parser.add_argument('--font', default='Arial.ttf', help='font used to measure the intensity of each symbol')
+    parser.add_argument('--font-size', type=int, default=100)
+    parser.add_argument('--fps', type=float, default=None, help='playback frame rate (defaults to the frame rate of the image)')
+    parser.add_argument('--loop', action='store_true', help='repeat the animation until interrupted (Ctrl+C)')
+    parser.add_argument('--no-fps-counter', dest='show_fps', action='store_false')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    animation = JPEGtoASCIIAnimation(image_path=args.image_path,
+                                     num_buckets=args.num_buckets,
+                                     h_stretch=args.h_stretch,
+                                     max_size=tuple(args.max_size),
+                                     reverse=args.reverse,
+                                     font=args.font,
+                                     font_size=args.font_size)
+    mean_fps = animation.play(loop=args.loop, fps=args.fps, show_fps=args.show_fps)
+    print('Mean frame rate: {:.1f} fps'.format(mean_fps))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
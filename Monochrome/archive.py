@@ -0,0 +1,131 @@
+import sys
+import argparse
+import numpy as np
+from common.image_io import text_writer
+from common.archive import ArchiveReader as _ArchiveReader, DEFAULT_ROWS_PER_CHUNK, FILE_EXT, write_chunks
+
+#Archive of ASCII art (.asca), in the container of common/archive.py (in the repository root). The header also holds the settings
+#needed to render the HTML document, and each chunk holds rows_per_chunk rows of symbol indices (one uint8 per character, omitted if
+#there is only one symbol).
+
+
+def encode_symbols(symbol_img):
+    '''
+    Purpose: Splits an image of symbols into a symbol table and the index of every symbol in it.
+    Inputs: symbol_img [np.array] of [STRINGS]: (rows, columns) symbol of every character
+    Returns: [TUPLE] (symbols [LIST] of [STRINGS], sorted; indices [np.array] of uint8 with the shape of symbol_img)
+    '''
+    if symbol_img.dtype == np.dtype('U1'):
+        #Single-character symbols are compared as code points
+        codes, indices = np.unique(np.ascontiguousarray(symbol_img).view(np.uint32), return_inverse=True)
+        symbols = [chr(code) for code in codes.tolist()]
+    else:
+        symbols, indices = np.unique(symbol_img, return_inverse=True)
+        symbols = symbols.tolist()
+    if len(symbols) > 256:
+        raise ValueError('An archive holds at most 256 different symbols, not {}.'.format(len(symbols)))
+    return symbols, indices.reshape(symbol_img.shape).astype(np.uint8)
+
+def write_archive(f, symbols, symbol_indices, render=None, compression='zlib', rows_per_chunk=DEFAULT_ROWS_PER_CHUNK):
+    '''
+    Purpose: Writes ASCII art to the binary file object f as an archive.
+    Inputs: symbols [LIST] of [STRINGS]: symbol table (at most 256 symbols)
+            symbol_indices [np.array] of uint8: (rows, columns) index in symbols of every character (see encode_symbols())
+            render [DICT]: settings used to render the HTML document (html_line_height, html_font_size)
+            compression [STRING]: 'zlib' (the default), 'lzma' (smaller, slower), 'zstd' (needs the zstandard package) or 'none'
+            rows_per_chunk [INT]: number of rows compressed together (the unit of lazy decoding)
+    Returns: [INT] number of bytes written
+    '''
+    height, width = symbol_indices.shape
+    payloads = [symbol_indices[start:start+rows_per_chunk].tobytes() if len(symbols) > 1 else b'' for start in range(0, height, rows_per_chunk)]
+    header = {'width': width, 'height': height, 'symbols': list(symbols), 'rows_per_chunk': rows_per_chunk, 'render': render or {}}
+    return write_chunks(f, header, payloads, compression)
+
+
+def rows_to_html(rows, line_height, font_size):
+    '''
+    Purpose: HTML document of rows of ASCII art (one <pre> element per row).
+    Inputs: rows [LIST] of [STRINGS]
+            line_height [FLOAT], font_size [INT]: line height and font size (in pixels) of the text
+    Returns: [STRING]
+    '''
+    #yattag is only imported when HTML is written
+    from yattag import Doc
+    doc, tag, text = Doc().tagtext()
+    style = 'white-space:PRE;line-height:{};font-size:{}px'.format(line_height, font_size)
+    for row in rows:
+        with tag('pre', color='#000000', style=style):
+            text(row)
+    return doc.getvalue()
+
+
+class ArchiveReader(_ArchiveReader):
+    def __init__(self, source):
+        '''
+        Purpose: Reads an archive lazily: only the header is read here, and read_rows() (and the renderers built on it) read and
+                 decompress only the chunks that hold the rows asked for.
+        Inputs: source: path of the archive, a bytes-like object containing it, or a binary file object (seekable)
+        '''
+        super().__init__(source)
+        #Code point of every symbol, so that rows of single-character symbols are built without joining strings
+        self.symbol_codes = np.array([ord(symbol) for symbol in self.symbols], dtype=np.uint32) if all(len(symbol) == 1 for symbol in self.symbols) else None
+
+    def _check_header(self, header):
+        if header.get('colour') is not None:
+            raise ValueError('The archive has colours (it was written by the Colour converter).')
+
+    def _decode_chunk(self, i, num_rows):
+        #Symbol indices of the rows of chunk i
+        if len(self.symbols) > 1:
+            return np.frombuffer(self._payload(i), dtype=np.uint8).reshape(num_rows, self.width)
+        return np.zeros((num_rows, self.width), dtype=np.uint8)
+
+    def read_rows(self, start=0, stop=None):
+        '''
+        Purpose: Decodes rows start to stop (excluded, as in a slice; stop=None reads to the last row).
+        Returns: [np.array] of uint8: (rows, columns) index in self.symbols of every character
+        '''
+        chunks, rows = self._row_chunks(start, stop)
+        return np.concatenate(chunks)[rows] if chunks else np.zeros((0, self.width), dtype=np.uint8)
+
+    def rows(self, start=0, stop=None):
+        '''
+        Returns: [LIST] of [STRINGS]: rows start to stop of the ASCII art (see read_rows())
+        '''
+        indices = self.read_rows(start, stop)
+        if self.symbol_codes is not None:
+            return np.ascontiguousarray(self.symbol_codes[indices]).view('U{}'.format(self.width)).ravel().tolist() if self.width else ['']*len(indices)
+        symbols = np.array(self.symbols, dtype=object)
+        return [''.join(row) for row in symbols[indices].tolist()]
+
+    def to_text(self, start=0, stop=None):
+        return ''.join(row+'\n' for row in self.rows(start, stop))
+
+    def to_html(self, start=0, stop=None):
+        render = self.header['render']
+        return rows_to_html(self.rows(start, stop), render.get('html_line_height', 0.05), render.get('html_font_size', 1))
+
+    def to_ansi(self, start=0, stop=None):
+        #Monochrome art has no colours, so the text is shown as it is
+        return self.to_text(start, stop)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Renders rows of an ASCII art archive (.asca) as text or HTML on standard output.')
+    parser.add_argument('archive_path')
+    parser.add_argument('--format', default='txt', choices=['txt', 'html', 'ansi'])
+    parser.add_argument('--rows', type=int, nargs='+', default=[0], metavar=('START', 'STOP'), help='range of rows to render (STOP excluded). Without STOP, renders up to the last row.')
+    args = parser.parse_args(argv)
+    if len(args.rows) > 2:
+        parser.error('--rows takes START and an optional STOP, not {} values'.format(len(args.rows)))
+    rows = (args.rows+[None])[:2]
+
+    with ArchiveReader(args.archive_path) as reader:
+        renderers = {'txt': reader.to_text, 'html': reader.to_html, 'ansi': reader.to_ansi}
+        with text_writer(sys.stdout) as f:
+            f.write(renderers[args.format](*rows))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
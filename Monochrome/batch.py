@@ -0,0 +1,307 @@
+import os
+import time
+import logging
+import argparse
+import collections
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from JPEGConverter import Buckets, JPEGtoASCII, GLYPH_MATCHING
+from utils import safe_mkdir, get_all_files
+from common.instrumentation import JSONLinesSink, set_sink
+from common.output_cache import OutputCache, hash_file, DEFAULT_MAX_BYTES
+from common.watcher import DirectoryWatcher, remove_outputs
+
+logger = logging.getLogger(__name__)
+
+#Output cache of this converter (see common/output_cache.py). CACHE_VERSION is bumped whenever a change to the converter changes its
+#output, so that entries written by older versions are never hit.
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'output_cache')
+CACHE_VERSION = 1
+
+#cached is True if the outputs were copied from the output cache instead of being converted
+BatchResult = collections.namedtuple('BatchResult', ['image_path', 'save_file_name', 'error', 'cached'], defaults=(False,))
+
+#Buckets object and OutputCache shared by every job running in this (worker) process. Set once by _init_worker().
+_worker_bucket_obj = None
+_worker_cache = None
+
+
+def _init_worker(bucket_obj, trace_path=None, cache=None):
+    global _worker_bucket_obj, _worker_cache
+    _worker_bucket_obj = bucket_obj
+    _worker_cache = cache
+    if trace_path is not None:
+        set_sink(JSONLinesSink(trace_path))
+
+def _output_paths(settings, save_file_name):
+    #Paths of the .txt and .html files that JPEGtoASCII.save_to_file() and save_as_html() write
+    return (os.path.join(settings.get('save_file_path_txt', '.'), save_file_name+'.txt'),
+            os.path.join(settings.get('save_file_path_html', '.'), save_file_name+'.html'))
+
+def _write_outputs(outputs, settings, save_file_name):
+    #Saves the 'txt' and 'html' outputs where JPEGtoASCII.save_to_file() and save_as_html() would
+    txt_path, html_path = _output_paths(settings, save_file_name)
+    with open(txt_path, 'w') as f:
+        f.write(outputs['txt'])
+    with open(html_path, 'w') as f:
+        f.write(outputs['html'])
+
+def _cache_params(settings, bucket_obj):
+    '''
+    Purpose: Every parameter the outputs depend on: settings without the output directories and max_band_bytes, and the symbol of every bucket (which
+             also captures the glyph densities of the font).
+    '''
+    params = {name: value for name, value in settings.items() if name not in ('save_file_path_txt', 'save_file_path_html', 'max_band_bytes')}
+    params['used_symbols'] = bucket_obj.get_bucketed_symbols()
+    return params
+
+def _from_cache(cache, image_path, params, settings):
+    '''
+    Purpose: Looks up the outputs of image_path in cache, and saves them on a hit. Outputs that cannot be saved are reported in the
+             BatchResult, as _convert_one() does, so that they do not abort the rest of the batch.
+    Returns: [TUPLE] (BatchResult on a hit else None, cache key or None if image_path could not be read)
+    '''
+    try:
+        key = cache.key(hash_file(image_path), params)
+    except OSError:
+        #Converted (and reported) as usual
+        return None, None
+    outputs = cache.get(key)
+    if outputs is None:
+        return None, key
+    save_file_name = os.path.splitext(os.path.basename(image_path))[0]
+    try:
+        _write_outputs(outputs, settings, save_file_name)
+    except Exception:
+        return BatchResult(image_path, save_file_name, traceback.format_exc()), key
+    return BatchResult(image_path, save_file_name, None, True), key
+
+def _convert_one(job):
+    '''
+    Purpose: Converts a single image and saves it as .txt and .html files. Any exception is caught and reported in the
+             returned BatchResult, so that one bad image does not abort the rest of the batch.
+    Inputs: job [TUPLE]: (image_path, settings, key), where settings is a [DICT] of keyword arguments for JPEGtoASCII. If key is
+                         not None, the outputs are also stored under key in the output cache of this process.
+    Returns: BatchResult
+    '''
+    image_path, settings, key = job
+    save_file_name = os.path.splitext(os.path.basename(image_path))[0]
+    try:
+        image = JPEGtoASCII(image_path=image_path, save_file_name=save_file_name, bucket_obj=_worker_bucket_obj, **settings)
+        image.convert_to_ascii()
+        if key is None or _worker_cache is None:
+            image.save_to_file()
+            image.save_as_html()
+        else:
+            outputs = {'txt': image.to_text(), 'html': image.to_html()}
+            _write_outputs(outputs, settings, save_file_name)
+            _worker_cache.put(key, outputs)
+    except Exception:
+        return BatchResult(image_path, save_file_name, traceback.format_exc())
+    return BatchResult(image_path, save_file_name, None)
+
+def _build_buckets(num_buckets, symbols, reverse, font, font_size, settings):
+    bucket_obj = Buckets(num_buckets, symbols, reverse, font, font_size)
+    if settings.get('glyph_matching') == 'structure':
+        #Built once here, so that every worker inherits the glyph index with the Buckets object
+        bucket_obj.get_glyph_index(tuple(settings.get('descriptor_size', (2, 3))))
+    return bucket_obj
+
+def convert_batch(image_paths, num_buckets, symbols=None, reverse=False, font='Arial.ttf', font_size=100, workers=None, trace_path=None, cache=None, executor=None, **settings):
+    '''
+    Purpose: Converts every image in image_paths to ASCII art, spreading the images over a pool of worker processes.
+             The Buckets object is built once and shared with every worker. If a cache is given, images whose outputs are cached
+             are not converted (and no worker is started if every image is cached).
+    Inputs: image_paths [LIST] of [STRINGS]: paths to the images to be converted
+            num_buckets, symbols, reverse, font, font_size: see Buckets
+            workers [INT]: number of worker processes. If None, uses the number of CPUs. If 1, runs in the current process.
+            trace_path [STRING]: if given, the spans of every stage of every conversion (see common/instrumentation.py) are appended to this
+                                 JSON-lines file by every process
+            cache [OutputCache]: cache of outputs, looked up by image content and settings (see common/output_cache.py). Outputs of
+                                 converted images are added to it, and its least recently used entries are then evicted.
+            executor [ProcessPoolExecutor]: pool (whose workers were initialised by _init_worker() with the same settings) to run
+                                            the images in, instead of a pool started for this batch
+            settings: remaining keyword arguments for JPEGtoASCII (h_stretch, max_size, save_file_path_txt, ...)
+    Returns: [LIST] of BatchResult, in the same order as image_paths
+    '''
+    if trace_path is not None:
+        sink = JSONLinesSink(trace_path)
+        previous_sink = set_sink(sink)
+    try:
+        bucket_obj = _build_buckets(num_buckets, symbols, reverse, font, font_size, settings)
+        settings = dict(settings, num_buckets=num_buckets, symbols=symbols, reverse=reverse, font=font, font_size=font_size)
+        results = [None]*len(image_paths)
+        jobs = []
+        if cache is not None:
+            params = _cache_params(settings, bucket_obj)
+        for i, image_path in enumerate(image_paths):
+            key = None
+            if cache is not None:
+                results[i], key = _from_cache(cache, image_path, params, settings)
+            if results[i] is None:
+                jobs.append((i, (image_path, settings, key)))
+
+        if executor is not None and jobs:
+            job_results = list(executor.map(_convert_one, [job for _, job in jobs]))
+        elif workers == 1 or not jobs:
+            _init_worker(bucket_obj, cache=cache)
+            job_results = [_convert_one(job) for _, job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(bucket_obj, trace_path, cache)) as executor:
+                job_results = list(executor.map(_convert_one, [job for _, job in jobs]))
+        for (i, _), result in zip(jobs, job_results):
+            results[i] = result
+        if cache is not None and jobs:
+            cache.evict()
+        return results
+    finally:
+        if trace_path is not None:
+            set_sink(previous_sink)
+            sink.close()
+
+def convert_directory(image_src_dir, save_file_path_txt, save_file_path_html, file_ext='.jpg', **kwargs):
+    '''
+    Purpose: Converts every image with file_ext in image_src_dir. See convert_batch() for the remaining keyword arguments.
+    Returns: [LIST] of BatchResult
+    '''
+    safe_mkdir(save_file_path_txt)
+    safe_mkdir(save_file_path_html)
+    image_paths = sorted(get_all_files(image_src_dir, file_ext=file_ext))
+    return convert_batch(image_paths, save_file_path_txt=save_file_path_txt, save_file_path_html=save_file_path_html, **kwargs)
+
+def watch_directory(image_src_dir, save_file_path_txt, save_file_path_html, num_buckets, symbols=None, reverse=False, font='Arial.ttf', font_size=100, file_ext='.jpg', manifest_path=None, poll_interval=1.0, settle_time=2.0, full_scan_interval=60.0, max_scans=None, workers=None, trace_path=None, cache=None, **settings):
+    '''
+    Purpose: Watches image_src_dir, converting images as they are added or changed and deleting the outputs of deleted images,
+             until interrupted (Ctrl+C). Only new and changed images are converted, as recorded in a persistent manifest (see
+             common/watcher.DirectoryWatcher), so a restart does not convert the directory again. The Buckets object and the pool of
+             worker processes are kept for the whole watch. The results of every scan are printed with report().
+    Inputs: num_buckets, symbols, reverse, font, font_size, workers, trace_path, cache: see convert_batch()
+            file_ext [STRING]: extension of the images to convert
+            manifest_path [STRING]: manifest of the converted images. Defaults to .manifest.json in save_file_path_txt.
+            poll_interval [FLOAT]: seconds between scans
+            settle_time [FLOAT]: seconds an image must go unmodified (and unchanged since the previous scan) before it is converted
+            full_scan_interval [FLOAT]: seconds between full scans, which also find images overwritten in place (images replaced
+                                        by a rename are found by every scan). The first scan is always full. If None, only the first
+                                        scan is.
+            max_scans [INT]: number of scans before returning. If None, watches until interrupted.
+            settings: remaining keyword arguments for JPEGtoASCII (h_stretch, max_size, ...)
+    Returns: [INT] number of failed conversions
+    '''
+    safe_mkdir(save_file_path_txt)
+    safe_mkdir(save_file_path_html)
+    if manifest_path is None:
+        manifest_path = os.path.join(save_file_path_txt, '.manifest.json')
+    settings = dict(settings, save_file_path_txt=save_file_path_txt, save_file_path_html=save_file_path_html)
+    watcher = DirectoryWatcher(image_src_dir, manifest_path, file_ext, settle_time,
+                               settings=dict(settings, num_buckets=num_buckets, symbols=symbols, reverse=reverse, font=font, font_size=font_size))
+    executor = None
+    if workers != 1:
+        bucket_obj = _build_buckets(num_buckets, symbols, reverse, font, font_size, settings)
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(bucket_obj, trace_path, cache))
+    logger.info('Watching %s (Ctrl+C to stop)...', image_src_dir)
+    num_failed = 0
+    num_scans = 0
+    last_full_scan = None
+    try:
+        while max_scans is None or num_scans < max_scans:
+            full = last_full_scan is None or (full_scan_interval is not None and time.monotonic()-last_full_scan >= full_scan_interval)
+            if full:
+                last_full_scan = time.monotonic()
+            ready, deleted = watcher.scan(full)
+            for output_paths in deleted:
+                logger.info('Image deleted: removed %d output(s) (%s)', remove_outputs(output_paths), ', '.join(output_paths))
+            if ready:
+                results = convert_batch(ready, num_buckets, symbols, reverse, font, font_size, workers=workers, trace_path=trace_path, cache=cache, executor=executor, **settings)
+                for result in results:
+                    watcher.record(result.image_path, [] if result.error else _output_paths(settings, result.save_file_name), failed=bool(result.error))
+                num_failed += report(results, cache)
+            watcher.save()
+            num_scans += 1
+            if max_scans is None or num_scans < max_scans:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.save()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return num_failed
+
+def report(results, cache=None):
+    '''
+    Purpose: Prints one line per result, the full traceback of every failed job and, if the OutputCache used for the batch is
+             given, its number of hits and misses. Returns the number of failed jobs.
+    '''
+    num_failed = 0
+    for result in results:
+        if result.error:
+            num_failed += 1
+            print('FAILED: {}\n{}'.format(result.image_path, result.error))
+        else:
+            print('{}: {}'.format('Cached' if result.cached else 'Converted', result.image_path))
+    print('{} of {} images converted.'.format(len(results)-num_failed, len(results)))
+    if cache is not None:
+        print('Output cache: {} hits, {} misses.'.format(cache.hits, cache.misses))
+    return num_failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Converts every image in a directory to ASCII art (.txt and .html).')
+    parser.add_argument('--image-src-dir', default='./Images')
+    parser.add_argument('--save-file-path-txt', default='./GeneratedASCII/txt')
+    parser.add_argument('--save-file-path-html', default='./GeneratedASCII/html')
+    parser.add_argument('--file-ext', default='.jpg')
+    parser.add_argument('--num-buckets', type=int, default=80)
+    parser.add_argument('--h-stretch', type=float, default=1.5)
+    parser.add_argument('--max-size', type=int, nargs=2, default=(300, 600), metavar=('MAX_WIDTH', 'MAX_HEIGHT'))
+    parser.add_argument('--no-reverse', dest='reverse', action='store_false')
+    parser.add_argument('--font', default='Arial.ttf', help='font used to measure the intensity of each symbol')
+    parser.add_argument('--font-size', type=int, default=100)
+    parser.add_argument('--glyph-matching', default='density', choices=GLYPH_MATCHING, help="'structure' also matches the shape of each cell (edges, lines) to the symbols (needs a font that can be loaded)")
+    parser.add_argument('--descriptor-size', type=int, nargs=2, default=(2, 3), metavar=('COLUMNS', 'ROWS'), help="sub-cells compared by --glyph-matching structure (at most 8)")
+    parser.add_argument('--html-line-height', type=float, default=0.2)
+    parser.add_argument('--html-font-size', type=int, default=5)
+    parser.add_argument('--no-fast-decode', dest='fast_decode', action='store_false', help='resample the full-resolution image (slower, more memory)')
+    parser.add_argument('--max-band-size', type=int, default=64, metavar='MB', help='memory budget of each band of an uncompressed image (TIFF, PPM, BMP) read in bands')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (defaults to the number of CPUs)')
+    parser.add_argument('--trace', default=None, metavar='FILE', help='append a JSON line per conversion stage (timing, pixels, bytes written, glyph cache) to FILE')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='directory of the output cache (outputs of unchanged images are copied from it)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES >> 20, metavar='MB', help='size limit of the output cache, in MB (least recently used outputs are evicted)')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help='convert every image, without reading or writing the output cache')
+    parser.add_argument('--watch', action='store_true', help='keep watching --image-src-dir, converting images as they are added or changed and deleting the outputs of deleted images (Ctrl+C to stop)')
+    parser.add_argument('--manifest', default=None, metavar='FILE', help='manifest of the images converted by --watch (defaults to .manifest.json in --save-file-path-txt)')
+    parser.add_argument('--poll-interval', type=float, default=1.0, metavar='SECONDS', help='time between two scans of --watch')
+    parser.add_argument('--settle-time', type=float, default=2.0, metavar='SECONDS', help='time an image must go unmodified before --watch converts it (so that images still being written are skipped)')
+    parser.add_argument('--full-scan-interval', type=float, default=60.0, metavar='SECONDS', help='time between two full scans of --watch, which also find images overwritten in place')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level, format='%(levelname)s: %(message)s')
+
+    cache = OutputCache(args.cache_dir, args.cache_size << 20, CACHE_VERSION) if args.cache else None
+    settings = dict(image_src_dir=args.image_src_dir,
+                    save_file_path_txt=args.save_file_path_txt,
+                    save_file_path_html=args.save_file_path_html,
+                    file_ext=args.file_ext,
+                    num_buckets=args.num_buckets,
+                    h_stretch=args.h_stretch,
+                    max_size=tuple(args.max_size),
+                    reverse=args.reverse,
+                    font=args.font,
+                    font_size=args.font_size,
+                    glyph_matching=args.glyph_matching,
+                    descriptor_size=tuple(args.descriptor_size),
+                    html_line_height=args.html_line_height,
+                    html_font_size=args.html_font_size,
+                    fast_decode=args.fast_decode,
+                    max_band_bytes=args.max_band_size << 20,
+                    workers=args.workers,
+                    trace_path=args.trace,
+                    cache=cache)
+    if args.watch:
+        num_failed = watch_directory(manifest_path=args.manifest, poll_interval=args.poll_interval, settle_time=args.settle_time, full_scan_interval=args.full_scan_interval, **settings)
+        return 1 if num_failed else 0
+    results = convert_directory(**settings)
+    return 1 if report(results, cache) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
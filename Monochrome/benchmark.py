@@ -0,0 +1,292 @@
+import io
+import os
+import sys
+import time
+import gzip
+import resource
+import tempfile
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageFont, ImageDraw
+from JPEGConverter import Buckets, JPEGtoASCII
+from animation import JPEGtoASCIIAnimation
+from archive import ArchiveReader
+from utils import get_all_files
+
+
+def legacy_convert_to_ascii(img, buckets, used_symbols):
+    '''
+    Purpose: The original per-pixel implementation of JPEGtoASCII.convert_to_ascii(), kept as a reference for benchmarking.
+    Inputs: img [PIL.Image]: resized B/W image
+            buckets [np.array]: starting values of each bucket
+            used_symbols [LIST] of [STRINGS]: symbol associated with each bucket
+    Returns: [LIST] of [STRINGS], one per row
+    '''
+    ascii_img = [[] for row in range(img.height)]
+    pixels = list(np.asarray(img).ravel())
+    for index, pixel in enumerate(pixels):
+        row = int(index/img.width)
+        bucket_index = np.digitize(pixel, buckets) - 1
+        ascii_img[row].append(used_symbols[bucket_index])
+    return [''.join(row) for row in ascii_img]
+
+def benchmark_convert_to_ascii(image_path, num_buckets=80, max_size=(300,600), h_stretch=1.5, reverse=True, repeat=3):
+    '''
+    Purpose: Times the legacy per-pixel loop against the lookup-table implementation of convert_to_ascii() on one image, and checks that both produce identical output.
+    Returns: [TUPLE] (legacy_seconds, lut_seconds)
+    '''
+    image = JPEGtoASCII(image_path=image_path, num_buckets=num_buckets, save_file_name='benchmark', h_stretch=h_stretch, max_size=max_size, reverse=reverse)
+    original_img = image.img
+
+    legacy_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        legacy_rows = legacy_convert_to_ascii(original_img.resize(image.resized_size, Image.BICUBIC), image.buckets, image.used_symbols)
+        legacy_times.append(time.perf_counter() - start)
+
+    lut_times = []
+    for _ in range(repeat):
+        image.img = original_img
+        start = time.perf_counter()
+        image.convert_to_ascii()
+        lut_times.append(time.perf_counter() - start)
+
+    assert legacy_rows == image.ascii_img, 'LUT output differs from the legacy output for {}'.format(image_path)
+    return min(legacy_times), min(lut_times)
+
+def legacy_measure_symbols(font_obj, symbols):
+    '''
+    Purpose: The original per-glyph implementation of Buckets._sort_symbols() (RGB canvas, Python pixel filter), kept as a reference for benchmarking.
+    Returns: [DICT] of {symbol: number of black pixels}
+    '''
+    densities = {}
+    for symbol in symbols:
+        img = Image.new('RGB', (100,100), 'white')
+        draw = ImageDraw.Draw(img)
+        draw.text((0,0), symbol, font=font_obj, fill='#000000')
+        pixels = list(np.asarray(img).reshape(-1, 3).tolist())
+        densities[symbol] = len(list(filter(lambda rgb: sum(rgb)==0, pixels)))
+    return densities
+
+def first_available_font(fonts):
+    for font in fonts:
+        try:
+            ImageFont.truetype(font, 100)
+            return font
+        except OSError:
+            pass
+    raise OSError('None of the fonts {} could be loaded.'.format(fonts))
+
+def benchmark_measure_symbols(font, symbols, repeat=3):
+    '''
+    Purpose: Times the legacy glyph measurement against Buckets._measure_symbols() (cold start, no cache), and checks that both produce identical densities.
+    Returns: [TUPLE] (legacy_seconds, batched_seconds)
+    '''
+    font_obj = ImageFont.truetype(font, 100)
+
+    start = time.perf_counter()
+    legacy_densities = legacy_measure_symbols(font_obj, symbols)
+    legacy_time = time.perf_counter() - start
+
+    batched_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        batched_densities = Buckets._measure_symbols(font_obj, symbols)
+        batched_times.append(time.perf_counter() - start)
+
+    assert legacy_densities == batched_densities, 'Batched glyph densities differ from the legacy densities'
+    return legacy_time, min(batched_times)
+
+def make_test_image(path, size=(8000, 6000), quality=90):
+    '''
+    Purpose: Saves a synthetic RGB JPEG of size (width, height) (gradients and noise, like a large phone photo) to path.
+    '''
+    noise = Image.effect_noise(size, 64)
+    horizontal = Image.linear_gradient('L').rotate(90).resize(size)
+    vertical = Image.linear_gradient('L').resize(size)
+    Image.merge('RGB', (noise, horizontal, vertical)).save(path, quality=quality)
+
+def peak_rss():
+    '''
+    Purpose: Returns the peak resident set size of this process in bytes. On Linux this is read from /proc (VmHWM), as ru_maxrss
+             also counts the memory of the parent process before a fork.
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss*1024 #Bytes on macOS, KB elsewhere
+
+def _convert_and_measure(image_path, fast_decode, bucket_obj, max_size):
+    #Runs in a fresh process, so that peak_rss() is the peak RSS of this conversion alone
+    start = time.perf_counter()
+    if image_path is not None:
+        image = JPEGtoASCII(image_path=image_path, num_buckets=bucket_obj.num_buckets, max_size=max_size, bucket_obj=bucket_obj, fast_decode=fast_decode)
+        image.convert_to_ascii()
+    elapsed = time.perf_counter() - start
+    return elapsed, peak_rss()
+
+def _in_fresh_process(func, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(func, *args).result()
+
+def benchmark_decode(image_path, bucket_obj, max_size=(300,600)):
+    '''
+    Purpose: Times the decode and resample of one image with and without fast_decode (see common/image_io.reduce_image()), and measures the peak
+             RSS of each, in a fresh process so that the runs do not share memory. The peak RSS of an idle process (interpreter and
+             imports) is reported separately.
+    Returns: [DICT] of {'idle': peak_bytes, 'full': (seconds, peak_bytes), 'fast': (seconds, peak_bytes)}
+    '''
+    return {'idle': _in_fresh_process(_convert_and_measure, None, True, bucket_obj, max_size)[1],
+            'full': _in_fresh_process(_convert_and_measure, image_path, False, bucket_obj, max_size),
+            'fast': _in_fresh_process(_convert_and_measure, image_path, True, bucket_obj, max_size)}
+
+def make_raw_test_image(path, size=(40000, 25000), band_height=256):
+    '''
+    Purpose: Saves a synthetic RGB image of size (width, height) as an uncompressed PPM file, one band of rows at a time, so that
+             images larger than memory can be made (the default is a 1 gigapixel, 3 GB file).
+    '''
+    width, height = size
+    rng = np.random.default_rng(0)
+    horizontal = np.linspace(0, 255, width).astype(np.uint8)
+    with open(path, 'wb') as f:
+        f.write('P6\n{} {}\n255\n'.format(width, height).encode('ascii'))
+        for top in range(0, height, band_height):
+            rows = min(band_height, height-top)
+            band = np.empty((rows, width, 3), dtype=np.uint8)
+            band[..., 0] = rng.integers(0, 256, (rows, width), dtype=np.uint8)
+            band[..., 1] = horizontal
+            band[..., 2] = (np.arange(top, top+rows)*255//height).astype(np.uint8)[:, np.newaxis]
+            f.write(band.tobytes())
+
+def _convert_raw_and_measure(image_path, striped, bucket_obj, max_size):
+    #Runs in a fresh process. Without striped, the image is given as a PIL Image, which is decoded whole.
+    Image.MAX_IMAGE_PIXELS = None #The image is larger than PIL's decompression bomb limit
+    start = time.perf_counter()
+    image = JPEGtoASCII(image_path=image_path if striped else Image.open(image_path), num_buckets=bucket_obj.num_buckets, max_size=max_size, bucket_obj=bucket_obj)
+    image.convert_to_ascii()
+    elapsed = time.perf_counter() - start
+    return elapsed, peak_rss(), image.to_text()
+
+def benchmark_striped(image_path, bucket_obj, max_size=(300,600)):
+    '''
+    Purpose: Times the conversion of an uncompressed image read in bands (see common/image_io.reduce_striped()) and decoded whole, and
+             measures the peak RSS of each in a fresh process.
+    Returns: [DICT] of {'whole': (seconds, peak_bytes), 'striped': (seconds, peak_bytes), 'same_output': [BOOLEAN]}
+    '''
+    whole = _in_fresh_process(_convert_raw_and_measure, image_path, False, bucket_obj, max_size)
+    striped = _in_fresh_process(_convert_raw_and_measure, image_path, True, bucket_obj, max_size)
+    return {'whole': whole[:2], 'striped': striped[:2], 'same_output': whole[2] == striped[2]}
+
+def benchmark_archive(image_path, bucket_obj, max_size=(300,600), compressions=('zlib', 'lzma'), rows=(0, 20), repeat=5):
+    '''
+    Purpose: Compares the archive (see archive.py) of one image, with every compression, to its text and HTML files (and the gzipped
+             text): size, time to encode, time to decode the whole text, and time to decode only the given range of rows (best of
+             repeat runs), and checks that the archive decodes to the same text and HTML.
+    Returns: [DICT] of {'txt': (bytes, seconds to write), 'html': (bytes, seconds to write), 'txt.gz': bytes,
+                        compression: (bytes, encode seconds, decode seconds, row range seconds)}
+    '''
+    image = JPEGtoASCII(image_path=image_path, num_buckets=bucket_obj.num_buckets, max_size=max_size, bucket_obj=bucket_obj)
+    image.convert_to_ascii()
+
+    def best(func):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - start)
+        return result, min(times)
+    text, text_time = best(image.to_text)
+    html, html_time = best(image.to_html)
+    results = {'txt': (len(text.encode('utf-8')), text_time), 'html': (len(html.encode('utf-8')), html_time), 'txt.gz': len(gzip.compress(text.encode('utf-8')))}
+    for compression in compressions:
+        archive, encode_time = best(lambda: image.to_archive(compression))
+        decoded, decode_time = best(lambda: ArchiveReader(archive).to_text())
+        assert decoded == text and ArchiveReader(archive).to_html() == html, 'The archive of {} does not decode to its text and HTML files'.format(image_path)
+        _, range_time = best(lambda: ArchiveReader(archive).to_text(*rows))
+        results[compression] = (len(archive), encode_time, decode_time, range_time)
+    return results
+
+def make_test_animation(path, size=(640, 480), num_frames=60, duration=33):
+    '''
+    Purpose: Saves a synthetic animated GIF of size (width, height) (a disc moving over a gradient with noise) to path.
+    '''
+    background = Image.merge('RGB', (Image.effect_noise(size, 32), Image.linear_gradient('L').resize(size), Image.linear_gradient('L').rotate(90).resize(size)))
+    frames = []
+    for i in range(num_frames):
+        frame = background.copy()
+        x = i*(size[0]-size[1]//3)//num_frames
+        ImageDraw.Draw(frame).ellipse((x, size[1]//3, x+size[1]//3, 2*size[1]//3), fill=(255, 255, 255))
+        frames.append(frame)
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=duration, loop=0)
+
+def benchmark_animation(image_path, bucket_obj, columns=200, h_stretch=1.5):
+    '''
+    Purpose: Plays an animation at the given number of columns without waiting between frames (so that it runs as fast as frames can
+             be decoded, converted and rendered), and measures the frame rate and the output size.
+    Returns: [TUPLE] (fps, mean bytes written per frame, bytes of one full frame)
+    '''
+    animation = JPEGtoASCIIAnimation(image_path=image_path, num_buckets=bucket_obj.num_buckets, h_stretch=h_stretch, max_size=(columns/h_stretch, 10**6), bucket_obj=bucket_obj)
+    f = io.StringIO()
+    fps = animation.play(f, realtime=False)
+    num_frames = sum(1 for _ in animation.frames())
+    full_frame = animation.render_frame(next(animation.frames())[0])
+    return fps, len(f.getvalue())/num_frames, len(full_frame)
+
+
+if __name__ == '__main__':
+    #Glyph measurement (the 500-codepoint Unicode symbol set from JPEGConverter.py)
+    font = first_available_font(['Arial.ttf', 'DejaVuSans.ttf'])
+    whitespace_int = [9, 10, 11, 12, 13, 32, 33, 160, 5760, 8192, 8193, 8194, 8195, 8196, 8197, 8198, 8199, 8200, 8201, 8202, 8232, 8233, 8239, 8287, 12288]
+    symbols = [chr(i) for i in range(500) if i not in whitespace_int and chr(i).isprintable()]
+    legacy_time, batched_time = benchmark_measure_symbols(font, symbols)
+    print('{} symbols ({})  legacy: {:8.2f} ms   batched: {:6.2f} ms   speedup: {:6.1f}x\n'.format(len(symbols), font, legacy_time*1000, batched_time*1000, legacy_time/batched_time))
+
+    image_src_dir = './Images'
+    max_size = (300,600)
+
+    total_legacy, total_lut = 0, 0
+    for image_path in sorted(get_all_files(image_src_dir, file_ext='.jpg')):
+        legacy_time, lut_time = benchmark_convert_to_ascii(image_path, max_size=max_size)
+        total_legacy += legacy_time
+        total_lut += lut_time
+        print('{:<20} legacy: {:8.2f} ms   lut: {:6.2f} ms   speedup: {:6.1f}x'.format(os.path.basename(image_path), legacy_time*1000, lut_time*1000, legacy_time/lut_time))
+    print('{:<20} legacy: {:8.2f} ms   lut: {:6.2f} ms   speedup: {:6.1f}x'.format('TOTAL', total_legacy*1000, total_lut*1000, total_legacy/total_lut))
+
+    #Archives against the text and HTML files
+    bucket_obj = Buckets(80, reverse=True)
+    for image_path in sorted(get_all_files(image_src_dir, file_ext='.jpg')):
+        r = benchmark_archive(image_path, bucket_obj, max_size=max_size)
+        print('archive {:<20} txt {:5.0f} KB  html {:5.0f} KB  txt.gz {:4.0f} KB'.format(os.path.basename(image_path), r['txt'][0]/1024, r['html'][0]/1024, r['txt.gz']/1024), end='')
+        for compression in ['zlib', 'lzma']:
+            num_bytes, encode_time, decode_time, range_time = r[compression]
+            print(' | {} {:4.0f} KB  encode {:5.1f} ms  decode {:4.1f} ms  20 rows {:4.2f} ms'.format(compression, num_bytes/1024, encode_time*1000, decode_time*1000, range_time*1000), end='')
+        print()
+
+    #Decode and resample of a large (48 MP) image, with and without fast_decode
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_path = os.path.join(temp_dir, 'large.jpg')
+        make_test_image(image_path)
+        r = benchmark_decode(image_path, Buckets(80, reverse=True), max_size=max_size)
+    print('\n48 MP JPEG        full decode: {:8.1f} ms  peak RSS {:6.1f} MB   fast decode: {:6.1f} ms  peak RSS {:6.1f} MB   (idle process: {:.1f} MB)'.format(
+        r['full'][0]*1000, r['full'][1]/2**20, r['fast'][0]*1000, r['fast'][1]/2**20, r['idle']/2**20))
+
+    #Conversion of a large uncompressed image, read in bands and decoded whole
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_path = os.path.join(temp_dir, 'large.ppm')
+        make_raw_test_image(image_path, size=(20000, 12500))
+        r = benchmark_striped(image_path, Buckets(80, reverse=True), max_size=max_size)
+    print('250 MP PPM        whole decode: {:7.1f} ms  peak RSS {:6.1f} MB   striped: {:9.1f} ms  peak RSS {:6.1f} MB   same output: {}'.format(
+        r['whole'][0]*1000, r['whole'][1]/2**20, r['striped'][0]*1000, r['striped'][1]/2**20, r['same_output']))
+
+    #Terminal playback of an animated GIF at 200 columns (only the changed cells of each frame are redrawn)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_path = os.path.join(temp_dir, 'animation.gif')
+        make_test_animation(image_path)
+        fps, frame_bytes, full_frame_bytes = benchmark_animation(image_path, Buckets(80))
+    print('640x480 GIF at 200 columns: {:6.1f} fps   {:6.0f} bytes written per frame (full frame: {} bytes)'.format(fps, frame_bytes, full_frame_bytes))
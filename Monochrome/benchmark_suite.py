@@ -0,0 +1,208 @@
+import io
+import os
+import gc
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import PIL
+from PIL import Image
+import glyph_cache
+from glyph_cache import GlyphDensityCache
+from JPEGConverter import Buckets, JPEGtoASCII
+from benchmark import first_available_font, make_test_image
+from utils import get_all_files
+
+SUITE_NAME = 'monochrome'
+DEFAULT_SYNTHETIC_SIZES = [(512, 384), (2048, 1536), (4096, 3072)]
+
+
+def _reset_peak_rss():
+    '''
+    Purpose: Resets the peak RSS of this process (Linux only, through /proc/self/clear_refs). Returns False if it cannot be reset.
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _read_rss():
+    #[TUPLE] (current RSS, peak RSS) in bytes, from /proc/self/status
+    values = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                values[line.split(':')[0]] = int(line.split()[1])*1024
+    return values['VmRSS'], values['VmHWM']
+
+def measure(func, repeat=3):
+    '''
+    Purpose: Measures func() (one stage of the conversion).
+    Returns: [DICT] of {'wall_time': fastest of repeat runs in seconds,
+                        'peak_traced_bytes': peak memory allocated through Python and NumPy during one run (tracemalloc),
+                        'peak_rss_bytes': growth of the peak RSS of the process during one run (includes PIL buffers; None where the
+                                          peak RSS cannot be reset, i.e. outside Linux)}
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    peak_rss = None
+    if _reset_peak_rss():
+        rss_before = _read_rss()[0]
+        func()
+        peak_rss = max(0, _read_rss()[1] - rss_before)
+
+    tracemalloc.start()
+    func()
+    peak_traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'wall_time': min(times), 'peak_traced_bytes': peak_traced, 'peak_rss_bytes': peak_rss}
+
+def _record(results, stage, input_name, pixels, measurement):
+    measurement = dict(stage=stage, input=input_name, pixels=pixels, **measurement)
+    measurement['pixels_per_s'] = pixels/measurement['wall_time'] if pixels and measurement['wall_time'] > 0 else None
+    results.append(measurement)
+    print('{:<20} {:<28} {:>10} px {:10.2f} ms {:>14} px/s  peak {:8.0f} KB traced {:>8} KB RSS'.format(
+        stage, input_name, pixels or '-', measurement['wall_time']*1000,
+        '{:.3g}'.format(measurement['pixels_per_s']) if measurement['pixels_per_s'] else '-',
+        measurement['peak_traced_bytes']/1024, '{:.0f}'.format(measurement['peak_rss_bytes']/1024) if measurement['peak_rss_bytes'] is not None else '-'))
+
+def benchmark_glyph_sorting(results, num_buckets, symbols, font, repeat=3):
+    '''
+    Purpose: Measures Buckets._sort_symbols() with an empty glyph cache (every symbol is rendered) and with a warm cache.
+    '''
+    with tempfile.TemporaryDirectory() as cache_dir:
+        bucket_obj = Buckets(num_buckets, symbols, font=font, glyph_cache=GlyphDensityCache(cache_dir))
+        symbols = bucket_obj.symbols
+
+        def cold():
+            glyph_cache._memo.clear()
+            for file_name in os.listdir(cache_dir):
+                os.remove(os.path.join(cache_dir, file_name))
+            bucket_obj._sort_symbols()
+        _record(results, 'glyph_sort_cold', '{} symbols'.format(len(symbols)), None, measure(cold, repeat))
+        _record(results, 'glyph_sort_warm', '{} symbols'.format(len(symbols)), None, measure(bucket_obj._sort_symbols, repeat))
+
+def benchmark_image(results, image_path, input_name, bucket_obj, settings, repeat=3):
+    '''
+    Purpose: Measures every stage of the conversion of one image: decode (JPEGtoASCII, which reads and shrinks the image, see
+             common/image_io.reduce_image()), resize, bucketing (convert_to_ascii() on the resized image) and serialization (.txt and .html).
+             Throughput is measured against the pixels of the source image for decode, and of the resized image for the other stages.
+    '''
+    def decode():
+        return JPEGtoASCII(image_path=image_path, num_buckets=bucket_obj.num_buckets, bucket_obj=bucket_obj, **settings)
+    image = decode()
+    image.img.load()
+    source_pixels = image.img_width*image.img_height
+    resized_pixels = image.resized_width*image.resized_height
+    decoded_img = image.img
+    resized_img = decoded_img.resize(image.resized_size, Image.BICUBIC)
+
+    def bucketing():
+        image.img = resized_img
+        image.convert_to_ascii()
+
+    _record(results, 'decode', input_name, source_pixels, measure(lambda: decode().img.load(), repeat))
+    _record(results, 'resize', input_name, resized_pixels, measure(lambda: decoded_img.resize(image.resized_size, Image.BICUBIC), repeat))
+    _record(results, 'bucketing', input_name, resized_pixels, measure(bucketing, repeat))
+    _record(results, 'serialize_txt', input_name, resized_pixels, measure(lambda: image.write_text(io.StringIO()), repeat))
+    _record(results, 'serialize_html', input_name, resized_pixels, measure(lambda: image.write_html(io.StringIO()), repeat))
+
+def run_suite(image_src_dir='./Images', synthetic_sizes=DEFAULT_SYNTHETIC_SIZES, num_buckets=80, max_size=(300, 600), h_stretch=1.5, reverse=True, repeat=3):
+    '''
+    Purpose: Runs every benchmark: glyph sorting, then every stage of the conversion of every image in image_src_dir and of a
+             synthetic JPEG of each size in synthetic_sizes ((width, height) [TUPLES]).
+    Returns: [DICT] report, with one entry per (stage, input) in 'results'
+    '''
+    results = []
+    font = first_available_font(['Arial.ttf', 'DejaVuSans.ttf'])
+    benchmark_glyph_sorting(results, num_buckets, None, font, repeat)
+
+    bucket_obj = Buckets(num_buckets, reverse=reverse, font=font)
+    settings = {'max_size': max_size, 'h_stretch': h_stretch}
+    for image_path in sorted(get_all_files(image_src_dir)):
+        benchmark_image(results, image_path, os.path.basename(image_path), bucket_obj, settings, repeat)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in synthetic_sizes:
+            image_path = os.path.join(temp_dir, 'synthetic_{}x{}.jpg'.format(*size))
+            make_test_image(image_path, size)
+            benchmark_image(results, image_path, os.path.basename(image_path), bucket_obj, settings, repeat)
+
+    return {'suite': SUITE_NAME,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': {'machine': platform.machine(), 'processor': platform.processor(), 'python': platform.python_version(),
+                         'numpy': np.__version__, 'pillow': PIL.__version__},
+            'settings': {'num_buckets': num_buckets, 'max_size': list(max_size), 'h_stretch': h_stretch, 'reverse': reverse,
+                         'font': font, 'repeat': repeat},
+            'results': results}
+
+def compare(report, baseline, tolerance=0.25, memory_tolerance=0.25, min_time=0.001):
+    '''
+    Purpose: Compares every result in report with the result of the same (stage, input) in baseline.
+    Inputs: tolerance [FLOAT]: maximum allowed relative increase in wall time (0.25 allows runs to be up to 25% slower)
+            memory_tolerance [FLOAT]: maximum allowed relative increase in peak traced memory
+            min_time [FLOAT]: increases in wall time smaller than this (in seconds) are ignored, as they are within timer noise
+    Returns: [LIST] of [STRINGS], one per regression
+    '''
+    baseline_results = {(result['stage'], result['input']): result for result in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        reference = baseline_results.get((result['stage'], result['input']))
+        if reference is None:
+            continue
+        if result['wall_time'] > reference['wall_time']*(1+tolerance) and result['wall_time']-reference['wall_time'] > min_time:
+            regressions.append('{} {}: wall time {:.2f} ms (baseline {:.2f} ms, +{:.0%})'.format(
+                result['stage'], result['input'], result['wall_time']*1000, reference['wall_time']*1000, result['wall_time']/reference['wall_time']-1))
+        if result['peak_traced_bytes'] > reference['peak_traced_bytes']*(1+memory_tolerance) and result['peak_traced_bytes']-reference['peak_traced_bytes'] > 1 << 16:
+            regressions.append('{} {}: peak memory {:.0f} KB (baseline {:.0f} KB)'.format(
+                result['stage'], result['input'], result['peak_traced_bytes']/1024, reference['peak_traced_bytes']/1024))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks every stage of the ASCII conversion and compares the results with a saved baseline.')
+    parser.add_argument('--image-src-dir', default='./Images')
+    parser.add_argument('--synthetic-sizes', type=int, nargs='*', default=[size for sizes in DEFAULT_SYNTHETIC_SIZES for size in sizes], metavar='WIDTH HEIGHT', help='sizes of the synthetic JPEG images (pairs of width and height)')
+    parser.add_argument('--num-buckets', type=int, default=80)
+    parser.add_argument('--max-size', type=int, nargs=2, default=(300, 600), metavar=('MAX_WIDTH', 'MAX_HEIGHT'))
+    parser.add_argument('--h-stretch', type=float, default=1.5)
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of each stage (the fastest is reported)')
+    parser.add_argument('--output', help='file to write the JSON report to')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='write the report to --baseline instead of comparing against it')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='maximum allowed relative increase in wall time')
+    parser.add_argument('--memory-tolerance', type=float, default=0.25, help='maximum allowed relative increase in peak memory')
+    args = parser.parse_args(argv)
+    if len(args.synthetic_sizes) % 2:
+        parser.error('--synthetic-sizes takes pairs of WIDTH HEIGHT')
+
+    synthetic_sizes = list(zip(args.synthetic_sizes[::2], args.synthetic_sizes[1::2]))
+    report = run_suite(args.image_src_dir, synthetic_sizes, args.num_buckets, tuple(args.max_size), args.h_stretch, repeat=args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+        print('Baseline saved to {}.'.format(args.baseline))
+    elif args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.memory_tolerance)
+        for regression in regressions:
+            print('REGRESSION: {}'.format(regression))
+        print('{} regressions against {}.'.format(len(regressions), args.baseline))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,207 @@
+import os
+import json
+import logging
+import hashlib
+import argparse
+import tempfile
+from PIL import ImageFont
+from common.instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+LEGACY_JSON_FILE_NAME = 'dump.JSON'
+LEGACY_FONT = ('Arial.ttf', 100)
+#Symbols measured alongside any cache miss (Basic Latin to Latin Extended-B), so later symbol sets are usually already cached
+PREFETCH_SYMBOLS = [chr(i) for i in range(0x250) if chr(i).isprintable()]
+
+#In-process memo: {(font path, font hash, font_size): {symbol: density}} (font hash is None for the legacy densities of a font that
+#cannot be loaded). Shared by every GlyphDensityCache in this process.
+_memo = {}
+#{font name or path: resolved path of the font file} and {resolved path: ((mtime_ns, size), SHA-256)}, so that a memo lookup only stats
+#the font file, and the file is hashed again only when it changes
+_font_paths = {}
+_font_hashes = {}
+
+
+def _hash_file(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def _font_hash(font_path):
+    #Hash of the font file (see _font_hashes)
+    stat = os.stat(font_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _font_hashes.get(font_path)
+    if cached is None or cached[0] != signature:
+        cached = _font_hashes[font_path] = (signature, _hash_file(font_path))
+    return cached[1]
+
+def _atomic_write_json(data, file_path):
+    '''
+    Purpose: Writes data to a temporary file in the same directory and renames it over file_path, so that readers (and
+             other processes writing concurrently) never see a partially written file.
+    '''
+    dir_path = os.path.dirname(file_path)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix='.tmp_', suffix='.JSON')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class GlyphDensityCache(object):
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, prefetch_symbols=PREFETCH_SYMBOLS):
+        '''
+        Purpose: Persistent cache of glyph densities (number of pixels each symbol covers when rendered).
+                 There is one .JSON file per (font file, font file hash, font size). Each file stores the raw density of every
+                 symbol measured so far, so any symbol subset and either sort order can be derived from it without re-rendering.
+                 Densities are also memoised in-process, keyed by the same (font file, hash, size), so repeated lookups with the
+                 same font only stat the font file (which is hashed again if it changed).
+        Inputs: cache_dir [STRING]: directory containing the cache files. Defaults to the data directory next to this module,
+                                    so the cache does not depend on the current working directory.
+                prefetch_symbols [LIST] of [STRINGS]: symbols that are measured in the same batch as any missing symbol
+        '''
+        self.cache_dir = cache_dir
+        self.prefetch_symbols = prefetch_symbols
+
+    def get_densities(self, symbols, font, font_size, measure_symbols):
+        '''
+        Purpose: Returns the density of every symbol in symbols, measuring (and caching) only the symbols that are not cached yet.
+        Inputs: symbols [LIST] of [STRINGS]: symbol set
+                font [STRING]: font file name or path (anything accepted by ImageFont.truetype)
+                font_size [INT]: font size the glyphs are rendered at
+                measure_symbols [FUNCTION]: measure_symbols(font_obj, symbols) returns a [DICT] of {symbol: density}
+        Returns: [DICT] of {symbol: density}, containing at least every symbol in symbols
+        '''
+        with span('glyph_table', font=font, font_size=font_size, symbols=len(symbols)) as glyph_span:
+            font_obj = None
+            font_path = _font_paths.get(font)
+            if font_path is None:
+                densities = _memo.get((font, None, font_size))
+                if densities is not None and all(symbol in densities for symbol in symbols):
+                    glyph_span.set(cache='memo', measured_symbols=0)
+                    return densities
+                try:
+                    font_obj = ImageFont.truetype(font, font_size)
+                except OSError:
+                    densities = self._load_legacy_densities(symbols, font, font_size)
+                    _memo[(font, None, font_size)] = densities
+                    glyph_span.set(cache='legacy', measured_symbols=0)
+                    return densities
+                font_path = _font_paths[font] = getattr(font_obj, 'path', font)
+
+            font_hash = _font_hash(font_path)
+            memo_key = (font_path, font_hash, font_size)
+            densities = _memo.get(memo_key)
+            if densities is not None and all(symbol in densities for symbol in symbols):
+                glyph_span.set(cache='memo', measured_symbols=0)
+                return densities
+
+            cache_file_path = self._get_cache_file_path(font_path, font_hash, font_size)
+            densities = self._load(cache_file_path)
+            missing_symbols = [symbol for symbol in symbols if symbol not in densities]
+            if missing_symbols:
+                logger.info('Measuring %d new symbol(s) with %s (font size %d)...', len(missing_symbols), os.path.basename(font_path), font_size)
+                missing_set = set(missing_symbols)
+                missing_symbols += [symbol for symbol in self.prefetch_symbols if symbol not in densities and symbol not in missing_set]
+                if font_obj is None:
+                    font_obj = ImageFont.truetype(font_path, font_size)
+                densities.update(measure_symbols(font_obj, missing_symbols))
+                densities = self._save(cache_file_path, font_path, font_hash, font_size, densities)
+                glyph_span.set(cache='miss', measured_symbols=len(missing_symbols))
+            else:
+                logger.debug('Using cached glyph densities in %s', cache_file_path)
+                glyph_span.set(cache='disk', measured_symbols=0)
+            _memo[memo_key] = densities
+            return densities
+
+    def _get_cache_file_path(self, font_path, font_hash, font_size):
+        font_name = os.path.splitext(os.path.basename(font_path))[0]
+        return os.path.join(self.cache_dir, 'glyphs_{}_{}_{}.JSON'.format(font_name, font_hash[:16], font_size))
+
+    def _load(self, cache_file_path):
+        if not os.path.isfile(cache_file_path):
+            return {}
+        with open(cache_file_path, 'r') as f:
+            return json.load(f)['densities']
+
+    def _save(self, cache_file_path, font_path, font_hash, font_size, densities):
+        '''
+        Purpose: Adds densities to the cache file. The file is read again just before it is replaced, so that the symbols another
+                 process measured (and saved) in the meantime are kept.
+        Returns: [DICT] of {symbol: density}: densities merged with the symbols in the file
+        '''
+        os.makedirs(self.cache_dir, exist_ok=True)
+        densities = dict(self._load(cache_file_path), **densities)
+        data = {'font_file': os.path.basename(font_path),
+                'font_hash': font_hash,
+                'font_size': font_size,
+                'densities': densities}
+        _atomic_write_json(data, cache_file_path)
+        return densities
+
+    def _load_legacy_densities(self, symbols, font, font_size):
+        '''
+        Purpose: Falls back on the densities in the legacy dump.JSON file (measured with Arial, font size 100) when the font
+                 cannot be loaded on this machine. Raises OSError if the legacy file cannot provide every symbol.
+        '''
+        legacy_file_path = os.path.join(self.cache_dir, LEGACY_JSON_FILE_NAME)
+        if (font, font_size) == LEGACY_FONT and os.path.isfile(legacy_file_path):
+            with open(legacy_file_path, 'r') as f:
+                densities = dict(json.load(f)['intensity_values_unsorted'])
+            if all(symbol in densities for symbol in symbols):
+                logger.warning('%s could not be loaded. Using glyph densities in %s', font, legacy_file_path)
+                return densities
+        raise OSError('Font {} could not be loaded and no cached glyph densities are available for this symbol set.'.format(font))
+
+
+def prebuild(fonts, font_sizes, symbols=PREFETCH_SYMBOLS, cache_dir=DEFAULT_CACHE_DIR):
+    '''
+    Purpose: Measures symbols with every font at every font size and stores them in the cache ahead of time (e.g. when a machine or a
+             container image is set up), so that converters and worker processes read the glyph table from disk and never render
+             glyphs when they start. Symbols that are already cached are not measured again.
+    Inputs: fonts [LIST] of [STRINGS]: font file names or paths
+            font_sizes [LIST] of [INTS]
+            symbols [LIST] of [STRINGS]: symbols to measure (Basic Latin to Latin Extended-B by default, which covers the default
+                                         symbol set of Buckets)
+    Returns: [LIST] of the (font, font_size) pairs whose font could not be loaded
+    '''
+    from JPEGConverter import Buckets
+    cache = GlyphDensityCache(cache_dir)
+    failed = []
+    for font in fonts:
+        for font_size in font_sizes:
+            try:
+                ImageFont.truetype(font, font_size)
+            except OSError:
+                logger.error('%s could not be loaded, so its glyph table cannot be built.', font)
+                failed.append((font, font_size))
+                continue
+            densities = cache.get_densities(list(symbols), font, font_size, Buckets._measure_symbols)
+            logger.info('%s (font size %d): %d symbols cached in %s', font, font_size, len(densities), cache.cache_dir)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Prebuilds the glyph density cache, so that no glyph is rendered when a converter or worker process starts.')
+    parser.add_argument('--font', nargs='+', default=[LEGACY_FONT[0]], help='font files (names or paths) to measure')
+    parser.add_argument('--font-size', type=int, nargs='+', default=[LEGACY_FONT[1]])
+    parser.add_argument('--symbols', default='', help='symbols to measure besides Basic Latin to Latin Extended-B, as one string')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    symbols = PREFETCH_SYMBOLS + [symbol for symbol in dict.fromkeys(args.symbols) if symbol not in PREFETCH_SYMBOLS]
+    return 1 if prebuild(args.font, args.font_size, symbols, args.cache_dir) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,84 @@
+import json
+import collections
+from JPEGConverter import Buckets, JPEGtoASCII
+#ServiceOverloaded is raised by convert() and imported here for its callers
+from common.service import BatchingService, ServiceOverloaded
+
+OUTPUT_FORMATS = ('txt', 'html')
+#Keyword arguments of JPEGtoASCII that determine its Buckets object
+BUCKET_SETTINGS = ('num_buckets', 'symbols', 'reverse', 'font', 'font_size')
+#Number of Buckets objects (one per distinct BUCKET_SETTINGS) kept by each worker process
+MAX_WORKER_BUCKETS = 8
+
+#Buckets objects of this (worker) process, least recently used first
+_worker_buckets = collections.OrderedDict()
+
+
+def _get_buckets(bucket_settings):
+    #Buckets object of bucket_settings, built on first use and then shared by every request with the same settings
+    key = json.dumps(bucket_settings, sort_keys=True)
+    bucket_obj = _worker_buckets.pop(key, None)
+    if bucket_obj is None:
+        bucket_obj = Buckets(**bucket_settings)
+    _worker_buckets[key] = bucket_obj
+    while len(_worker_buckets) > MAX_WORKER_BUCKETS:
+        _worker_buckets.popitem(last=False)
+    return bucket_obj
+
+def _convert_requests(settings, output, images):
+    '''
+    Purpose: Converts a micro-batch of images that share settings, in a worker process. The Buckets object (and the glyph index, for
+             structure matching) is built once and reused by every image of the batch and of later batches.
+    Inputs: settings [DICT]: keyword arguments for JPEGtoASCII
+            output [STRING]: 'txt' or 'html'
+            images [LIST]: image of every request (see JPEGtoASCII)
+    Returns: [LIST] of (output [STRING], None) or (None, exception), in the same order as images
+    '''
+    bucket_obj = _get_buckets({name: settings[name] for name in BUCKET_SETTINGS if name in settings})
+    results = []
+    for image in images:
+        try:
+            converter = JPEGtoASCII(image_path=image, bucket_obj=bucket_obj, **settings)
+            converter.convert_to_ascii()
+            results.append((converter.to_html() if output == 'html' else converter.to_text(), None))
+        except Exception as e:
+            results.append((None, e))
+    return results
+
+
+class ConversionService(BatchingService):
+    def __init__(self, workers=None, max_queue=256, max_batch=16, max_batch_bytes=1 << 20, batch_window=0.002, timeout=30.0, reject_when_full=False, executor=None):
+        '''
+        Purpose: asyncio front-end that converts images to ASCII art in a pool of worker processes, so that the event loop (e.g. of an
+                 HTTP server) is never blocked by a conversion. Requests wait in a bounded queue. Whenever a worker is free, the
+                 oldest queued request is sent to it together with the other queued requests that have the same settings (a
+                 micro-batch), so they share one Buckets object and one round trip to the pool. Under load, requests queue up while
+                 every worker is busy, and batches grow with the load.
+                 Use as
+                     async with ConversionService() as service:
+                         text = await service.convert(image_bytes, num_buckets=80, max_size=(100, 50))
+        Inputs: see common/service.BatchingService
+        '''
+        super().__init__(_convert_requests, workers=workers, max_queue=max_queue, max_batch=max_batch, max_batch_bytes=max_batch_bytes, batch_window=batch_window, timeout=timeout, reject_when_full=reject_when_full, executor=executor)
+
+    async def convert(self, image, num_buckets=80, output='txt', timeout=None, **settings):
+        '''
+        Purpose: Converts image to ASCII art in a worker process.
+        Inputs: image: path to an image file, bytes or bytearray containing an encoded image, or np.ndarray (see JPEGtoASCII). It is
+                       sent to a worker process, so it must be picklable.
+                num_buckets [INT]: see JPEGtoASCII
+                output [STRING]: 'txt' (the text, rows separated by newlines) or 'html' (the HTML document)
+                timeout [FLOAT]: seconds before the request fails with TimeoutError, including the time spent waiting in the
+                                 queue. Defaults to the timeout of the service. A request whose batch is already being converted
+                                 cannot stop its worker, so the worker finishes the batch and the output is discarded.
+                settings: remaining keyword arguments for JPEGtoASCII (h_stretch, max_size, reverse, symbols, font, glyph_matching, ...)
+        Returns: [STRING] the output
+        Raises: TimeoutError, ServiceOverloaded, or the exception raised by the conversion. Cancelling the calling task cancels the
+                request (it is then dropped from its batch if the batch has not been sent to a worker yet).
+        '''
+        if output not in OUTPUT_FORMATS:
+            raise ValueError('Unknown output {}. Choose from {}.'.format(output, OUTPUT_FORMATS))
+        settings = dict(settings, num_buckets=num_buckets)
+        key = json.dumps([output, settings], sort_keys=True, default=str)
+        return await self.submit(key, (settings, output), image, timeout)
+
@@ -7,7 +7,7 @@ def safe_mkdir(dir_path):
     if os.path.isdir(dir_path):
         pass
     else:
-        os.mkdir(dir_path)
+        os.makedirs(dir_path)
 
 def get_all_files(dir_path, file_ext=None):
     '''
@@ -23,4 +23,4 @@ def get_all_files(dir_path, file_ext=None):
                 files_fullpath.append(os.path.join(dir_path, file))
         else:
             files_fullpath.append(os.path.join(dir_path, file))
-    return files_fullpath
\ No newline at end of file
+    return files_fullpath
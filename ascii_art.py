@@ -0,0 +1,51 @@
+import os
+import sys
+import importlib
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+#{mode: (directory of the converter, {command: module whose main(argv) runs it})}. The first command is the default.
+#The Monochrome and Colour directories have modules with the same names, so only the directory of the chosen mode is put on the
+#path, and only the module of the chosen command is imported (each module imports its heavy dependencies when it needs them).
+MODES = {'mono': ('Monochrome', {'batch': 'batch',
+                                 'animation': 'animation',
+                                 'archive': 'archive',
+                                 'glyphs': 'glyph_cache',
+                                 'load-test': 'load_test',
+                                 'benchmark': 'benchmark_suite'}),
+         'colour': ('Colour', {'batch': 'batch',
+                               'terminal': 'terminal',
+                               'archive': 'archive',
+                               'load-test': 'load_test',
+                               'benchmark': 'benchmark_suite'})}
+
+
+def usage():
+    lines = ['usage: python ascii_art.py {mono,colour} [COMMAND] [ARGS ...]', '',
+             'Runs a command of the monochrome (.txt/.html) or colour (.html/terminal) converter. ARGS are passed to the command;',
+             'use "python ascii_art.py MODE COMMAND --help" for its options. Paths are relative to the working directory.', '']
+    for mode, (directory, commands) in MODES.items():
+        names = list(commands)
+        lines.append('  {:<8} {} (default), {}   (see {}/README.md)'.format(mode, names[0], ', '.join(names[1:]), directory))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0
+    mode, argv = argv[0], argv[1:]
+    if mode not in MODES:
+        print(usage(), file=sys.stderr)
+        raise SystemExit('Unknown mode {}. Choose from {}.'.format(mode, tuple(MODES)))
+    directory, commands = MODES[mode]
+    command = argv.pop(0) if argv and argv[0] in commands else next(iter(commands))
+
+    sys.path.insert(0, os.path.join(ROOT_DIR, directory))
+    module = importlib.import_module(commands[command])
+    #The command's own parser (which takes its name from sys.argv[0]) reports errors and --help under this entry point
+    sys.argv[0] = 'python ascii_art.py {} {}'.format(mode, command)
+    return module.main(argv)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,57 @@
+import os
+import sys
+import argparse
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+#Import-time budgets in ms of the modules that short CLI calls and fresh worker processes import first: (directory, module, budget).
+#They are about twice the time measured on one core, so that a slower machine passes but an eager import of a heavy
+#dependency (sklearn alone takes ~1 s) does not.
+BUDGETS = [('.', 'ascii_art', 50),
+           ('Monochrome', 'JPEGConverter', 250),
+           ('Monochrome', 'batch', 300),
+           ('Monochrome', 'animation', 300),
+           ('Monochrome', 'archive', 250),
+           ('Monochrome', 'service', 400),
+           ('Colour', 'JPEGConverter', 250),
+           ('Colour', 'batch', 300),
+           ('Colour', 'terminal', 250),
+           ('Colour', 'archive', 250),
+           ('Colour', 'service', 400)]
+#Modules that must only be imported by the features that need them (clustering, resizing, HTML output, opening a web browser)
+LAZY_MODULES = ('sklearn', 'skimage', 'scipy', 'yattag', 'webbrowser')
+
+
+def measure_import(directory, module):
+    '''
+    Purpose: Imports module in a fresh interpreter (python -X importtime, with directory as the working directory and first on the path).
+    Returns: [TUPLE] (cumulative import time of module in seconds, [LIST] of the LAZY_MODULES it imported)
+    '''
+    code = 'import sys, {}; print(" ".join(name for name in {!r} if name in sys.modules))'.format(module, LAZY_MODULES)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=os.path.join(ROOT_DIR, directory), capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError('Importing {} failed:\n{}'.format(module, result.stderr))
+    #Lines look like "import time:       436 |     110028 | JPEGConverter" (self and cumulative times in microseconds)
+    cumulative = [int(line.split('|')[1]) for line in result.stderr.splitlines() if line.startswith('import time:') and line.split('|')[-1].strip() == module]
+    return cumulative[-1]/1e6, result.stdout.split()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Checks the import time of the entry points of both converters against their budgets, and that no heavy dependency is imported when a module is loaded. Exits with status 1 if a check fails.')
+    parser.add_argument('--repeat', type=int, default=5, help='number of imports of each module (the fastest is compared with its budget)')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies every budget (e.g. 2 on a slow machine)')
+    args = parser.parse_args(argv)
+
+    failed = False
+    for directory, module, budget in BUDGETS:
+        runs = [measure_import(directory, module) for _ in range(args.repeat)]
+        elapsed = min(elapsed for elapsed, _ in runs)
+        lazy_imported = runs[0][1]
+        ok = elapsed*1000 <= budget*args.scale and not lazy_imported
+        failed = failed or not ok
+        print('{:<4} {:<26} {:7.1f} ms  (budget {:5.0f} ms){}'.format('ok' if ok else 'FAIL', os.path.normpath(os.path.join(directory, module)), elapsed*1000, budget*args.scale,
+                                                                 '  imports {}'.format(', '.join(lazy_imported)) if lazy_imported else ''))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
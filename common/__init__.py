@@ -0,0 +1,3 @@
+#Modules shared by the Monochrome and Colour converters: image_io (opening and shrinking images, text output), instrumentation
+#(per-stage spans), archive (the .asca container), output_cache, watcher (watch mode) and service (the batching core of the conversion
+#services). The converters import them as common.<module> (see common/__init__.py in their directories).
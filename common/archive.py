@@ -0,0 +1,146 @@
+import json
+import lzma
+import zlib
+import struct
+import numpy as np
+from common.image_io import is_buffer
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#Container of the compact binary archives of ASCII art (.asca) written by both converters, laid out as
+#    MAGIC | header size (uint32, little-endian) | header (JSON, UTF-8) | chunk 0 | chunk 1 | ...
+#The header holds the format version, width and height (in characters), the symbol table, the compression, the number of rows per
+#chunk, the compressed size of every chunk, and the fields of the converter that wrote it (see archive.py in the Monochrome and
+#Colour directories, which also define what a chunk holds). Each chunk holds rows_per_chunk rows (fewer in the last one) and is
+#compressed on its own, so any range of rows is decoded without reading or decompressing the other chunks.
+MAGIC = b'ASCIIART'
+FORMAT_VERSION = 1
+FILE_EXT = '.asca'
+COMPRESSIONS = ('none', 'zlib', 'lzma', 'zstd')
+DEFAULT_ROWS_PER_CHUNK = 64
+HEADER_SIZE = struct.Struct('<I')
+
+
+def check_compression(compression):
+    if compression not in COMPRESSIONS:
+        raise ValueError('Unknown compression {}. Choose from {}.'.format(compression, COMPRESSIONS))
+    if compression == 'zstd' and zstandard is None:
+        raise ImportError('zstd compression needs the zstandard package (pip install zstandard).')
+
+def _compress(data, compression):
+    if compression == 'zlib':
+        return zlib.compress(data, 9)
+    if compression == 'lzma':
+        return lzma.compress(data)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    return data
+
+def _decompress(data, compression):
+    if compression == 'zlib':
+        return zlib.decompress(data)
+    if compression == 'lzma':
+        return lzma.decompress(data)
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def write_chunks(f, header, payloads, compression='zlib'):
+    '''
+    Purpose: Writes an archive (see the layout above) to the binary file object f.
+    Inputs: header [DICT]: fields of the header (width, height, symbols, rows_per_chunk, render, ...). The format version, the
+                           compression and the chunk sizes are added here.
+            payloads [LIST] of [BYTES]: uncompressed content of every chunk
+            compression [STRING]: 'zlib' (the default), 'lzma' (smaller, slower), 'zstd' (needs the zstandard package) or 'none'
+    Returns: [INT] number of bytes written
+    '''
+    check_compression(compression)
+    chunks = [_compress(payload, compression) for payload in payloads]
+    header = json.dumps(dict({'version': FORMAT_VERSION}, **header, compression=compression, chunk_sizes=[len(chunk) for chunk in chunks])).encode('utf-8')
+    f.write(MAGIC + HEADER_SIZE.pack(len(header)) + header)
+    for chunk in chunks:
+        f.write(chunk)
+    return len(MAGIC) + HEADER_SIZE.size + len(header) + sum(len(chunk) for chunk in chunks)
+
+
+class ArchiveReader(object):
+    def __init__(self, source):
+        '''
+        Purpose: Reads an archive lazily: only the header is read here, and the chunks are read and decompressed when their rows are
+                 asked for. Each converter subclasses it (see archive.py in its directory) with _check_header(), _decode_chunk(),
+                 read_rows() and its renderers.
+        Inputs: source: path of the archive, a bytes-like object containing it, or a binary file object (seekable)
+        '''
+        self.owns_file = not hasattr(source, 'read') and not is_buffer(source)
+        if is_buffer(source):
+            self.data, self.f = memoryview(source), None
+        else:
+            self.data, self.f = None, open(source, 'rb') if self.owns_file else source
+        try:
+            prefix = self._read(0, len(MAGIC)+HEADER_SIZE.size)
+            if prefix[:len(MAGIC)] != MAGIC:
+                raise ValueError('Not an ASCII art archive.')
+            header_size, = HEADER_SIZE.unpack(prefix[len(MAGIC):])
+            self.header = json.loads(bytes(self._read(len(prefix), header_size)))
+            if self.header['version'] > FORMAT_VERSION:
+                raise ValueError('Archive format version {} is newer than this reader ({}).'.format(self.header['version'], FORMAT_VERSION))
+            self._check_header(self.header)
+            check_compression(self.header['compression'])
+        except Exception:
+            self.close()
+            raise
+        self.width = self.header['width']
+        self.height = self.header['height']
+        self.symbols = self.header['symbols']
+        self.rows_per_chunk = self.header['rows_per_chunk']
+        self.chunk_offsets = np.cumsum([len(prefix)+header_size] + self.header['chunk_sizes']).tolist()
+        self.last_chunk = (None, None)
+
+    def _check_header(self, header):
+        #Raises ValueError if the archive was written by the other converter
+        pass
+
+    def _read(self, offset, size):
+        if self.data is not None:
+            return self.data[offset:offset+size]
+        self.f.seek(offset)
+        return self.f.read(size)
+
+    def close(self):
+        if self.owns_file:
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _payload(self, i):
+        #Decompressed content of chunk i
+        return _decompress(bytes(self._read(self.chunk_offsets[i], self.chunk_offsets[i+1]-self.chunk_offsets[i])), self.header['compression'])
+
+    def _decode_chunk(self, i, num_rows):
+        #Decoded rows of chunk i, which has num_rows rows
+        raise NotImplementedError
+
+    def _chunk(self, i):
+        #Decoded rows of chunk i (the last chunk decoded is kept, as consecutive reads often share it)
+        if self.last_chunk[0] != i:
+            self.last_chunk = (i, self._decode_chunk(i, min(self.rows_per_chunk, self.height - i*self.rows_per_chunk)))
+        return self.last_chunk[1]
+
+    def _row_chunks(self, start, stop):
+        '''
+        Purpose: Decodes the chunks that hold rows start to stop (excluded, as in a slice; stop=None reads to the last row).
+        Returns: [TUPLE] (decoded chunks [LIST] (empty if the range is empty), rows [slice] of the range in the concatenated chunks)
+        '''
+        start, stop, _ = slice(start, stop).indices(self.height)
+        stop = max(start, stop)
+        if stop == start:
+            return [], slice(0, 0)
+        first, last = start//self.rows_per_chunk, (stop-1)//self.rows_per_chunk
+        return [self._chunk(i) for i in range(first, last+1)], slice(start-first*self.rows_per_chunk, stop-first*self.rows_per_chunk)
@@ -0,0 +1,188 @@
+import io
+import mmap
+import contextlib
+import numpy as np
+from PIL import Image
+
+
+class BufferReader(io.RawIOBase):
+    '''
+    Purpose: Read-only, seekable file object over a bytes-like object (bytes, bytearray, memoryview, np.ndarray, ...). Reads are
+             served from a memoryview of the buffer, so the buffer itself is never copied (unlike io.BytesIO(memoryview)).
+    '''
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer).cast('B')
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.buffer[self.position:self.position+len(b)]
+        b[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = len(self.buffer) + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+def is_buffer(obj):
+    return isinstance(obj, (bytes, bytearray, memoryview))
+
+@contextlib.contextmanager
+def text_writer(f):
+    '''
+    Purpose: Yields a text file object for f. If f is a binary file object (e.g. io.BytesIO, a socket file), it is wrapped in a
+             UTF-8 io.TextIOWrapper, which is detached again afterwards so that f is left open.
+    '''
+    if isinstance(f, io.TextIOBase) or not isinstance(f, (io.RawIOBase, io.BufferedIOBase)):
+        yield f
+        return
+    wrapper = io.TextIOWrapper(f, encoding='utf-8', write_through=True)
+    try:
+        yield wrapper
+    finally:
+        wrapper.flush()
+        wrapper.detach()
+
+def check_image_array(image):
+    '''
+    Purpose: Raises ValueError unless image is a uint8 array (values 0 to 255). Other dtypes are not rescaled: e.g. a float image in
+             [0, 1] would otherwise come out nearly black.
+    '''
+    if image.dtype != np.uint8:
+        raise ValueError('Expected a uint8 image array (values 0 to 255), got dtype {}. Convert it first, e.g. (image*255).astype(np.uint8) for a float image in [0, 1].'.format(image.dtype))
+
+def open_image(image):
+    '''
+    Purpose: Opens an image given as a path, a binary file object, a bytes-like object (encoded image), a PIL Image or a uint8
+             np.ndarray (see check_image_array()). In-memory images and buffers are not copied.
+    Returns: PIL Image
+    '''
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, np.ndarray):
+        check_image_array(image)
+        return Image.fromarray(np.ascontiguousarray(image))
+    if is_buffer(image):
+        return Image.open(BufferReader(image))
+    return Image.open(image)
+
+def reduce_image(img, mode, size, oversample=2, draft=True):
+    '''
+    Purpose: Cheaply shrinks img towards size before its final resample, so that large images are never fully decoded or held in memory.
+             JPEG images are decoded at a reduced scale (1/2, 1/4 or 1/8, in the DCT domain) by Image.draft(), and the image is then shrunk
+             further by a whole factor with Image.reduce() (box filter). Both steps keep the image at least oversample times larger than
+             size in each dimension, so the final resample still has enough pixels to filter.
+    Inputs: img [PIL.Image]: image that has not been loaded yet (e.g. from Image.open()). Loaded images skip the Image.draft() step.
+            mode [STRING]: mode of the returned image (e.g. 'L' or 'RGB'). JPEG images are decoded straight to this mode.
+            size [TUPLE]: (width, height) of the final image
+            oversample [FLOAT]: minimum ratio between the returned image and size
+            draft [BOOLEAN]: if False, skips Image.draft() (which changes img itself, e.g. for an image owned by the caller)
+    Returns: PIL Image
+    '''
+    min_width = max(1, int(size[0]*oversample))
+    min_height = max(1, int(size[1]*oversample))
+    #Images that cannot be shrunk are decoded (and converted) exactly as they would be without reduce_image()
+    if draft and min(img.width//min_width, img.height//min_height) >= 2:
+        img.draft(mode, (min_width, min_height))
+    if img.mode != mode:
+        img = img.convert(mode)
+    factor = min(img.width//min_width, img.height//min_height)
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img
+
+#Raw modes of uncompressed pixel data that raw_pixel_array() can map: {rawmode: (mode, channels)}
+RAW_MODES = {'L': ('L', 1), 'RGB': ('RGB', 3), 'BGR': ('RGB', 3)}
+DEFAULT_MAX_BAND_BYTES = 64 << 20
+
+def raw_pixel_array(img):
+    '''
+    Purpose: Maps the pixels of an image file that stores them uncompressed (e.g. uncompressed TIFF, PPM/PGM, BMP) with np.memmap, so
+             that any band of rows can be read without decoding (or reading) the rest of the file.
+    Inputs: img [PIL.Image]: image opened from a file path that has not been loaded yet (e.g. from Image.open())
+    Returns: read-only np.memmap view of shape (height, width) for mode 'L' or (height, width, 3) for mode 'RGB', or None if the pixels
+             are compressed, not stored contiguously, in another mode, or img was not opened from a file path
+    '''
+    file_path = getattr(img, 'filename', None)
+    if not file_path or not getattr(img, 'tile', None) or getattr(img, 'n_frames', 1) != 1:
+        return None
+    tile = img.tile[0]
+    args = tile[3] if isinstance(tile[3], tuple) else (tile[3],)
+    rawmode = args[0]
+    stride = args[1] if len(args) > 1 and args[1] else None
+    orientation = args[2] if len(args) > 2 else 1
+    if rawmode not in RAW_MODES or RAW_MODES[rawmode][0] != img.mode or orientation not in (1, -1):
+        return None
+    channels = RAW_MODES[rawmode][1]
+    stride = stride or img.width*channels
+    if orientation == -1 and len(img.tile) > 1:
+        return None
+    #Every tile must be a full-width band of rows, following on from the previous one in the file
+    next_row, next_offset = 0, tile[2]
+    for codec_name, extents, offset, tile_args in img.tile:
+        if codec_name != 'raw' or tile_args != tile[3] or tuple(extents) != (0, next_row, img.width, extents[3]) or offset != next_offset:
+            return None
+        next_row, next_offset = extents[3], offset + (extents[3]-extents[1])*stride
+    if next_row != img.height:
+        return None
+
+    pixels = np.memmap(file_path, dtype=np.uint8, mode='r', offset=tile[2], shape=(img.height, stride))
+    pixels = pixels[:, :img.width*channels]
+    if channels == 3:
+        pixels = pixels.reshape(img.height, img.width, 3)
+    if orientation == -1: #Stored bottom-up (BMP)
+        pixels = pixels[::-1]
+    if rawmode == 'BGR':
+        pixels = pixels[..., ::-1]
+    return pixels
+
+def reduce_striped(pixels, mode, size, oversample=2, max_band_bytes=DEFAULT_MAX_BAND_BYTES):
+    '''
+    Purpose: Gives the same image as reduce_image(Image.fromarray(pixels), mode, size, oversample) (which it replaces for images too
+             large to hold in memory), but reads pixels in horizontal bands: each band is copied, converted to mode and shrunk with
+             Image.reduce() before the next one is read, so that only one band (of at most about max_band_bytes) and the shrunk
+             image are ever in memory. Bands start on multiples of the reduce factor, so the box filter sees the same pixels as it
+             would in the whole image.
+    Inputs: pixels [np.array] or [np.memmap]: uint8 pixels of shape (height, width) or (height, width, 3), e.g. from raw_pixel_array()
+            mode, size, oversample: see reduce_image()
+            max_band_bytes [INT]: memory budget of one band (source pixels and their converted copy)
+    Returns: PIL Image
+    '''
+    height, width = pixels.shape[:2]
+    min_width = max(1, int(size[0]*oversample))
+    min_height = max(1, int(size[1]*oversample))
+    factor = min(width//min_width, height//min_height)
+    if factor < 2:
+        #Nothing to reduce: the image is about as small as its final size
+        return reduce_image(Image.fromarray(np.ascontiguousarray(pixels)), mode, size, oversample, draft=False)
+
+    #Source pixels of a row, their copy in a PIL Image and the converted copy (PIL stores up to 4 bytes per pixel)
+    row_bytes = pixels[0].size + width*4*2
+    band_height = max(1, max_band_bytes//(row_bytes*factor))*factor
+    #Pages of a np.memmap are dropped from memory once their band is shrunk (they stay in the OS file cache), so that they do not
+    #accumulate in the RSS of the process
+    mapping = getattr(pixels, '_mmap', None) if hasattr(mmap, 'MADV_DONTNEED') else None
+    reduced_img = Image.new(mode, ((width+factor-1)//factor, (height+factor-1)//factor))
+    for top in range(0, height, band_height):
+        band = Image.fromarray(np.ascontiguousarray(pixels[top:top+band_height]))
+        if band.mode != mode:
+            band = band.convert(mode)
+        reduced_img.paste(band.reduce(factor), (0, top//factor))
+        del band
+        if mapping is not None:
+            mapping.madvise(mmap.MADV_DONTNEED)
+    return reduced_img
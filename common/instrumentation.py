@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import logging
+import threading
+import tracemalloc
+
+#Sink that receives every span (see set_sink()). None disables instrumentation.
+_sink = None
+
+
+class MemorySink(object):
+    def __init__(self):
+        '''
+        Purpose: Collects every span (a [DICT]) in memory, in self.spans.
+        '''
+        self.spans = []
+
+    def emit(self, record):
+        self.spans.append(record)
+
+    def totals(self):
+        '''
+        Returns: [DICT] of {stage: total duration in seconds}
+        '''
+        totals = {}
+        for record in self.spans:
+            totals[record['stage']] = totals.get(record['stage'], 0) + record['duration']
+        return totals
+
+
+class JSONLinesSink(object):
+    def __init__(self, f):
+        '''
+        Purpose: Writes every span as one line of JSON.
+        Inputs: f [STRING] or [FILE]: path of the file (opened in append mode, so that several processes can write to the same file,
+                                      one whole line at a time) or a text file object
+        '''
+        self.owns_file = isinstance(f, (str, os.PathLike))
+        self.f = open(f, 'a', buffering=1) if self.owns_file else f
+        self.lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self.lock:
+            self.f.write(line)
+
+    def close(self):
+        if self.owns_file:
+            self.f.close()
+
+
+class LoggingSink(object):
+    def __init__(self, logger=None, level=logging.DEBUG):
+        '''
+        Purpose: Logs every span as JSON through the logging module (by default to the 'instrumentation' logger, at DEBUG level).
+        '''
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.level = level
+
+    def emit(self, record):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, '%s', json.dumps(record, default=str))
+
+
+def set_sink(sink):
+    '''
+    Purpose: Sends every span from now on to sink, an object with an emit(record) method (e.g. MemorySink, JSONLinesSink or
+             LoggingSink). None disables instrumentation.
+    Returns: the previous sink
+    '''
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+def get_sink():
+    return _sink
+
+
+class CountingWriter(object):
+    '''
+    Purpose: Wraps a text file object and counts the bytes (UTF-8) written through it.
+    '''
+    def __init__(self, f):
+        self.f = f
+        self.bytes_written = 0
+
+    def write(self, text):
+        self.bytes_written += len(text) if text.isascii() else len(text.encode('utf-8'))
+        return self.f.write(text)
+
+
+class Span(object):
+    enabled = True
+
+    def __init__(self, sink, stage, fields):
+        '''
+        Purpose: Times one stage of the pipeline and sends it to sink as a [DICT] on exit, with the keys stage, start (time.time()),
+                 duration (seconds), pid, every field given to span() or set(), bytes_written (if count_writes() was used),
+                 peak_traced_bytes (only while tracemalloc is tracing; not meaningful for nested spans) and error (the exception type,
+                 if the stage raised one).
+        '''
+        self.sink = sink
+        self.record = dict(stage=stage, **fields)
+        self.writer = None
+
+    def set(self, **fields):
+        self.record.update(fields)
+
+    def count_writes(self, f):
+        '''
+        Purpose: Returns f wrapped in a CountingWriter, so that the bytes written through it are recorded in the span.
+        '''
+        self.writer = CountingWriter(f)
+        return self.writer
+
+    def __enter__(self):
+        self.tracing = tracemalloc.is_tracing()
+        if self.tracing:
+            self.traced_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.record['start'] = time.time()
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.record['duration'] = time.perf_counter() - self.start_time
+        self.record['pid'] = os.getpid()
+        if self.writer is not None:
+            self.record['bytes_written'] = self.writer.bytes_written
+        if self.tracing:
+            self.record['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1] - self.traced_start
+        if exc_type is not None:
+            self.record['error'] = exc_type.__name__
+        self.sink.emit(self.record)
+        return False
+
+
+class _DisabledSpan(object):
+    #Returned by span() while no sink is set: every method is a no-op, so that disabled instrumentation costs one function call
+    enabled = False
+
+    def set(self, **fields):
+        pass
+
+    def count_writes(self, f):
+        return f
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+DISABLED_SPAN = _DisabledSpan()
+
+def span(stage, **fields):
+    '''
+    Purpose: Context manager timing one stage of the pipeline (see Span), e.g.
+                 with span('resize', pixels=width*height) as s:
+                     ...
+                     s.set(cache='hit')
+             Fields should be cheap to compute, as they are evaluated even while instrumentation is disabled (then nothing is recorded).
+    Inputs: stage [STRING]: name of the stage
+            fields: JSON-serialisable values recorded with the span
+    Returns: Span, or DISABLED_SPAN if no sink is set
+    '''
+    sink = _sink
+    if sink is None:
+        return DISABLED_SPAN
+    return Span(sink, stage, fields)
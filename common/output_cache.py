@@ -0,0 +1,191 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+from common.instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 512 << 20
+ENTRY_SUFFIX = '.entry'
+
+
+def hash_file(file_path):
+    '''
+    Purpose: SHA-256 of the content of the file at file_path (read in 1 MB chunks).
+    Returns: [STRING] hex digest
+    '''
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class OutputCache(object):
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, version=1):
+        '''
+        Purpose: Content-addressed cache of converted outputs (.txt/.html documents). Every entry is one file, named after the hash of
+                 the input image's content and every rendering parameter (see key()), so a renamed or copied image is still a hit,
+                 while any change to the image or to a parameter is a miss.
+                 Entries are written to a temporary file and renamed into place, so any number of processes can read and write the
+                 same cache at once: readers never see a partially written entry, and two processes writing the same entry write
+                 the same content. Every hit refreshes the modification time of its entry, and evict() deletes the least recently
+                 used entries once the cache is larger than max_bytes.
+        Inputs: cache_dir [STRING]: directory containing the cache entries (each converter has its own, see DEFAULT_CACHE_DIR in its
+                                    batch.py)
+                max_bytes [INT]: size limit of the cache in bytes (enforced by evict())
+                version [INT]: version of the outputs, part of every key. The converters bump it (CACHE_VERSION in their batch.py)
+                               whenever a change to the converter changes its output, so that entries written by older versions are
+                               never hit.
+        '''
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version = version
+        #Lookups made through this object (in this process)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, input_hash, params):
+        '''
+        Purpose: Cache key of the output of an image with content hash input_hash, converted with params.
+        Inputs: input_hash [STRING]: see hash_file()
+                params [DICT]: every parameter the output depends on (JSON-serialisable; tuples are treated as lists)
+        Returns: [STRING] hex digest
+        '''
+        data = json.dumps({'version': self.version, 'input': input_hash, 'params': params}, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key+ENTRY_SUFFIX)
+
+    def get(self, key):
+        '''
+        Purpose: Looks up the outputs stored under key, and marks the entry as recently used.
+        Returns: [DICT] of {output name: [STRING]} (e.g. {'txt': ..., 'html': ...}), or None on a miss
+        '''
+        outputs = self._read(key)
+        if outputs is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return outputs
+
+    def get_all(self, keys):
+        '''
+        Purpose: Looks up the outputs stored under every key in keys, which are only of use together (e.g. every output of one job),
+                 and stops at the first miss. Counts as one hit or one miss.
+        Returns: [LIST] of outputs (see get()), in the order of keys, or None if any of them is missing
+        '''
+        all_outputs = []
+        for key in keys:
+            outputs = self._read(key)
+            if outputs is None:
+                self.misses += 1
+                return None
+            all_outputs.append(outputs)
+        self.hits += 1
+        return all_outputs
+
+    def _read(self, key):
+        #Outputs stored under key (see get()), without counting the lookup
+        entry_path = self._entry_path(key)
+        with span('cache_lookup', key=key[:16]) as lookup_span:
+            try:
+                with open(entry_path, 'rb') as f:
+                    data = f.read()
+                os.utime(entry_path)
+            except OSError:
+                #Missing, or deleted by evict() in another process since it was opened
+                lookup_span.set(cache='miss')
+                return None
+            header, _, body = data.partition(b'\n')
+            outputs = {}
+            offset = 0
+            for name, num_bytes in json.loads(header)['outputs']:
+                outputs[name] = body[offset:offset+num_bytes].decode('utf-8')
+                offset += num_bytes
+            lookup_span.set(cache='hit', bytes_read=len(data))
+        return outputs
+
+    def put(self, key, outputs):
+        '''
+        Purpose: Stores outputs ([DICT] of {output name: [STRING]}) under key. The entry is one file: a JSON header line listing the
+                 name and size of every output, followed by the outputs (UTF-8).
+        '''
+        encoded = [(name, text.encode('utf-8')) for name, text in outputs.items()]
+        header = json.dumps({'outputs': [(name, len(data)) for name, data in encoded]}).encode('utf-8')
+        entry_path = self._entry_path(key)
+        with span('cache_store', key=key[:16]) as store_span:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path), prefix='.tmp_')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(header+b'\n')
+                    for _, data in encoded:
+                        f.write(data)
+                os.replace(tmp_path, entry_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            store_span.set(bytes_written=len(header)+1+sum(len(data) for _, data in encoded))
+
+    def _entries(self):
+        #[LIST] of (modification time, size, path) of every entry
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(ENTRY_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        '''
+        Returns: [TUPLE] (number of entries, total size in bytes)
+        '''
+        entries = self._entries()
+        return len(entries), sum(size for _, size, _ in entries)
+
+    def evict(self):
+        '''
+        Purpose: Deletes the least recently used entries until the cache is no larger than self.max_bytes. Entries already deleted
+                 by another process are skipped.
+        Returns: [INT] number of entries deleted
+        '''
+        with span('cache_evict') as evict_span:
+            entries = self._entries()
+            total_bytes = sum(size for _, size, _ in entries)
+            num_deleted = 0
+            for _, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    num_deleted += 1
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+            evict_span.set(entries=len(entries)-num_deleted, deleted=num_deleted, cache_bytes=total_bytes)
+        if num_deleted:
+            logger.info('Evicted %d least recently used output(s) from %s', num_deleted, self.cache_dir)
+        return num_deleted
+
+    def clear(self):
+        '''
+        Purpose: Deletes every entry.
+        '''
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
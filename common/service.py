@@ -0,0 +1,228 @@
+import os
+import time
+import asyncio
+import logging
+import collections
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from common.instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceOverloaded(RuntimeError):
+    '''
+    Purpose: Raised by BatchingService.submit() (and so by the convert() of each converter's ConversionService) when the request queue
+             is full and the service rejects new requests rather than making them wait (reject_when_full=True).
+    '''
+
+
+def _input_size(image):
+    #Approximate size of a request in bytes, used to keep micro-batches of large images small
+    if isinstance(image, (bytes, bytearray)):
+        return len(image)
+    if isinstance(image, np.ndarray):
+        return image.nbytes
+    try:
+        return os.path.getsize(image)
+    except (TypeError, OSError):
+        return 0
+
+
+_Request = collections.namedtuple('_Request', ['key', 'args', 'image', 'size', 'future', 'queued_time'])
+
+
+class BatchingService(object):
+    def __init__(self, worker, workers=None, max_queue=256, max_batch=16, max_batch_bytes=1 << 20, batch_window=0.002, timeout=30.0, reject_when_full=False, executor=None):
+        '''
+        Purpose: asyncio front-end that runs conversions in a pool of worker processes, so that the event loop (e.g. of an HTTP server)
+                 is never blocked by a conversion. Requests wait in a bounded queue. Whenever a worker is free, the oldest queued
+                 request is sent to it together with the other queued requests that have the same key (a micro-batch), so they share
+                 one round trip to the pool. Under load, requests queue up while every worker is busy, and batches grow with the load.
+                 Each converter subclasses it as ConversionService (see service.py in the Monochrome and Colour directories), whose
+                 convert() turns its settings into a key and the arguments of worker, and calls submit().
+        Inputs: worker [FUNCTION]: converts a micro-batch in a worker process. It is called as worker(*args, images), where args are the
+                                   arguments given to submit() by the first request of the batch and images is the list of the images
+                                   of every request, and returns a list of (output, None) or (None, exception), in the same order as
+                                   images. It is sent to the worker processes, so it must be a module-level function.
+                workers [INT]: number of worker processes (and of batches converted at once). If None, uses the number of CPUs.
+                max_queue [INT]: size of the request queue. When it is full, submit() waits for a free place (backpressure, within
+                                 its timeout), or raises ServiceOverloaded if reject_when_full is True. Up to max_queue more requests
+                                 may be held while batches are formed.
+                max_batch [INT]: maximum number of requests per batch (1 disables batching)
+                max_batch_bytes [INT]: a batch takes no more requests once its inputs (encoded bytes, array or file size) reach this
+                                       size, so that large images are converted alone
+                batch_window [FLOAT]: seconds to wait for more requests before sending a batch to an idle worker (0 sends at once)
+                timeout [FLOAT]: default timeout of each request in seconds, from the call to submit() (None waits forever)
+                reject_when_full [BOOLEAN]: see max_queue
+                executor [Executor]: executor to run the batches in, instead of a ProcessPoolExecutor owned by the service (it is
+                                     then not shut down by close())
+        '''
+        self.worker = worker
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.max_batch_bytes = max_batch_bytes
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self.reject_when_full = reject_when_full
+        self.executor = executor
+        self.owns_executor = executor is None
+        self.dispatcher = None
+
+    async def start(self):
+        '''
+        Purpose: Starts the worker pool and the dispatcher task. Must be called from the event loop that will call submit().
+        '''
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.max_queue)
+        #Requests taken off the queue but not yet batched: {key: deque of _Request}, the oldest group first
+        self.pending = collections.OrderedDict()
+        self.num_pending = 0
+        self.batches = set()
+        self.free_workers = asyncio.Semaphore(self.workers)
+        if self.owns_executor:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.dispatcher = asyncio.create_task(self._dispatch())
+        return self
+
+    async def close(self):
+        '''
+        Purpose: Stops the service. Requests that are still queued or being converted are cancelled.
+        '''
+        if self.dispatcher is None:
+            return
+        self.dispatcher.cancel()
+        for task in list(self.batches):
+            task.cancel()
+        await asyncio.gather(self.dispatcher, *self.batches, return_exceptions=True)
+        while not self.queue.empty():
+            self.queue.get_nowait().future.cancel()
+        for requests in self.pending.values():
+            for request in requests:
+                request.future.cancel()
+        self.pending.clear()
+        if self.owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.dispatcher = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def submit(self, key, args, image, timeout=None):
+        '''
+        Purpose: Converts image in a worker process, in a micro-batch with the other queued requests that have the same key.
+        Inputs: key [STRING]: requests are batched together only if their keys are equal, so it must determine args
+                args [TUPLE]: arguments of the worker function before the list of images (see __init__)
+                image: the input of the request. It is sent to a worker process, so it must be picklable.
+                timeout [FLOAT]: seconds before the request fails with TimeoutError, including the time spent waiting in the
+                                 queue. Defaults to the timeout of the service. A request whose batch is already being converted
+                                 cannot stop its worker, so the worker finishes the batch and the output is discarded.
+        Returns: the output of the worker for image
+        Raises: TimeoutError, ServiceOverloaded, or the exception raised by the conversion. Cancelling the calling task cancels the
+                request (it is then dropped from its batch if the batch has not been sent to a worker yet).
+        '''
+        if self.dispatcher is None:
+            raise RuntimeError('The service is not running. Call start() (or use "async with") first.')
+        if isinstance(image, memoryview):
+            image = image.tobytes()
+        future = self.loop.create_future()
+        request = _Request(key, args, image, _input_size(image), future, time.perf_counter())
+
+        async def enqueue():
+            if not self.reject_when_full:
+                await self.queue.put(request)
+            else:
+                try:
+                    self.queue.put_nowait(request)
+                except asyncio.QueueFull:
+                    raise ServiceOverloaded('The request queue is full ({} requests).'.format(self.max_queue)) from None
+            return await future
+        try:
+            return await asyncio.wait_for(enqueue(), self.timeout if timeout is None else timeout)
+        finally:
+            #Marks timed out and cancelled requests, so that they are skipped when batches are formed
+            future.cancel()
+
+    async def _dispatch(self):
+        while True:
+            #Waits for a free worker, then for a request (requests keep queuing up while every worker is busy)
+            await self.free_workers.acquire()
+            if not self.num_pending:
+                self._add_pending(await self.queue.get())
+                if self.batch_window:
+                    await asyncio.sleep(self.batch_window)
+            while self.num_pending < self.max_queue and not self.queue.empty():
+                self._add_pending(self.queue.get_nowait())
+            batch = self._next_batch()
+            if not batch:
+                self.free_workers.release()
+                continue
+            task = asyncio.create_task(self._run_batch(batch))
+            self.batches.add(task)
+            task.add_done_callback(self.batches.discard)
+
+    def _add_pending(self, request):
+        self.pending.setdefault(request.key, collections.deque()).append(request)
+        self.num_pending += 1
+
+    def _next_batch(self):
+        '''
+        Purpose: Takes the next micro-batch off self.pending: queued requests with the same key as the oldest one, skipping
+                 cancelled requests. Groups with requests left over are moved behind the other groups.
+        Returns: [LIST] of _Request (empty if every pending request was cancelled)
+        '''
+        batch = []
+        batch_bytes = 0
+        while self.pending and not batch:
+            key, requests = next(iter(self.pending.items()))
+            while requests and len(batch) < self.max_batch and (not batch or batch_bytes+requests[0].size <= self.max_batch_bytes):
+                request = requests.popleft()
+                self.num_pending -= 1
+                if not request.future.done():
+                    batch.append(request)
+                    batch_bytes += request.size
+            if requests:
+                self.pending.move_to_end(key)
+            else:
+                del self.pending[key]
+        return batch
+
+    async def _run_batch(self, batch):
+        try:
+            with span('service_batch', requests=len(batch), input_bytes=sum(request.size for request in batch), queue_wait=time.perf_counter()-batch[0].queued_time) as batch_span:
+                work = self.executor.submit(self.worker, *batch[0].args, [request.image for request in batch])
+
+                def cancel_if_abandoned(_):
+                    #The batch is not converted at all if every request is cancelled before a worker picks it up
+                    if all(request.future.done() for request in batch):
+                        work.cancel()
+                for request in batch:
+                    request.future.add_done_callback(cancel_if_abandoned)
+                try:
+                    results = await asyncio.wrap_future(work)
+                except asyncio.CancelledError:
+                    if work.cancelled():
+                        batch_span.set(cancelled=True)
+                        return
+                    raise
+        except asyncio.CancelledError:
+            #The service is closing
+            for request in batch:
+                request.future.cancel()
+            raise
+        except Exception as e:
+            logger.exception('Batch of %d request(s) failed', len(batch))
+            results = [(None, e)]*len(batch)
+        finally:
+            self.free_workers.release()
+        for request, (output, error) in zip(batch, results):
+            if request.future.done():
+                continue
+            if error is not None:
+                request.future.set_exception(error)
+            else:
+                request.future.set_result(output)
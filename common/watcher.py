@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+from common.output_cache import hash_file
+from common.instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+#Bumped whenever the layout of the manifest changes, so that older manifests are rebuilt instead of misread
+MANIFEST_VERSION = 2
+#A directory modified this recently may be modified again within the same timestamp tick without its mtime changing, so its mtime
+#is only trusted once it is older than this (as git does for "racily clean" index entries)
+RACY_SECONDS = 2.0
+
+
+def _atomic_write_json(data, file_path):
+    #Writes data to a temporary file next to file_path and renames it into place, so a crash never leaves a partial manifest
+    dir_path = os.path.dirname(os.path.abspath(file_path))
+    os.makedirs(dir_path, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix='.tmp_', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class DirectoryWatcher(object):
+    def __init__(self, dir_path, manifest_path, file_ext=None, settle_time=2.0, settings=None):
+        '''
+        Purpose: Finds the images added to, changed in or deleted from dir_path since the last scan, with a persistent manifest of
+                 (name, mtime, size, inode, SHA-256 hash, output paths) of every image converted so far, so that only new and
+                 changed images are converted again, even across restarts.
+                 The cost of a scan grows with the number of changes, not with the size of the directory: if the mtime of the
+                 directory has not changed (no file was added, deleted or renamed), only the files waiting to settle are looked
+                 at; otherwise the directory is listed (names and inodes, without a stat() per file) and only the new names, and
+                 the names whose inode changed, are looked at. The inode changes when a file is replaced by a rename (as done by
+                 tools that write atomically: a temporary file moved onto the name), which also changes the mtime of the directory.
+                 Files are only hashed when their mtime, size or inode changed, and a file whose content is unchanged (e.g.
+                 touched) is not converted again. A file overwritten in place keeps its inode and does not change the mtime of the
+                 directory, so it is only found by a full scan (scan(full=True)), which looks at every file.
+                 A new or changed file is only ready once it is settled, i.e. when its mtime, size and inode are the same as at
+                 the previous scan and it has not been modified for settle_time seconds, so that files that are still being written
+                 (copied, uploaded) are not converted half-written.
+        Inputs: dir_path [STRING]: directory to watch (not recursively)
+                manifest_path [STRING]: JSON file holding the manifest (created if missing)
+                file_ext [STRING]: only files with this extension are watched (e.g. '.jpg'). If None, every file is.
+                settle_time [FLOAT]: seconds without modification before a file is ready
+                settings [DICT]: settings the outputs depend on. If they differ from the settings of the manifest, every file is
+                                 converted again.
+        '''
+        self.dir_path = dir_path
+        self.manifest_path = manifest_path
+        self.file_ext = file_ext
+        self.settle_time = settle_time
+        self.settings_hash = hashlib.sha256(json.dumps(settings or {}, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        self._load()
+
+    def _load(self):
+        #self.files: {name: {'mtime_ns', 'size', 'inode', 'hash', 'outputs', 'failed'}} of every converted file
+        #self.pending: {name: [mtime_ns, size, inode]} of the new and changed files seen at the last scan, which are not settled yet
+        data = {}
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') != MANIFEST_VERSION or data.get('settings') != self.settings_hash:
+                logger.info('The settings (or the manifest version) changed since %s was written, so every file will be converted again.', self.manifest_path)
+                data = {}
+        self.files = data.get('files', {})
+        self.pending = data.get('pending', {})
+        #self.in_flight: {name: entry} of the files returned by scan() but not record()ed yet. They are only added to self.files (and so
+        #to the saved manifest) by record(), so that files whose conversion was interrupted are converted again after a restart.
+        self.in_flight = {}
+        self.dir_mtime_ns = data.get('dir_mtime_ns')
+        #True once the manifest differs from the file, so that idle scans do not rewrite it
+        self.changed = not data
+
+    def save(self):
+        '''
+        Purpose: Writes the manifest, if it changed since it was last written or read.
+        '''
+        if not self.changed:
+            return
+        self.changed = False
+        _atomic_write_json({'version': MANIFEST_VERSION, 'settings': self.settings_hash, 'dir_mtime_ns': self.dir_mtime_ns,
+                            'files': self.files, 'pending': self.pending}, self.manifest_path)
+
+    def _list(self):
+        #{name: inode} of the watched files in the directory (os.scandir() gets the type and inode of every entry without a stat() on
+        #POSIX systems)
+        return {entry.name: entry.inode() for entry in os.scandir(self.dir_path)
+                if (self.file_ext is None or entry.name.endswith(self.file_ext)) and entry.is_file()}
+
+    def scan(self, full=False):
+        '''
+        Purpose: Looks for changes since the previous scan (see __init__()). Deleted files are removed from the manifest.
+        Inputs: full [BOOLEAN]: if True, every file is looked at (also finds files overwritten in place)
+        Returns: [TUPLE] (ready [LIST] of paths of the new and changed files that are settled, to be converted and then passed to
+                          record(); deleted [LIST] of [LISTS] of the output paths of every deleted file, to be removed)
+        '''
+        with span('watch_scan', full=full) as scan_span:
+            now = time.time()
+            dir_mtime_ns = os.stat(self.dir_path).st_mtime_ns
+            candidates = set(self.pending)
+            deleted = []
+            listed = full or dir_mtime_ns != self.dir_mtime_ns or now - dir_mtime_ns/1e9 < RACY_SECONDS
+            if listed:
+                inodes = self._list()
+                names = set(inodes)
+                num_known = len(self.files) + len(self.pending)
+                for name in set(self.files) - names:
+                    deleted.append(self.files.pop(name)['outputs'])
+                for name in set(self.pending) - names:
+                    del self.pending[name]
+                candidates &= names
+                candidates |= {name for name, inode in inodes.items() if full or self.files.get(name, {}).get('inode') != inode} - set(self.in_flight)
+                self.changed |= dir_mtime_ns != self.dir_mtime_ns or len(self.files) + len(self.pending) != num_known
+                self.dir_mtime_ns = dir_mtime_ns
+
+            ready = []
+            num_hashed = 0
+            for name in sorted(candidates):
+                path = os.path.join(self.dir_path, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    #Deleted since the directory was listed: found by the next listing
+                    self.changed |= self.pending.pop(name, None) is not None
+                    continue
+                signature = [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+                entry = self.files.get(name)
+                if entry is not None and [entry['mtime_ns'], entry['size'], entry['inode']] == signature:
+                    self.changed |= self.pending.pop(name, None) is not None
+                    continue
+                if self.pending.get(name) != signature or now - stat.st_mtime_ns/1e9 < self.settle_time:
+                    self.changed |= self.pending.get(name) != signature
+                    self.pending[name] = signature
+                    continue
+                del self.pending[name]
+                self.changed = True
+                content_hash = hash_file(path)
+                num_hashed += 1
+                if entry is not None and entry['hash'] == content_hash:
+                    #Touched, or rewritten (or replaced) with the same content
+                    entry['mtime_ns'], entry['size'], entry['inode'] = signature
+                    continue
+                self.in_flight[name] = {'mtime_ns': signature[0], 'size': signature[1], 'inode': signature[2], 'hash': content_hash,
+                                        'outputs': entry['outputs'] if entry is not None else [], 'failed': False}
+                ready.append(path)
+            scan_span.set(listed=listed, looked_at=len(candidates), hashed=num_hashed, ready=len(ready), deleted=len(deleted), pending=len(self.pending))
+        return ready, deleted
+
+    def record(self, path, outputs, failed=False):
+        '''
+        Purpose: Records the outputs of a file returned by scan(), once it has been converted. Only then is the file added to the
+                 manifest: a file that is never recorded (e.g. the watch was interrupted) is converted again by the next scan of
+                 the next run. A failed file is not converted again until it changes.
+        Inputs: outputs [LIST] of [STRINGS]: paths of the outputs of the file (removed when the file is deleted)
+        '''
+        name = os.path.basename(path)
+        entry = self.in_flight.pop(name, None)
+        if entry is not None:
+            self.changed = True
+            entry['outputs'] = sorted(set(entry['outputs']) | set(outputs))
+            entry['failed'] = failed
+            self.files[name] = entry
+
+
+def remove_outputs(output_paths):
+    '''
+    Purpose: Deletes the outputs of a deleted image (outputs that are already gone are skipped).
+    Returns: [INT] number of files deleted
+    '''
+    num_removed = 0
+    for output_path in output_paths:
+        try:
+            os.remove(output_path)
+            num_removed += 1
+        except FileNotFoundError:
+            pass
+    return num_removed